@@ -7,170 +7,353 @@ be created in the geopackage to connect the different tables in the geopackage
 if it does not yet exist in the geopackage file.
 """
 # import packages
+import os
 import sys
 import logging
+import struct
+import threading
+import hashlib
+import zipfile
+from functools import lru_cache
+from collections import OrderedDict
+from urllib.request import pathname2url
 from os.path import exists, join, dirname
 import sqlite3
-import geopandas as gpd
-from shapely.ops import transform
+import numpy as np
+import shapely
+from shapely.ops import transform, unary_union
 import pandas as pd
 import pyproj
 from rtree import index
-from shapely.geometry import shape, Point
+from shapely.geometry import shape, Point, box
+from CPTtool import cpt_store
+from CPTtool import cpt_cache
 
 req_columns = ["penetrationLength", "coneResistance", "localFriction", "frictionRatio"]
-columns_gpkg = ['penetrationLength', 'depth', 'elapsed_time', 'coneResistance',
-                'corrected_cone_resistance',
-                'net_cone_resistance', 'magnetic_field_strength_x', 'magnetic_field_strength_y',
-                'magnetic_field_strength_z',
-                'magnetic_field_strength_total', 'electrical_conductivity', 'inclination_ew',
-                'inclination_ns',
-                'inclination_x', 'inclination_y', 'inclinationResultant',
-                'magnetic_inclination',
-                'magnetic_declination', 'localFriction',
-                'pore_ratio', 'temperature', "porePressureU1", "porePressureU2", "porePressureU3",
-                'frictionRatio', 'id', 'location_x', 'location_y', 'offset_z',
-                'vertical_datum', 'local_reference', 'quality_class',
-                'cpt_standard', 'research_report_date', 'predrilled_z']
-float_columns = ['penetrationLength', 'depth', 'elapsed_time', 'coneResistance',
-                'corrected_cone_resistance',
-                'net_cone_resistance', 'magnetic_field_strength_x', 'magnetic_field_strength_y',
-                'magnetic_field_strength_z',
-                'magnetic_field_strength_total', 'electrical_conductivity', 'inclination_ew',
-                'inclination_ns',
-                'inclination_x', 'inclination_y', 'inclinationResultant',
-                'magnetic_inclination',
-                'magnetic_declination', 'localFriction',
-                'pore_ratio', 'temperature', "porePressureU1", "porePressureU2", "porePressureU3",
-                'frictionRatio', 'predrilled_z', 'offset_z']
-
-
-
-def query_equals_according_to_length(keys):
-    """
-    Function that returns equals search query for geodatabase
-    :param keys:
-    :return:
-    """
-    if len(keys) == 1:
-        if isinstance(keys[0], str):
-            return f" = '{keys[0]}' "
-        else:
-            return f" = {keys[0]} "
-    else:
-        return " IN " + f"{tuple(keys)}"
+# measurement columns that are used for the processing: name in the cpt dataframe and column in the geopackage
+processing_columns = {'penetrationLength': 'penetration_length',
+                      'depth': 'depth',
+                      'coneResistance': 'cone_resistance',
+                      'localFriction': 'local_friction',
+                      'frictionRatio': 'friction_ratio',
+                      'porePressureU1': 'pore_pressure_u1',
+                      'porePressureU2': 'pore_pressure_u2',
+                      'porePressureU3': 'pore_pressure_u3',
+                      'inclinationResultant': 'inclination_resultant'}
+# measurement columns that are not used for the processing: only their missing values are read
+other_measurement_columns = ['elapsed_time', 'corrected_cone_resistance', 'net_cone_resistance',
+                             'magnetic_field_strength_x', 'magnetic_field_strength_y', 'magnetic_field_strength_z',
+                             'magnetic_field_strength_total', 'electrical_conductivity', 'inclination_ew',
+                             'inclination_ns', 'inclination_x', 'inclination_y', 'magnetic_inclination',
+                             'magnetic_declination', 'pore_ratio', 'temperature']
+# size of the envelope in the geopackage geometry header, per envelope contents indicator
+envelope_size = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+# spatial layer (table, geometry column, crs) of the geopackages: found once per geopackage
+spatial_layers = {}
+# rtree indexes of the buffered track: opened once per process
+track_indexes = {}
+track_lock = threading.Lock()
+# sqlite connections to the geopackages: one per thread
+thread_connections = threading.local()
+# sidecar index databases of the geopackages (None if the indexes are in the geopackage): prepared once per process
+gpkg_sidecars = {}
+gpkg_lock = threading.Lock()
+# geomorphological polygons: loaded once per process
+geomorph_caches = {}
+geomorph_lock = threading.Lock()
+# tile caches of the cpts of the geopackages: one per process
+tile_caches = {}
+tile_lock = threading.Lock()
+# version of the geomorphological cache. changing it rebuilds the caches
+GEOMORPH_CACHE_VERSION = 2
+# pragmas of the (read-only) connections to the geopackages
+gpkg_pragmas = ["PRAGMA mmap_size = 1073741824",
+                "PRAGMA cache_size = -65536",
+                "PRAGMA temp_store = MEMORY"]
+
 
 
-def construct_query(cpt_keys):
+def read_only_uri(fn, immutable=True):
     """
-    Function that creates query to retrieve all data from cone_penetration_test_result,
-    cpt_cone_penetrometer_survey and cpt_geotechnical_survey tables
-    :param cpt_keys: List of ids of the cpts
-    :return: str
+    Function that returns the uri to open a database read-only
+
+    :param fn: database file location
+    :param immutable: (optional) the database does not change while it is open: no locking. Default is True
+    :return: uri
+    """
+    uri = "file:{}?mode=ro".format(pathname2url(os.path.abspath(fn)))
+    if immutable:
+        uri += "&immutable=1"
+    return uri
+
+
+def gpkg_connection(fn):
+    """
+    Function that returns the sqlite connection to the geopackage.
+    The connection is opened once per thread (and process), so that the prepared queries are reused.
+    The geopackage is opened read-only. The sidecar index database is attached as "sidecar" (see prepare_gpkg).
+
+    :param fn: geopackage file location
+    :return: sqlite connection
+    """
+    connections = getattr(thread_connections, "connections", None)
+    if connections is None or thread_connections.pid != os.getpid():
+        connections = thread_connections.connections = {}
+        thread_connections.pid = os.getpid()
+    if fn not in connections:
+        sidecar = prepare_gpkg(fn)
+        conn = sqlite3.connect(read_only_uri(fn), uri=True)
+        for pragma in gpkg_pragmas:
+            conn.execute(pragma)
+        if sidecar is not None:
+            conn.execute("ATTACH DATABASE ? AS sidecar", (read_only_uri(sidecar), ))
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS selected_keys (key PRIMARY KEY)")
+        connections[fn] = conn
+    return connections[fn]
+
+
+def select_keys(cursor, keys):
+    """
+    Function that stores the keys of a bulk lookup in the temporary table selected_keys
+
+    :param cursor: sqlite cursor of the geopackage
+    :param keys: list of keys
+    :return: None
     """
+    cursor.execute("DELETE FROM temp.selected_keys")
+    cursor.executemany("INSERT OR IGNORE INTO temp.selected_keys (key) VALUES (?)", [(key, ) for key in keys])
+    # end the (temporary table) transaction: the geopackage itself is not locked
+    cursor.connection.commit()
 
-    selected_columns = "SELECT distinct cone_penetration_test_result.penetration_length,\
-                               cone_penetration_test_result.depth,\
-                               cone_penetration_test_result.elapsed_time,\
-                               cone_penetration_test_result.cone_resistance,\
-                               cone_penetration_test_result.corrected_cone_resistance,\
-                               cone_penetration_test_result.net_cone_resistance,\
-                               cone_penetration_test_result.magnetic_field_strength_x,\
-                               cone_penetration_test_result.magnetic_field_strength_y,\
-                               cone_penetration_test_result.magnetic_field_strength_z,\
-                               cone_penetration_test_result.magnetic_field_strength_total,\
-                               cone_penetration_test_result.electrical_conductivity,\
-                               cone_penetration_test_result.inclination_ew,\
-                               cone_penetration_test_result.inclination_ns,\
-                               cone_penetration_test_result.inclination_x,\
-                               cone_penetration_test_result.inclination_y,\
-                               cone_penetration_test_result.inclination_resultant,\
-                               cone_penetration_test_result.magnetic_inclination,\
-                               cone_penetration_test_result.magnetic_declination,\
-                               cone_penetration_test_result.local_friction,\
-                               cone_penetration_test_result.pore_ratio,\
-                               cone_penetration_test_result.temperature,\
-                               cone_penetration_test_result.pore_pressure_u1,\
-                               cone_penetration_test_result.pore_pressure_u2,\
-                               cone_penetration_test_result.pore_pressure_u3,\
-                               cone_penetration_test_result.friction_ratio,\
-                               geotechnical_cpt_survey.bro_id,\
-                               bro_point.x_or_lon,\
-                               bro_point.y_or_lat,\
-                               delivered_vertical_position.offset,\
-                               delivered_vertical_position.vertical_datum,\
-                               delivered_vertical_position.local_vertical_reference_point,\
-                               geotechnical_cpt_survey.quality_regime,\
-                               geotechnical_cpt_survey.cpt_standard,\
-                               geotechnical_cpt_survey.research_report_date,\
-                               trajectory.predrilled_depth \
-               FROM geotechnical_cpt_survey \
-                   join cone_penetration_test_result on cone_penetration_test_result.cone_penetration_test_fk = geotechnical_cpt_survey.geotechnical_cpt_survey_pk \
-                   join delivered_vertical_position on delivered_vertical_position.geotechnical_cpt_survey_fk = geotechnical_cpt_survey.geotechnical_cpt_survey_pk \
-                   join bro_point on bro_point.bro_location_fk = geotechnical_cpt_survey.geotechnical_cpt_survey_pk \
-                   join trajectory on trajectory.cone_penetrometer_survey_fk = geotechnical_cpt_survey.geotechnical_cpt_survey_pk "
-    where_clause = f"WHERE geotechnical_cpt_survey.geotechnical_cpt_survey_pk "
-    if len(cpt_keys) >= 8:
-        in_clause = query_equals_according_to_length(cpt_keys)
-        return selected_columns + where_clause + in_clause
+
+def construct_query_processing(sidecar=False):
+    """
+    Function that creates query to retrieve the measurements used for the processing from
+    cone_penetration_test_result for the ids of the cpts in the temporary table selected_keys.
+    Only the columns used for the processing are read. For the other measurement columns a bit mask of the
+    missing values is read, so that the incomplete rows can be removed.
+    The measurements are distinct per cpt on the columns that are read and the bit mask.
+    :param sidecar: (optional) use the sidecar index database. Default is False
+    :return: str
+    """
+    null_mask = " | ".join("((cone_penetration_test_result.{} IS NULL) << {})".format(column, i)
+                           for i, column in enumerate(other_measurement_columns))
+    measurement_columns = ["cone_penetration_test_result." + column for column in processing_columns.values()]
+    if sidecar:
+        rows = "FROM sidecar.cone_penetration_test_result_rows \
+                    join cone_penetration_test_result on cone_penetration_test_result.rowid = sidecar.cone_penetration_test_result_rows.row \
+                WHERE sidecar.cone_penetration_test_result_rows.cone_penetration_test_fk IN (SELECT key FROM temp.selected_keys)"
     else:
-        return [selected_columns + where_clause + f" = {int(i)} " for i in cpt_keys]
+        rows = "FROM cone_penetration_test_result \
+                WHERE cone_penetration_test_result.cone_penetration_test_fk IN (SELECT key FROM temp.selected_keys)"
+    return "SELECT DISTINCT cone_penetration_test_result.cone_penetration_test_fk, {}, {} {}".format(
+        ", ".join(measurement_columns), null_mask, rows)
+
+
+def construct_query_metadata():
+    """
+    Function that creates query to retrieve the metadata of the cpts in the temporary table selected_keys.
+    The metadata is unique per cpt: one row per cpt
+    :return: str
+    """
+    return "SELECT geotechnical_cpt_survey.geotechnical_cpt_survey_pk,\
+                   geotechnical_cpt_survey.bro_id,\
+                   bro_point.x_or_lon,\
+                   bro_point.y_or_lat,\
+                   delivered_vertical_position.offset,\
+                   delivered_vertical_position.vertical_datum,\
+                   delivered_vertical_position.local_vertical_reference_point,\
+                   geotechnical_cpt_survey.quality_regime,\
+                   geotechnical_cpt_survey.cpt_standard,\
+                   trajectory.predrilled_depth \
+                FROM geotechnical_cpt_survey \
+                    join delivered_vertical_position on delivered_vertical_position.geotechnical_cpt_survey_fk = geotechnical_cpt_survey.geotechnical_cpt_survey_pk \
+                    join bro_point on bro_point.bro_location_fk = geotechnical_cpt_survey.geotechnical_cpt_survey_pk \
+                    join trajectory on trajectory.cone_penetrometer_survey_fk = geotechnical_cpt_survey.geotechnical_cpt_survey_pk \
+                WHERE geotechnical_cpt_survey.geotechnical_cpt_survey_pk IN (SELECT key FROM temp.selected_keys)"
 
 
-def construct_query_cone_surface_quotient(cpt_keys):
+def construct_query_cone_surface_quotient():
     """
     Function that returns query for retrieving the cone_surface_quotient from the cpt_cone_penetrometer table
-    :param cpt_keys: List of ids of the cpts
+    for the ids of the cpts in the temporary table selected_keys
     :return: str
     """
-    return f"select bro_id, cone_surface_quotient  \
+    return "select bro_id, cone_surface_quotient  \
                 FROM geotechnical_cpt_survey \
                 join cone_penetrometer on cone_penetrometer.cone_penetrometer_survey_fk = geotechnical_cpt_survey.geotechnical_cpt_survey_pk  \
-                WHERE cone_penetrometer.cone_penetrometer_survey_fk " + query_equals_according_to_length(cpt_keys)
+                WHERE cone_penetrometer.cone_penetrometer_survey_fk IN (SELECT key FROM temp.selected_keys)"
 
 
-def change_to_floats(data):
+def track_index(file_track):
     """
-    Function that changes all data to floats
-    :param data: pandas dataframe
-    :return: pandas dataframe
+    Function that returns the rtree index of the buffered track geometry. The index is opened once per process.
+
+    :param file_track: rtree index file location
+    :return: rtree index
     """
-    data[float_columns] = data[float_columns].apply(pd.to_numeric)
-    return data
+    with track_lock:
+        if file_track not in track_indexes:
+            track_indexes[file_track] = index.Index(file_track, interleaved=True)
+    return track_indexes[file_track]
 
 
-def determine_if_all_data_is_available(data):
+def inside_track(file_track, xs, ys):
     """
-    Determine if all data is available in dataframe
-    :param data: pandas dataframe
-    :return: boolean if all data is available
+    Check which CPTs are inside the buffered track geometry
+
+    :param file_track: rtree index file location
+    :param xs: x coordinates of the cpts
+    :param ys: y coordinates of the cpts
+    :return: boolean array if cpt is inside buffered track
     """
-    avail_columns = data.get("dataframe").columns
-    data_excluding_dataframe = {x: data[x] for x in data if x not in {"dataframe", "a"}}
-    meta_usable = all([x is not None for x in data_excluding_dataframe.values()])
-    data_column_usable = all([col in avail_columns for col in req_columns])
-    data_usable = all([not data["dataframe"][k].isnull().values.all() for k in req_columns])
-    if not (meta_usable and data_usable and data_column_usable):
-        logging.warning("CPT with id {} misses required data.".format(data["id"]))
-        return False
-    return True
+    points = np.column_stack([np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)])
+    if len(points) == 0:
+        return np.zeros(0, dtype=bool)
 
-def is_cpt_inside_buffered_track(file_track, point):
+    idx = track_index(file_track)
+    with track_lock:
+        if hasattr(idx, "intersection_v"):
+            _, counts = idx.intersection_v(points, points)
+        else:
+            counts = np.array([idx.count(tuple(point) * 2) for point in points])
+    return counts > 0
+
+
+@lru_cache(maxsize=None)
+def rd_transformer(crs):
     """
-    Check if a CPT in inside the buffered track geometry
+    Function that returns the (cached) transformer from epsg:28992 to a coordinate system
 
-    :param file_track: rtree index file location
-    :param point: list of x and y coordinates
-    :return: boolean if cpt is inside buffered track
+    :param crs: coordinate system
+    :return: pyproj transformer
     """
-    idx = index.Index(file_track, interleaved=True)
+    return pyproj.Transformer.from_proj(pyproj.CRS('epsg:28992'), pyproj.CRS(crs), always_xy=True)
 
-    point = Point(point[0], point[1])
-    possible_matches = list(idx.intersection(point.bounds))
-    if len(possible_matches) == 0:
-        return False
-    else:
-        return True
+
+@lru_cache(maxsize=None)
+def layer_transformer(crs):
+    """
+    Function that returns the (cached) transformer from a coordinate system to epsg:28992
+
+    :param crs: coordinate system
+    :return: pyproj transformer
+    """
+    return pyproj.Transformer.from_proj(pyproj.CRS(crs), pyproj.CRS('epsg:28992'), always_xy=True)
+
+
+def spatial_layer(cursor, fn):
+    """
+    Function that finds the spatial layer of the cpts and its rtree spatial index in the geopackage
+
+    :param cursor: sqlite cursor of the geopackage
+    :param fn: geopackage file location
+    :return: table, geometry column and crs of the layer. None if the layer has no rtree spatial index
+    """
+    if fn not in spatial_layers:
+        cursor.execute("SELECT gpkg_geometry_columns.table_name, gpkg_geometry_columns.column_name, \
+                               gpkg_spatial_ref_sys.organization, gpkg_spatial_ref_sys.organization_coordsys_id \
+                        FROM gpkg_geometry_columns \
+                            join gpkg_spatial_ref_sys on gpkg_spatial_ref_sys.srs_id = gpkg_geometry_columns.srs_id")
+        layers = cursor.fetchall()
+        # the cpt layer is the geotechnical_cpt_survey table, otherwise the first layer
+        layers = sorted(layers, key=lambda layer: layer[0] != "geotechnical_cpt_survey")
+        layer = None
+        if layers:
+            table, column, organization, coordsys_id = layers[0]
+            cursor.execute("SELECT name FROM sqlite_master WHERE name = ?", (f"rtree_{table}_{column}", ))
+            if cursor.fetchone() is not None:
+                layer = (table, column, f"{organization}:{coordsys_id}")
+        spatial_layers[fn] = layer
+    return spatial_layers[fn]
+
+
+def gpkg_point(blob):
+    """
+    Function that reads the coordinates of a point from a geopackage geometry
+
+    :param blob: geopackage geometry
+    :return: x and y coordinates
+    """
+    flags = blob[3]
+    # empty geometry
+    if flags & 0b10000:
+        return np.nan, np.nan
+    # skip the header and the byte order and type of the well known binary
+    offset = 8 + envelope_size[(flags >> 1) & 0b111]
+    byte_order = "<" if blob[offset] == 1 else ">"
+    return struct.unpack_from(byte_order + "dd", blob, offset + 5)
+
+
+def project_polygon(polygon, crs, polygon_etrs89=None):
+    """
+    Function that projects a polygon from epsg:28992 to the coordinate system of the spatial layer
+
+    :param polygon: shapely polygon (epsg:28992)
+    :param crs: coordinate system of the spatial layer
+    :param polygon_etrs89: (optional) the polygon projected to epsg:4258. Default is None: the polygon is projected
+    :return: shapely polygon
+    """
+    if polygon_etrs89 is not None and crs.lower() == 'epsg:4258':
+        return polygon_etrs89
+    return transform(rd_transformer(crs).transform, polygon)
+
+
+def select_cpt_locations(polygon, fn, cursor, polygon_etrs89=None):
+    """
+    Function that selects the bro_ids and locations of the cpts that intercept a polygon
+
+    The bounding box of the polygon is searched in the rtree spatial index of the geopackage, followed by an exact
+    point in polygon test. If the geopackage has no rtree spatial index, the cpts are selected with geopandas.
+
+    :param polygon: shapely polygon (epsg:28992)
+    :param fn: geopackage file location
+    :param cursor: sqlite cursor of the geopackage
+    :param polygon_etrs89: (optional) the polygon projected to epsg:4258. Default is None: the polygon is projected
+    :return: list of bro_ids, array with the coordinates of the cpts and coordinate system of the coordinates
+    """
+    layer = spatial_layer(cursor, fn)
+    if layer is None:
+        # geopackages without rtree spatial index
+        import geopandas as gpd
+        polygon = project_polygon(polygon, 'epsg:4258', polygon_etrs89)
+        cpts = gpd.read_file(fn, mask=polygon, usecols='bro_id')
+        points = np.column_stack([cpts.geometry.x, cpts.geometry.y]) if len(cpts) else np.empty((0, 2))
+        return list(cpts.bro_id), points, 'epsg:4258'
+
+    table, column, crs = layer
+    # transform the polygon from epsg:28992 to the coordinate system of the layer
+    polygon = project_polygon(polygon, crs, polygon_etrs89)
+    min_x, min_y, max_x, max_y = polygon.bounds
+    cursor.execute(f'SELECT "{table}".bro_id, "{table}"."{column}" \
+                     FROM "rtree_{table}_{column}" \
+                         join "{table}" on "{table}".rowid = "rtree_{table}_{column}".id \
+                     WHERE minx <= ? AND maxx >= ? AND miny <= ? AND maxy >= ?', (max_x, min_x, max_y, min_y))
+    candidates = [row for row in cursor.fetchall() if row[1] is not None]
+    if not candidates:
+        return [], np.empty((0, 2)), crs
+
+    # exact point in polygon test
+    points = np.array([gpkg_point(geometry) for _, geometry in candidates], dtype=float)
+    inside = shapely.intersects_xy(polygon, points[:, 0], points[:, 1])
+    return [bro_id for (bro_id, _), is_inside in zip(candidates, inside) if is_inside], points[inside], crs
+
+
+def cpts_inside(polygon, cpts, points, crs, polygon_etrs89=None):
+    """
+    Function that selects the cpts inside a polygon, with their location in the spatial layer
+
+    :param polygon: shapely polygon (epsg:28992)
+    :param cpts: list of dictionaries containing the cpt data
+    :param points: array with the coordinates of the cpts in the spatial layer
+    :param crs: coordinate system of the spatial layer
+    :param polygon_etrs89: (optional) the polygon projected to epsg:4258. Default is None: the polygon is projected
+    :return: list of dictionaries containing the cpt data
+    """
+    if not cpts:
+        return []
+    inside = shapely.intersects_xy(project_polygon(polygon, crs, polygon_etrs89), points[:, 0], points[:, 1])
+    return [cpt for cpt, is_inside in zip(cpts, inside) if is_inside]
 
 
 def create_index_gpkg(fn):
@@ -182,96 +365,676 @@ def create_index_gpkg(fn):
     """
 
     # create indexes to accelerate the search
-    check_query = "SELECT name FROM sqlite_master WHERE type='index' AND name='ix_test1'"
+    check_query = "SELECT name FROM sqlite_master WHERE type='index' AND name='ix_test2'"
     conn = sqlite3.connect(fn)
-    cursor = conn.cursor()
-    cursor.execute(check_query)
-    index_exists = cursor.fetchone() is not None
-    if not index_exists:
-        print("Creating indexes in the geopackage to accelerate the search. This might take a while...")
-        query = ["create index if not exists ix_test1 on geotechnical_cpt_survey(geotechnical_cpt_survey_pk)",
-                 "create index if not exists ix_test2 on cone_penetration_test_result(cone_penetration_test_fk)"]
-        for q in query:
-            cursor.execute(q)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(check_query)
+        index_exists = cursor.fetchone() is not None
+        if not index_exists:
+            print("Creating indexes in the geopackage to accelerate the search. This might take a while...")
+            query = ["create index if not exists ix_test1 on geotechnical_cpt_survey(geotechnical_cpt_survey_pk)",
+                     "create index if not exists ix_test2 on cone_penetration_test_result(cone_penetration_test_fk)"]
+            for q in query:
+                cursor.execute(q)
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def measurement_index_exists(fn):
+    """
+    Function that checks if the measurements of the geopackage are indexed by cpt
+
+    :param fn: geopackage file location
+    :return: boolean
+    """
+    conn = sqlite3.connect(read_only_uri(fn, immutable=False), uri=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA index_list(cone_penetration_test_result)")
+        for index_name in [row[1] for row in cursor.fetchall()]:
+            cursor.execute('PRAGMA index_info("{}")'.format(index_name))
+            columns = sorted(cursor.fetchall())
+            if columns and columns[0][2] == "cone_penetration_test_fk":
+                return True
+        return False
+    finally:
+        conn.close()
+
+
+def cache_files(fn, extension):
+    """
+    Function that returns the possible locations of a file derived from a data file:
+    next to the data file, or in the cache folder of the user
+
+    :param fn: data file location
+    :param extension: extension of the derived file
+    :return: list of file locations
+    """
+    name = hashlib.sha1(os.path.abspath(fn).encode()).hexdigest() + extension
+    return [fn + extension,
+            join(os.path.expanduser("~"), ".cache", "OURS", name)]
+
+
+def sidecar_is_valid(sidecar, fn):
+    """
+    Function that checks if the sidecar index database belongs to the current version of the geopackage
+
+    :param sidecar: sidecar index database location
+    :param fn: geopackage file location
+    :return: boolean
+    """
+    if not exists(sidecar):
+        return False
+    stat = os.stat(fn)
+    try:
+        conn = sqlite3.connect(read_only_uri(sidecar, immutable=False), uri=True)
+        try:
+            source = conn.execute("SELECT size, mtime FROM source").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    return source == (stat.st_size, stat.st_mtime_ns)
+
+
+def create_sidecar(fn, sidecar):
+    """
+    Function that creates the sidecar index database of a read-only geopackage. The sidecar contains the rowids of
+    the measurements per cpt.
+
+    :param fn: geopackage file location
+    :param sidecar: sidecar index database location
+    :return: None
+    """
+    print("Creating sidecar indexes of the geopackage to accelerate the search. This might take a while...")
+    os.makedirs(dirname(os.path.abspath(sidecar)), exist_ok=True)
+    stat = os.stat(fn)
+    # write to a temporary file first: other processes never read a partial sidecar
+    tmp_file = "{}.{}.tmp".format(sidecar, os.getpid())
+    conn = sqlite3.connect(tmp_file)
+    try:
+        conn.execute("ATTACH DATABASE ? AS gpkg", (read_only_uri(fn, immutable=False), ))
+        conn.execute("CREATE TABLE cone_penetration_test_result_rows (cone_penetration_test_fk, row INTEGER)")
+        conn.execute("INSERT INTO cone_penetration_test_result_rows \
+                      SELECT cone_penetration_test_fk, rowid FROM gpkg.cone_penetration_test_result")
+        conn.execute("CREATE INDEX ix_rows ON cone_penetration_test_result_rows(cone_penetration_test_fk, row)")
+        conn.execute("CREATE TABLE source (size, mtime)")
+        conn.execute("INSERT INTO source VALUES (?, ?)", (stat.st_size, stat.st_mtime_ns))
         conn.commit()
+    finally:
         conn.close()
+    os.replace(tmp_file, sidecar)
 
 
-def read_cpt_from_gpkg(polygon, fn, file_track):
+def prepare_gpkg(fn):
     """
-    Function that retrieves cpts that intercept a polygon
+    Function that prepares the indexes of the geopackage, once per process.
+
+    The indexes are created in the geopackage. If the geopackage is read-only, the indexes are created in a sidecar
+    database (see cache_files), that is attached to the connections of the geopackage.
 
-    :param polygon: shapely polygon
     :param fn: geopackage file location
-    :param file_track: rtree index file location
-    :return: list of dictionaries containing all cpt data
+    :return: sidecar index database location. None if the geopackage contains the indexes
+    """
+    with gpkg_lock:
+        if fn not in gpkg_sidecars:
+            gpkg_sidecars[fn] = None
+            if not measurement_index_exists(fn):
+                try:
+                    create_index_gpkg(fn)
+                except sqlite3.OperationalError as e:
+                    logging.warning("Cannot create indexes in the geopackage {}: {}".format(fn, e))
+                    gpkg_sidecars[fn] = prepare_sidecar(fn)
+    return gpkg_sidecars[fn]
+
+
+def prepare_sidecar(fn):
+    """
+    Function that finds or creates the sidecar index database of the geopackage
+
+    :param fn: geopackage file location
+    :return: sidecar index database location. None if no sidecar can be created
+    """
+    for sidecar in cache_files(fn, ".index.sqlite"):
+        if sidecar_is_valid(sidecar, fn):
+            return sidecar
+    for sidecar in cache_files(fn, ".index.sqlite"):
+        try:
+            create_sidecar(fn, sidecar)
+            return sidecar
+        except (OSError, sqlite3.Error) as e:
+            logging.warning("Cannot create sidecar indexes {}: {}".format(sidecar, e))
+    return None
+
+
+def parse_cpt_measurements(metadata, measurements, cone_surface_quotient):
+    """
+    Function that splits the measurements into the cpt dictionaries
+
+    The measurements are read as float arrays and sorted once. The cpts are split at the index boundaries of the
+    sorted arrays. Rows with missing values in the measurement columns that are not read are removed, unless the
+    column is missing for the whole cpt.
+
+    :param metadata: list of the metadata of the cpts
+    :param measurements: list of the measurements of all cpts
+    :param cone_surface_quotient: list of bro_id and cone_surface_quotient
+    :return: list of dictionaries containing the cpt data used for the processing
+    """
+    meta_columns = ['vertical_datum', 'local_reference', 'quality_class', 'cpt_standard']
+
+    # metadata of the cpts. cpts without id or location are not used
+    cpt_metadata = {}
+    for row in metadata:
+        if None not in row[1:4]:
+            cpt_metadata.setdefault(int(row[0]), row)
+    if not cpt_metadata or not measurements:
+        return []
+    # order of the cpts: bro_id and location
+    keys = np.array(sorted(cpt_metadata, key=lambda key: cpt_metadata[key][1:4]), dtype=np.int64)
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[np.argsort(keys)] = np.arange(len(keys))
+    sorted_keys = np.sort(keys)
+
+    data = np.array(measurements, dtype=float).reshape(len(measurements), len(processing_columns) + 2)
+    # measurements of the cpts with metadata
+    position = np.minimum(np.searchsorted(sorted_keys, data[:, 0]), len(keys) - 1)
+    data = data[sorted_keys[position] == data[:, 0]]
+    if len(data) == 0:
+        return []
+    cpt_rank = rank[np.searchsorted(sorted_keys, data[:, 0])]
+    # sort once for all cpts: cpt, penetration length and depth
+    data = data[np.lexsort((data[:, 2], data[:, 1], cpt_rank))]
+    cpt_rank = np.sort(cpt_rank)
+    values = data[:, 1:-1]
+    null_mask = data[:, -1].astype(np.int64)
+
+    # index boundaries of the cpts
+    start = np.append(0, np.flatnonzero(cpt_rank[1:] != cpt_rank[:-1]) + 1)
+    count = np.diff(np.append(start, len(data)))
+
+    # cpts that contain the required data
+    usable = np.ones(len(start), dtype=bool)
+    for name in req_columns:
+        column = list(processing_columns).index(name)
+        usable &= np.add.reduceat(~np.isnan(values[:, column]), start) > 0
+
+    # rows with missing values in the columns that are not read, unless missing for the whole cpt
+    missing_column = np.bitwise_and.reduceat(null_mask, start)
+    complete = (null_mask & ~np.repeat(missing_column, count)) == 0
+
+    # first cone surface quotient of each cpt
+    quotient = {}
+    for bro_id, a in cone_surface_quotient:
+        quotient.setdefault(bro_id, np.nan if a is None else a)
+
+    cpts_results = []
+    for i, key in enumerate(keys[cpt_rank[start]]):
+        _, bro_id, location_x, location_y, offset_z, vertical_datum, local_reference, quality_class, cpt_standard, \
+            predrilled_z = cpt_metadata[key]
+        if not usable[i] or None in [vertical_datum, local_reference, quality_class, cpt_standard]:
+            logging.warning("CPT with id {} misses required data.".format(bro_id))
+            continue
+        rows = slice(start[i], start[i] + count[i])
+        temporary_cpt_dict = {'id': bro_id,
+                              'location_x': location_x,
+                              'location_y': location_y,
+                              'offset_z': float(0 if offset_z is None else offset_z),
+                              'predrilled_z': float(0 if predrilled_z is None else predrilled_z),
+                              'a': quotient.get(bro_id, np.nan),
+                              'dataframe': pd.DataFrame(values[rows][complete[rows]],
+                                                        columns=list(processing_columns))}
+        for name, value in zip(meta_columns, [vertical_datum, local_reference, quality_class, cpt_standard]):
+            temporary_cpt_dict[name] = value
+        cpts_results.append(temporary_cpt_dict)
+    return cpts_results
+
+
+def read_cpts(bro_ids, fn, cursor, file_track):
     """
+    Function that retrieves the cpts with the bro_ids
 
-    # create indexes in the geopackage to accelerate the search
-    create_index_gpkg(fn)
+    :param bro_ids: list of bro_ids
+    :param fn: geopackage file location
+    :param cursor: sqlite cursor of the geopackage
+    :param file_track: rtree index file location
+    :return: list of dictionaries containing the cpt data
+    """
 
     cpts_results = []
-    # transform the polygon from epsg:28992 to epsg:4258
-    rd_p = pyproj.CRS('epsg:28992')
-    wgs84_p = pyproj.CRS('epsg:4258')
-    project = pyproj.Transformer.from_proj(rd_p, wgs84_p, always_xy=True)
-    polygon = transform(project.transform, polygon)
-    # get bro_ids from the intersection with the polygon
-    bro_ids = gpd.read_file(fn, mask=polygon, usecols='bro_id')
+    sidecar = prepare_gpkg(fn) is not None
     if len(bro_ids) > 0:
-        # connect with the geopackage using sqlite
-        conn = sqlite3.connect(fn)
-        cursor = conn.cursor()
         # get the keys of the database using the bro_ids found in the intersection
-        query = "SELECT geotechnical_cpt_survey_pk FROM geotechnical_cpt_survey WHERE geotechnical_cpt_survey.bro_id"
-        cursor.execute(query + query_equals_according_to_length(bro_ids.bro_id))
-        returned_ids = cursor.fetchall()
-        returned_ids = [int(id[0]) for id in returned_ids]
-        query = construct_query(returned_ids)
-        # check type of query
-        if isinstance(query, list):
-            results = []
-            for q in query:
-                cursor.execute(q)
-                c = pd.DataFrame(cursor.fetchall(), columns=columns_gpkg)
-                if not(c.empty):
-                    results.append(c)
-            # check if results is not empty
-            if len(results) > 0:
-                results = pd.concat(results)
-            else:
-                return []
-        else:
-            cursor.execute(query)
-            results = pd.DataFrame(cursor.fetchall(), columns=columns_gpkg)
-
-        cursor.execute(construct_query_cone_surface_quotient(returned_ids))
-        cone_surface_quotient = pd.DataFrame(cursor.fetchall(), columns=['id', 'a'])
-        column_names_per_cpt = ['id', 'location_x', 'location_y']
-        grouped_results = results.groupby(column_names_per_cpt)
-        cpts_results = []
-        for name, group in grouped_results:
-            temporary_cpt_dict = dict(zip(column_names_per_cpt, name))
-            temporary_cpt_dict['offset_z'] = float(list(group['offset_z'].fillna(0))[0])
-            temporary_cpt_dict['vertical_datum'] = list(group['vertical_datum'])[0]
-            temporary_cpt_dict['local_reference'] = list(group['local_reference'])[0]
-            temporary_cpt_dict['quality_class'] = list(group['quality_class'])[0]
-            temporary_cpt_dict['cpt_standard'] = list(group['cpt_standard'])[0]
-            temporary_cpt_dict['predrilled_z'] = list(group['predrilled_z'].fillna(0))[0]
-            temporary_cpt_dict['a'] = cone_surface_quotient[cone_surface_quotient['id'] == name[0]]['a'].values[0]
-            temporary_cpt_dict['in_track'] = is_cpt_inside_buffered_track(file_track, [temporary_cpt_dict['location_x'], temporary_cpt_dict['location_y']])
-            cpt_group = group.copy(deep=True)
-            cpt_group.sort_values(['penetrationLength', 'depth'], inplace=True)
-            temporary_cpt_dict['dataframe'] = cpt_group
-            if determine_if_all_data_is_available(temporary_cpt_dict):
-                temporary_cpt_dict['dataframe'] = change_to_floats(temporary_cpt_dict['dataframe'])
-                # replace np.nan with None
-                #temporary_cpt_dict['dataframe'] = temporary_cpt_dict['dataframe'].replace({np.nan: None})
-                cpts_results.append(temporary_cpt_dict)
+        select_keys(cursor, bro_ids)
+        cursor.execute("SELECT geotechnical_cpt_survey_pk FROM geotechnical_cpt_survey \
+                        WHERE geotechnical_cpt_survey.bro_id IN (SELECT key FROM temp.selected_keys)")
+        returned_ids = [int(id[0]) for id in cursor.fetchall()]
+        # get all data of the cpts in one query
+        select_keys(cursor, returned_ids)
+        cursor.execute(construct_query_metadata())
+        metadata = cursor.fetchall()
+        cursor.execute(construct_query_processing(sidecar))
+        measurements = cursor.fetchall()
+
+        cursor.execute(construct_query_cone_surface_quotient())
+        cone_surface_quotient = cursor.fetchall()
+        cpts_results = parse_cpt_measurements(metadata, measurements, cone_surface_quotient)
+
+        # check which cpts are inside the buffered track
+        in_track = inside_track(file_track, [cpt['location_x'] for cpt in cpts_results],
+                                [cpt['location_y'] for cpt in cpts_results])
+        for cpt, is_in_track in zip(cpts_results, in_track):
+            cpt['in_track'] = bool(is_in_track)
 
-        conn.close()
     return cpts_results
 
+
+class TileCache:
+    """
+    Cache of the cpts of the geopackage in fixed tiles of the RD grid
+
+    Neighbouring receptors search nearly the same area. The cpts of each tile are read once from the geopackage.
+    The cpts of a search area are assembled from the tiles. The tiles that are least recently used are removed,
+    when the cache contains more than max_cpts cpts.
+    """
+
+    def __init__(self, fn, tile_size=500., margin=100., max_cpts=2000):
+        """
+        Initialise the cache
+
+        :param fn: geopackage file location
+        :param tile_size: (optional) size of the tiles [m]. Default is 500
+        :param margin: (optional) margin around the tiles in the spatial selection [m]. Default is 100
+        :param max_cpts: (optional) maximum number of cpts in the cache. Default is 2000
+        """
+        self.fn = fn
+        self.tile_size = tile_size
+        self.margin = margin
+        self.max_cpts = max_cpts
+        self.hits = 0
+        self.misses = 0
+        self.crs = None
+        self.__tiles = OrderedDict()
+        self.__nb_cpts = 0
+        self.__lock = threading.Lock()
+        return
+
+    def read(self, polygon, polygon_etrs89=None):
+        """
+        Retrieve the cpts that intercept a polygon
+
+        :param polygon: shapely polygon (epsg:28992)
+        :param polygon_etrs89: (optional) the polygon projected to epsg:4258. Default is None: the polygon is projected
+        :return: list of dictionaries containing all cpt data, array with the coordinates of the cpts in the spatial
+                 layer and coordinate system of the spatial layer
+        """
+        cursor = gpkg_connection(self.fn).cursor()
+        min_x, min_y, max_x, max_y = polygon.bounds
+        tiles = [(i, j)
+                 for i in range(self.__tile(min_x - self.margin), self.__tile(max_x + self.margin) + 1)
+                 for j in range(self.__tile(min_y - self.margin), self.__tile(max_y + self.margin) + 1)]
+
+        with self.__lock:
+            missing = [tile for tile in tiles if tile not in self.__tiles]
+            self.hits += len(tiles) - len(missing)
+            self.misses += len(missing)
+            if missing:
+                self.__fetch(missing, cursor)
+            cpts, points = [], []
+            for tile in tiles:
+                self.__tiles.move_to_end(tile)
+                cpts.extend(self.__tiles[tile][0])
+                points.extend(self.__tiles[tile][1])
+            # remove the least recently used tiles
+            while self.__nb_cpts > self.max_cpts and len(self.__tiles) > 1:
+                _, (tile_cpts, _) = self.__tiles.popitem(last=False)
+                self.__nb_cpts -= len(tile_cpts)
+        cursor.close()
+
+        if not cpts:
+            return [], np.empty((0, 2)), self.crs
+        # exact point in polygon test, in the coordinate system of the spatial layer
+        points = np.array(points, dtype=float).reshape(len(cpts), 2)
+        inside = shapely.intersects_xy(project_polygon(polygon, self.crs, polygon_etrs89), points[:, 0], points[:, 1])
+        order = sorted(np.flatnonzero(inside),
+                       key=lambda i: (cpts[i]['id'], cpts[i]['location_x'], cpts[i]['location_y']))
+        return [cpts[i] for i in order], points[order].reshape(len(order), 2), self.crs
+
+    def __tile(self, coordinate):
+        return int(np.floor(coordinate / self.tile_size))
+
+    def __fetch(self, tiles, cursor):
+        # the cpts of the tiles, with a margin for the projection of the tiles to the spatial layer
+        area = unary_union([box(i * self.tile_size - self.margin, j * self.tile_size - self.margin,
+                                (i + 1) * self.tile_size + self.margin, (j + 1) * self.tile_size + self.margin)
+                            for i, j in tiles])
+        bro_ids, points, self.crs = select_cpt_locations(area, self.fn, cursor)
+        location = dict(zip(bro_ids, points))
+        cpts = read_cpts(bro_ids, self.fn, cursor, join(dirname(self.fn), 'buff_track'))
+
+        # the cpts belong to the tile of their location in the spatial layer, projected to epsg:28992
+        new_tiles = {tile: ([], []) for tile in tiles}
+        points = np.array([location[cpt['id']] for cpt in cpts], dtype=float).reshape(len(cpts), 2)
+        rd_x, rd_y = layer_transformer(self.crs).transform(points[:, 0], points[:, 1])
+        for cpt, x, y in zip(cpts, rd_x, rd_y):
+            tile = (self.__tile(x), self.__tile(y))
+            if tile in new_tiles:
+                new_tiles[tile][0].append(cpt)
+                new_tiles[tile][1].append(location[cpt['id']])
+        for tile, value in new_tiles.items():
+            self.__tiles[tile] = value
+            self.__nb_cpts += len(value[0])
+        return
+
+
+def tile_cache(fn):
+    """
+    Function that returns the tile cache of the geopackage, once per process
+
+    :param fn: geopackage file location
+    :return: TileCache object
+    """
+    with tile_lock:
+        if fn not in tile_caches:
+            tile_caches[fn] = TileCache(fn)
+    return tile_caches[fn]
+
+def read_cpt_from_store(polygon, fn):
+    """
+    Function that retrieves cpts that intercept a polygon from a cpt store (see extract_corridor)
+
+    :param polygon: shapely polygon
+    :param fn: cpt store location
+    :return: list of dictionaries containing all cpt data, array with the coordinates of the cpts in the spatial
+             layer and coordinate system of the spatial layer
+    """
+    store = cpt_store.open_store(fn)
+    if not store.footprint.covers(polygon):
+        logging.warning("The search area is not completely inside the area of the CPT store {}.".format(fn))
+    # transform the polygon from epsg:28992 to the coordinate system of the store
+    polygon = transform(rd_transformer(store.crs).transform, polygon)
+    selected = store.select(polygon)
+    return [store.cpt(i) for i in selected], store.points[selected].reshape(len(selected), 2), store.crs
+
+
+def geomorph_source(file_idx):
+    """
+    Function that identifies the version of the geomorphological data files
+
+    :param file_idx: rtree geomorphological map location (without extension)
+    :return: array with the size and modification time of the data files
+    """
+    return np.array([(os.stat(file_idx + extension).st_size, os.stat(file_idx + extension).st_mtime_ns)
+                     for extension in [".idx", ".dat"]], dtype=np.int64)
+
+
+def create_geomorph_cache(file_idx):
+    """
+    Function that converts the geomorphological polygons of the rtree into the geomorphological cache.
+    The polygons are repaired and projected once.
+
+    The polygons are stored in the order of the rtree: the order of the polygons of a search is the order of the rtree.
+    The cache only contains numeric and string arrays: the polygons are stored as the concatenated well known binary
+    of the polygons and the offsets of each polygon.
+
+    :param file_idx: rtree geomorphological map location (without extension)
+    :return: dictionary with the arrays of the geomorphological cache
+    """
+    gm_index = index.Index(file_idx)  # created by auxiliary_code/gen_geomorph_idx.py
+    codes, bounds, polygons = [], [], []
+    for item in gm_index.intersection(gm_index.bounds, objects=True):
+        gm_code, polygon = item.object
+        poly = shape(polygon)
+        if not poly.is_valid:
+            poly = poly.buffer(0.01)  # buffering reconstructs the geometry, often fixing invalidity
+        codes.append(gm_code)
+        bounds.append(item.bbox)
+        polygons.append(poly)
+    gm_index.close()
+
+    polygons_etrs89 = [transform(rd_transformer('epsg:4258').transform, poly) for poly in polygons]
+    cache = {"version": np.array(GEOMORPH_CACHE_VERSION),
+             "source": geomorph_source(file_idx),
+             "codes": np.array(codes, dtype=str),
+             "bounds": np.array(bounds, dtype=float).reshape(len(codes), 4)}
+    for name, polys in [("rd", polygons), ("etrs89", polygons_etrs89)]:
+        wkb = [bytes(geometry) for geometry in shapely.to_wkb(np.array(polys, dtype=object))]
+        cache[name] = np.frombuffer(b"".join(wkb), dtype=np.uint8)
+        cache[name + "_offsets"] = np.cumsum([0] + [len(geometry) for geometry in wkb]).astype(np.int64)
+    return cache
+
+
+def read_geomorph_cache(cache_file, file_idx):
+    """
+    Function that reads the geomorphological cache, if it belongs to the current geomorphological data files.
+    The cache is read without pickle: a cache on shared storage cannot execute code.
+
+    :param cache_file: geomorphological cache location
+    :param file_idx: rtree geomorphological map location (without extension)
+    :return: dictionary with the arrays of the geomorphological cache. None if the cache is not valid
+    """
+    if not exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file, allow_pickle=False) as f:
+            cache = {name: f[name] for name in f.files}
+        if cache["version"] != GEOMORPH_CACHE_VERSION or \
+                not np.array_equal(cache["source"], geomorph_source(file_idx)):
+            return None
+        # check that the polygons can be split
+        for name in ["rd", "etrs89"]:
+            if len(cache[name + "_offsets"]) != len(cache["codes"]) + 1 or \
+                    cache[name + "_offsets"][-1] != len(cache[name]):
+                raise ValueError("inconsistent polygon offsets")
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        logging.warning("Cannot read geomorphological cache {}: {}".format(cache_file, e))
+        return None
+    return cache
+
+
+def polygons_from_wkb(data, offsets):
+    """
+    Function that converts the concatenated well known binary of the geomorphological cache into polygons
+
+    :param data: concatenated well known binary of the polygons
+    :param offsets: start and end of each polygon in data
+    :return: array of polygons
+    """
+    wkb = np.empty(len(offsets) - 1, dtype=object)
+    wkb[:] = [data[start:end].tobytes() for start, end in zip(offsets[:-1], offsets[1:])]
+    return shapely.from_wkb(wkb)
+
+
+def geomorph_data(fn):
+    """
+    Function that returns the geomorphological polygons, once per process.
+
+    The geomorphological cache is created once (see create_geomorph_cache) and stored next to the geomorphological
+    data files, or in the cache folder of the user (see cache_files).
+
+    :param fn: BRO data location. The geomorphological data files are located in the same folder
+    :return: dictionary with the geomorphological codes, bounding boxes in the rtree, polygons (epsg:28992),
+             polygons (epsg:4258) and the search tree of the polygons
+    """
+    # rtree geomorpholog map
+    file_idx = join(dirname(fn), 'geomorph')
+    idx_fn = join(dirname(fn), 'geomorph.idx')
+
+    with geomorph_lock:
+        if idx_fn not in geomorph_caches:
+            if not exists(idx_fn):
+                print("Cannot open provided geomorphological data files (.dat & .idx): {}".format(idx_fn))
+                sys.exit(2)
+
+            cache = None
+            for cache_file in cache_files(file_idx, ".npz"):
+                cache = read_geomorph_cache(cache_file, file_idx)
+                if cache is not None:
+                    break
+            if cache is None:
+                cache = create_geomorph_cache(file_idx)
+                for cache_file in cache_files(file_idx, ".npz"):
+                    # write to a temporary file first: other processes never read a partial cache
+                    tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+                    try:
+                        os.makedirs(dirname(os.path.abspath(cache_file)), exist_ok=True)
+                        with open(tmp_file, "wb") as f:
+                            np.savez(f, **cache)
+                        os.replace(tmp_file, cache_file)
+                        break
+                    except OSError as e:
+                        logging.warning("Cannot write geomorphological cache {}: {}".format(cache_file, e))
+
+            polygons = polygons_from_wkb(cache["rd"], cache["rd_offsets"])
+            polygons_etrs89 = polygons_from_wkb(cache["etrs89"], cache["etrs89_offsets"])
+            shapely.prepare(polygons)
+            shapely.prepare(polygons_etrs89)
+            geomorph_caches[idx_fn] = {"codes": cache["codes"].tolist(),
+                                       "bounds": cache["bounds"],
+                                       "rd": polygons,
+                                       "etrs89": polygons_etrs89,
+                                       "tree": shapely.STRtree(polygons)}
+    return geomorph_caches[idx_fn]
+
+
+def geomorph_polygons(fn, area):
+    """
+    Function that retrieves the geomorphological polygons that intersect an area
+
+    :param fn: BRO data location. The geomorphological data files are located in the same folder
+    :param area: shapely polygon (epsg:28992)
+    :return: list of geomorphological codes, array of polygons (epsg:28992) and array of polygons (epsg:4258)
+    """
+    geomorph = geomorph_data(fn)
+    hits = geomorph["tree"].query(area, predicate="intersects")
+    # polygons with the bounding box in the rtree intersecting the bounding box of the area, in the order of the rtree
+    min_x, min_y, max_x, max_y = area.bounds
+    bounds = geomorph["bounds"][hits]
+    hits = np.sort(hits[(bounds[:, 0] <= max_x) & (bounds[:, 2] >= min_x) &
+                        (bounds[:, 1] <= max_y) & (bounds[:, 3] >= min_y)])
+    return [geomorph["codes"][i] for i in hits], geomorph["rd"][hits], geomorph["etrs89"][hits]
+
+
+def extract_corridor(fn, track, radius, output):
+    """
+    Function that extracts all cpts along a track from the BRO database into a cpt store
+
+    The area of the store is the track buffered with the search radius, together with the geomorphological
+    polygons that intersect it: every receptor on the track finds all its cpts in the store.
+    The store can be used as BRO data (see read_bro_gpkg_version). It should be located in the folder of the BRO
+    data, next to the water level and geomorphological data files.
+
+    :param fn: geopackage file location
+    :param track: shapely geometry of the track (epsg:28992)
+    :param radius: search radius
+    :param output: cpt store location
+    :return: number of cpts in the store
+    """
+    corridor = track.buffer(radius, resolution=32)
+    _, polygons, _ = geomorph_polygons(fn, corridor)
+    footprint = unary_union([corridor] + list(polygons))
+
+    cursor = gpkg_connection(fn).cursor()
+    # coordinates of the cpts in the spatial layer of the geopackage
+    bro_ids, points, crs = select_cpt_locations(footprint, fn, cursor)
+    location = dict(zip(bro_ids, points))
+    dates = research_report_dates(bro_ids, cursor)
+    cpts = read_cpts(bro_ids, fn, cursor, join(dirname(fn), 'buff_track'))
+    cursor.close()
+    write_cpt_store(output, cpts, location, dates, crs, footprint, fn)
+    logging.warning("Extracted {} CPTs into {}.".format(len(cpts), output))
+    return len(cpts)
+
+
+def research_report_dates(bro_ids, cursor):
+    """
+    Function that retrieves the research report date of the cpts: the version of the cpts in the BRO database
+
+    :param bro_ids: list of bro_ids
+    :param cursor: sqlite cursor of the geopackage
+    :return: dictionary with the research report date (as string) by bro_id
+    """
+    select_keys(cursor, bro_ids)
+    cursor.execute("SELECT bro_id, research_report_date FROM geotechnical_cpt_survey \
+                    WHERE geotechnical_cpt_survey.bro_id IN (SELECT key FROM temp.selected_keys)")
+    return {bro_id: None if date is None else str(date) for bro_id, date in cursor.fetchall()}
+
+
+def write_cpt_store(output, cpts, location, dates, crs, footprint, fn):
+    """
+    Function that writes the cpts to a cpt store, in the order of the BRO database reader
+
+    :param output: cpt store location
+    :param cpts: list of dictionaries containing the cpt data
+    :param location: dictionary with the coordinates of the cpts in the spatial layer, by bro_id
+    :param dates: dictionary with the research report date of all cpts in the area, by bro_id
+    :param crs: coordinate system of the spatial layer
+    :param footprint: shapely polygon of the area of the store (epsg:28992)
+    :param fn: geopackage file location
+    :return: None
+    """
+    cpts = sorted(cpts, key=lambda cpt: (cpt['id'], cpt['location_x'], cpt['location_y']))
+    for cpt in cpts:
+        cpt['research_report_date'] = dates.get(cpt['id'])
+    points = np.array([location[cpt['id']] for cpt in cpts], dtype=float).reshape(len(cpts), 2)
+    # cpts that miss required data: they are only read again when they change
+    stored = {cpt['id'] for cpt in cpts}
+    rejected = {bro_id: date for bro_id, date in dates.items() if bro_id not in stored}
+    cpt_store.write_store(output, cpts, points, crs, footprint, fn, rejected=rejected)
+
+
+def ingest_store(store, fn, cache=None):
+    """
+    Function that updates a cpt store with a new version of the BRO database
+
+    The cpts in the area of the store are compared by bro_id and research report date. Only the new and changed cpts
+    are read from the geopackage. The cpts that are no longer in the BRO database are retired.
+    The processed cpts of the added, changed and retired cpts are removed from the cache.
+
+    :param store: cpt store location
+    :param fn: geopackage file location of the new version of the BRO database
+    :param cache: (optional) cache of processed cpts. Default is None
+    :return: dictionary with the bro_ids of the added, replaced and retired cpts
+    """
+    old = cpt_store.CPTStore(os.path.abspath(store))
+    stored = {}
+    for cpt in old.metadata:
+        stored[cpt['id']] = cpt['research_report_date']
+    known = dict(old.rejected)
+    known.update(stored)
+
+    cursor = gpkg_connection(fn).cursor()
+    bro_ids, points, crs = select_cpt_locations(old.footprint, fn, cursor)
+    location = dict(zip(bro_ids, points))
+    dates = research_report_dates(bro_ids, cursor)
+
+    # read the new and changed cpts
+    changed = [bro_id for bro_id, date in dates.items() if bro_id not in known or known[bro_id] != date]
+    cpts = read_cpts(changed, fn, cursor, join(dirname(old.folder), 'buff_track'))
+    cursor.close()
+    new_ids = {cpt['id'] for cpt in cpts}
+    # keep the unchanged cpts
+    changed = set(changed)
+    cpts.extend(old.cpt(i) for i, cpt in enumerate(old.metadata)
+                if cpt['id'] in dates and cpt['id'] not in changed)
+    footprint = old.footprint
+    # close the memory mapped arrays before the store is replaced
+    del old
+    write_cpt_store(store, cpts, location, dates, crs, footprint, fn)
+
+    updates = {"added": sorted(new_ids - set(stored)),
+               "replaced": sorted(new_ids & set(stored)),
+               "retired": sorted(bro_id for bro_id in stored if bro_id not in dates or
+                                 (bro_id in changed and bro_id not in new_ids))}
+    if cache is not None:
+        # added cpts can have processed cpts of an earlier version in the cache
+        cache.invalidate(updates["added"] + updates["replaced"] + updates["retired"])
+    logging.warning("Ingested {} into {}: {} CPTs added, {} replaced, {} retired.".format(
+        fn, store, len(updates["added"]), len(updates["replaced"]), len(updates["retired"])))
+    return updates
+
+
 def read_bro_gpkg_version(parameters):
     """Main function to read the BRO database.
 
@@ -296,46 +1059,73 @@ def read_bro_gpkg_version(parameters):
     # inside those polygons.
     out["polygons"] = {}
     total_cpts = 0
-    # rtree geomorpholog map
-    file_idx = join(dirname(fn), 'geomorph')
-    idx_fn = join(dirname(fn), 'geomorph.idx')
-    # rtree buffered track
-    file_track_idx = join(dirname(fn), 'buff_track')
-
-    if not exists(idx_fn):
-        print("Cannot open provided geomorphological data files (.dat & .idx): {}".format(idx_fn))
-        sys.exit(2)
-    gm_index = index.Index(file_idx)  # created by auxiliary_code/gen_geomorph_idx.py
 
-    geomorphs = list(gm_index.intersection((x - r, y - r, x + r, y + r), objects="raw"))
     circle = Point(x, y).buffer(r, resolution=32)
-    for gm_code, polygon in geomorphs:
-        poly = shape(polygon)
-        if not poly.is_valid:
-            poly = poly.buffer(0.01)  # buffering reconstructs the geometry, often fixing invalidity
-        if circle.intersects(poly):
-            perc = circle.intersection(poly).area / circle.area
-            cpts = read_cpt_from_gpkg(poly, fn, file_track_idx)
-            total_cpts = total_cpts + len(cpts)
-            if gm_code in out["polygons"]:
-                out["polygons"][gm_code]["data"].extend(cpts)
-            else:
-                out["polygons"][gm_code] = {"data": cpts, "perc": perc}
+    gm_codes, gm_polygons, gm_polygons_etrs89 = geomorph_polygons(fn, circle)
+    percs = shapely.area(shapely.intersection(circle, gm_polygons)) / circle.area
+    polygons = [[gm_code, poly, float(perc)] for gm_code, poly, perc in zip(gm_codes, gm_polygons, percs)]
+
+    # Read all CPTs in the polygons and in the circle at once:
+    # one spatial selection over the union of the polygons and the circle
+    footprint = unary_union([circle] + list(gm_polygons))
+    circle_etrs89 = transform(rd_transformer('epsg:4258').transform, circle)
+    if cpt_store.is_store(fn):
+        cpts, points, crs = read_cpt_from_store(footprint, fn)
+    else:
+        footprint_etrs89 = unary_union([circle_etrs89] + list(gm_polygons_etrs89))
+        cpts, points, crs = tile_cache(fn).read(footprint, polygon_etrs89=footprint_etrs89)
+
+    # assign the CPTs to the polygons, with their location in the spatial layer
+    for (gm_code, poly, perc), poly_etrs89 in zip(polygons, gm_polygons_etrs89):
+        polygon_cpts = cpts_inside(poly, cpts, points, crs, polygon_etrs89=poly_etrs89)
+        total_cpts = total_cpts + len(polygon_cpts)
+        if gm_code in out["polygons"]:
+            out["polygons"][gm_code]["data"].extend(polygon_cpts)
+        else:
+            out["polygons"][gm_code] = {"data": polygon_cpts, "perc": perc}
     logging.warning("Found {} CPTs in intersecting polygons.".format(total_cpts))
 
     # Find CPT indexes in circle
-    # create circle as polygon
-    circle_polygon = Point(x, y).buffer(r, resolution=32)
-    circle_cpts = read_cpt_from_gpkg(circle_polygon, fn, file_track_idx)
+    circle_cpts = cpts_inside(circle, cpts, points, crs, polygon_etrs89=circle_etrs89)
     logging.warning("Found {} CPTs in circle.".format(len(circle_cpts)))
     out["circle"] = {"data": circle_cpts}
 
     return out
 
 
+def read_track(file_track):
+    """
+    Function that reads the track geometry
+
+    :param file_track: track file location (any file format of geopandas: shapefile, geojson, geopackage)
+    :return: shapely geometry of the track (epsg:28992)
+    """
+    import geopandas as gpd
+    track = gpd.read_file(file_track)
+    if track.crs is not None:
+        track = track.to_crs('epsg:28992')
+    return unary_union(list(track.geometry))
+
+
 if __name__ == "__main__":
-    test_db = join(dirname(__file__), '../bro/test_v2_0_1.gpkg')
-    input = {"BRO_data": test_db, "Source_x": 82860, "Source_y": 443400,
-             "Radius": 120}
-    cpts = read_bro_gpkg_version(input)
-    print(cpts.keys())
+    import argparse
+    parser = argparse.ArgumentParser(description='BRO database tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_extract = subparsers.add_parser('extract', help='extract all CPTs along a track into a CPT store')
+    parser_extract.add_argument('-b', '--bro', help='BRO geopackage file', required=True)
+    parser_extract.add_argument('-t', '--track', help='track file (epsg:28992)', required=True)
+    parser_extract.add_argument('-r', '--radius', help='search radius', type=float, required=True)
+    parser_extract.add_argument('-o', '--output', help='CPT store folder', required=True)
+
+    parser_ingest = subparsers.add_parser('ingest', help='update a CPT store with a new BRO geopackage')
+    parser_ingest.add_argument('-b', '--bro', help='new BRO geopackage file', required=True)
+    parser_ingest.add_argument('-s', '--store', help='CPT store folder', required=True)
+    parser_ingest.add_argument('-c', '--cache', help='folder of the cache of processed CPTs', required=False,
+                               default=None)
+    args = parser.parse_args()
+
+    if args.command == 'extract':
+        extract_corridor(args.bro, read_track(args.track), args.radius, args.output)
+    elif args.command == 'ingest':
+        cache = cpt_cache.CPTCache(cache_folder=args.cache) if args.cache else None
+        ingest_store(args.store, args.bro, cache=cache)
@@ -0,0 +1,270 @@
+"""
+Batch of CPTs
+"""
+# import packages
+import logging
+import numpy as np
+# import OURS packages
+from CPTtool import cpt_module
+from CPTtool import robertson
+from CPTtool import tools_utils
+from CPTtool import netcdf
+
+# methods of the CPT correlations that are available for a batch
+gamma_methods = ["Robertson", "Lengkeek"]
+vs_methods = ["Robertson", "Mayne", "Andrus", "Zang", "Ahmed"]
+
+
+class CPTBatch:
+    r"""
+    Batch of CPTs
+
+    The CPTs are concatenated in one array per attribute. The offsets define the start and end of each CPT in the
+    arrays. The CPT correlations are computed for all the CPTs at once, with the correlation functions of
+    :mod:`cpt_module` that are also used by :class:`cpt_module.CPT`. The results are handed back to the CPTs with
+    :meth:`unpack`.
+    """
+
+    def __init__(self, cpts):
+        """
+        Initialise the batch
+
+        :param cpts: list of CPT objects, parsed from the BRO (see cpt_module.CPT.parse_bro)
+        """
+        self.cpts = cpts
+        self.offsets = np.cumsum([0] + [len(cpt.depth) for cpt in cpts]).astype(int)
+        self.lengths = np.diff(self.offsets)
+
+        # measurements
+        self.depth = self.__concatenate("depth")
+        self.depth_to_reference = self.__concatenate("depth_to_reference")
+        self.tip = self.__concatenate("tip")
+        self.friction = self.__concatenate("friction")
+        self.friction_nbr = self.__concatenate("friction_nbr")
+        self.water = self.__concatenate("water")
+        self.a = self.__repeat(np.array([cpt.a for cpt in cpts], dtype=float))
+
+        # results
+        self.pwp = []
+        self.qt = []
+        self.gamma = []
+        self.rho = []
+        self.total_stress = []
+        self.effective_stress = []
+        self.Qtn = []
+        self.Fr = []
+        self.n = []
+        self.n_iterations = []
+        self.n_converged = []
+        self.lithology = []
+        self.litho_points = []
+        self.IC = []
+        self.vs = []
+        self.G0 = []
+        self.damping = []
+        self.poisson = []
+        # number of first samples of each CPT that are filtered
+        self.nb_filtered = np.zeros(len(cpts), dtype=int)
+
+        # fixed values
+        self.g = cpt_module.g
+        self.Pa = cpt_module.Pa
+        return
+
+    def smooth(self, nb_points=5, limit=0):
+        r"""
+        Smooth the cpt input data. The CPTs must be longer than the smoothing window.
+
+        :param nb_points: (optional) number of points for smoothing. default 5
+        :param limit: (optional) lower limit of the smooth
+        :return:
+        """
+
+        self.tip = tools_utils.smooth(self.tip, window_len=nb_points, lim=limit, offsets=self.offsets)
+        self.friction = tools_utils.smooth(self.friction, window_len=nb_points, lim=limit, offsets=self.offsets)
+        self.friction_nbr = tools_utils.smooth(self.friction_nbr, window_len=nb_points, lim=limit,
+                                               offsets=self.offsets)
+        self.water = tools_utils.smooth(self.water, window_len=nb_points, lim=0, offsets=self.offsets)
+        return
+
+    def qt_calc(self):
+        r"""
+        Corrected cone resistance (see cpt_module.CPT.qt_calc)
+        """
+
+        self.qt = cpt_module.corrected_cone_resistance(self.tip, self.water, self.a)
+        return
+
+    def gamma_calc(self, method="Robertson", gamma_min=10.5, gamma_max=22):
+        r"""
+        Computes unit weight (see cpt_module.CPT.gamma_calc)
+
+        :param method: (optional) Method to compute unit weight. Default is Robertson
+        :param gamma_max: (optional) Maximum gamma. Default is 22
+        :param gamma_min: (optional) Minimum gamma. Default is 10.5
+        """
+
+        self.gamma = cpt_module.unit_weight(self.qt, self.friction_nbr, method=method, gamma_min=gamma_min,
+                                            gamma_max=gamma_max, offsets=self.offsets)
+        return
+
+    def rho_calc(self):
+        r"""
+        Computes density of soil (see cpt_module.CPT.rho_calc)
+        """
+
+        self.rho = cpt_module.density(self.gamma)
+        return
+
+    def pwp_level_calc(self, path_bro, water_levels=None):
+        """
+        Computes the estimated pwp level for the cpt coordinates
+
+        :param path_bro: path for the location of the netCDF file with expected water levels
+        :param water_levels: (optional) water levels at the cpt coordinates, if already queried. Default is None
+        :return:
+        """
+
+        if water_levels is None:
+            water_levels = netcdf.water_level_grid(path_bro).query_many([cpt.coord[0] for cpt in self.cpts],
+                                                                        [cpt.coord[1] for cpt in self.cpts])
+        self.pwp = np.asarray(water_levels)
+        return
+
+    def stress_calc(self):
+        r"""
+        Computes total and effective stress (see cpt_module.CPT.stress_calc)
+        """
+
+        self.total_stress, self.effective_stress = cpt_module.stresses(self.depth, self.depth_to_reference, self.gamma,
+                                                                       self.pwp, offsets=self.offsets)
+        return
+
+    def lithology_calc(self):
+        r"""
+        Lithology calculation (see cpt_module.CPT.lithology_calc)
+        """
+
+        classification = robertson.shared_classification()
+
+        # compute Qtn and Fr
+        self.norm_calc()
+
+        # lithology as integer array (Robertson soil type 1 to 9)
+        self.lithology = classification.classify(self.Qtn, self.Fr).astype(np.int8)
+        self.litho_points = np.column_stack([self.Fr, self.Qtn])
+        return
+
+    def norm_calc(self):
+        r"""
+        Normalisation of qc and friction into Qtn and Fr (see cpt_module.CPT.norm_calc).
+        The stress exponent *n* is computed in an iterative way.
+        """
+
+        # iteration around n: each sample converges on its own
+        n, self.n_iterations, self.n_converged = tools_utils.n_solve(self.tip, self.friction_nbr,
+                                                                     self.effective_stress, self.total_stress, self.Pa)
+        for i, cpt in enumerate(self.cpts):
+            cpt_converged = self.n_converged[self.offsets[i]:self.offsets[i + 1]]
+            if not all(cpt_converged):
+                logging.debug("CPT {}: stress exponent did not converge for {} of {} samples. n=0.5 is used".format(
+                    cpt.name, np.sum(~cpt_converged), len(cpt_converged)))
+
+        # calculation Q and F
+        self.Qtn, self.Fr = cpt_module.normalised_resistance(self.tip, self.friction, self.effective_stress,
+                                                             self.total_stress, n)
+        self.n = n
+        return
+
+    def IC_calc(self):
+        r"""
+        IC (see cpt_module.CPT.IC_calc)
+        """
+
+        self.IC = cpt_module.behaviour_index(self.Qtn, self.Fr)
+        return
+
+    def vs_calc(self, method="Robertson"):
+        r"""
+        Shear wave velocity and shear modulus (see cpt_module.CPT.vs_calc)
+
+        :param method: (optional) Method to compute the shear wave velocity. Default is Robertson
+        """
+
+        self.vs = cpt_module.shear_wave_velocity(self.qt, self.friction, self.IC, self.Fr, self.depth, self.gamma,
+                                                 self.total_stress, self.effective_stress, method=method,
+                                                 offsets=self.offsets)
+        self.G0 = self.rho * self.vs ** 2
+        return
+
+    def damp_calc(self, method="Mayne", d_min=2, Cu=2., D50=0.2, Ip=40., freq=1.):
+        r"""
+        Damping calculation (see cpt_module.CPT.damp_calc)
+
+        :param method: (optional) Method for calculation of OCR. Default is Mayne
+        :param d_min: (optional) Minimum damping. Default is 2%
+        :param Cu: (optional) Coefficient of uniformity. Default is 2.0
+        :param D50: (optional) Median grain size. Default is 0.2 mm
+        :param Ip: (optional) Plasticity index. Default is 40
+        :param freq: (optional) Frequency. Default is 1 Hz
+        """
+
+        self.damping = cpt_module.damping(self.lithology, self.qt, self.Qtn, self.total_stress, self.effective_stress,
+                                          method=method, d_min=d_min, Cu=Cu, D50=D50, Ip=Ip, freq=freq)
+        return
+
+    def poisson_calc(self):
+        r"""
+        Poisson ratio (see cpt_module.CPT.poisson_calc)
+        """
+
+        self.poisson = cpt_module.poisson_ratio(self.lithology, self.depth_to_reference, self.__repeat(self.pwp))
+        return
+
+    def filter(self, lithologies=[""], key="G0", value=0):
+        """
+        Filters the first consecutive samples of each CPT, for the defined **lithologies**, where the **key** is
+        smaller than the **value** (see cpt_module.CPT.filter). The samples are removed from the CPTs by
+        :meth:`unpack`.
+
+        :param lithologies: list of lithologies to be filtered
+        :param key: Key of the object to be filtered
+        :param value: value of the key to be limited
+        :return:
+        """
+        to_filter = cpt_module.CPT.filter_mask(self.lithology, getattr(self, key), lithologies, value)
+
+        # first sample of each CPT that is not filtered
+        index = np.arange(len(to_filter))
+        next_kept = np.minimum.accumulate(np.where(to_filter, len(to_filter), index)[::-1])[::-1]
+        starts = self.offsets[:-1]
+        self.nb_filtered = np.minimum(next_kept[starts], self.offsets[1:]) - starts
+        return
+
+    def unpack(self):
+        """
+        Hand back the results to the CPTs. The attributes of the CPTs are views of the arrays of the batch.
+        The filtered samples are removed from the CPTs.
+
+        :return: list of CPT objects
+        """
+
+        attributes = ["tip", "friction", "friction_nbr", "water", "qt", "gamma", "rho", "total_stress",
+                      "effective_stress", "Qtn", "Fr", "n", "n_iterations", "n_converged", "lithology", "litho_points",
+                      "IC", "vs", "G0", "damping", "poisson"]
+
+        for i, cpt in enumerate(self.cpts):
+            rows = slice(self.offsets[i], self.offsets[i + 1])
+            for att in attributes:
+                setattr(cpt, att, getattr(self, att)[rows])
+            cpt.pwp = self.pwp[i]
+            cpt.remove_top(int(self.nb_filtered[i]))
+        return self.cpts
+
+    def __concatenate(self, attribute):
+        if not self.cpts:
+            return np.zeros(0)
+        return np.concatenate([np.asarray(getattr(cpt, attribute), dtype=float) for cpt in self.cpts])
+
+    def __repeat(self, values):
+        return np.repeat(values, self.lengths)
@@ -0,0 +1,180 @@
+"""
+Cache of processed CPTs
+"""
+# import packages
+import os
+import json
+import pickle
+import hashlib
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# version of the cached data. changing it invalidates all existing caches
+CACHE_VERSION = 5
+
+
+class CPTCache:
+    """
+    Cache of processed CPTs
+
+    Neighbouring calculation points share most of their CPTs. The processed CPT profile (see cpt_module.CPTProfile) is
+    stored by BRO id, by a hash of the data of the CPT and by a hash of the methods and settings of the CPT
+    correlations, so that every CPT is processed only once per run. A CPT that changes in a new release of the BRO
+    database gets a new key: only the changed CPTs are processed again.
+    The cache has an in-memory tier (least recently used CPTs are removed) and an optional on-disk tier.
+    """
+
+    def __init__(self, max_size=512, cache_folder=None):
+        """
+        Initialise the cache
+
+        :param max_size: (optional) maximum number of CPTs in memory. Default is 512
+        :param cache_folder: (optional) folder for the on-disk cache. Default is None: no on-disk cache
+        """
+        self.max_size = max_size
+        self.cache_folder = cache_folder
+        self.hits = 0
+        self.misses = 0
+        self.__memory = OrderedDict()
+        self.__lock = threading.Lock()
+
+        # checks if cache_folder exits. If not creates cache_folder
+        if self.cache_folder and not os.path.exists(self.cache_folder):
+            os.makedirs(self.cache_folder)
+        return
+
+    @staticmethod
+    def settings_hash(methods, settings, dtype="float64"):
+        """
+        Hash of the settings that define the processed CPT
+
+        :param methods: Methods for the CPT correlations
+        :param settings: Settings for the optional parameters for the CPT correlations
+        :param dtype: (optional) data type of the processed CPT profiles. Default is float64
+        :return: hash string
+        """
+        definition = {"version": CACHE_VERSION,
+                      "methods": methods,
+                      "settings": settings,
+                      "dtype": dtype}
+        return hashlib.sha1(json.dumps(definition, sort_keys=True, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def cpt_hash(cpt_BRO, water_level):
+        """
+        Hash of the data of a CPT: its metadata, its measurements and the water level at its location
+
+        :param cpt_BRO: cpt information from the BRO
+        :param water_level: water level at the cpt coordinate
+        :return: hash string
+        """
+        metadata = {name: value for name, value in cpt_BRO.items() if name != "dataframe"}
+        cpt_hash = hashlib.sha1(json.dumps([metadata, float(water_level)], sort_keys=True, default=str).encode())
+        for column in cpt_BRO["dataframe"].columns:
+            cpt_hash.update(column.encode())
+            cpt_hash.update(np.ascontiguousarray(cpt_BRO["dataframe"][column].values, dtype=np.float64).tobytes())
+        return cpt_hash.hexdigest()
+
+    @staticmethod
+    def key(bro_id, cpt_hash, settings_hash):
+        """
+        Cache key of a CPT
+
+        :param bro_id: BRO id of the CPT
+        :param cpt_hash: hash of the data of the CPT
+        :param settings_hash: hash of the settings
+        :return: key
+        """
+        return "{}_{}_{}".format(bro_id, cpt_hash, settings_hash)
+
+    def get(self, key):
+        """
+        Get a processed CPT from the cache
+
+        :param key: cache key
+        :return: processed CPT (or the data quality message of the CPT). None if the key is not in the cache
+        """
+        with self.__lock:
+            if key in self.__memory:
+                self.__memory.move_to_end(key)
+                self.hits += 1
+                return self.__memory[key]
+
+        value = None
+        file_name = self.__file_name(key)
+        if file_name and os.path.isfile(file_name):
+            try:
+                with open(file_name, "rb") as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+                logging.warning("Cannot read cached CPT {}: {}".format(file_name, e))
+                value = None
+
+        with self.__lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__add(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        Add a processed CPT to the cache
+
+        :param key: cache key
+        :param value: processed CPT (or the data quality message of the CPT)
+        """
+        with self.__lock:
+            self.__add(key, value)
+
+        file_name = self.__file_name(key)
+        if file_name:
+            # write to a temporary file first: other processes never read a partial file
+            tmp_file = "{}.{}.{}.tmp".format(file_name, os.getpid(), threading.get_ident())
+            try:
+                with open(tmp_file, "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_file, file_name)
+            except OSError as e:
+                logging.warning("Cannot write cached CPT {}: {}".format(file_name, e))
+        return
+
+    def invalidate(self, bro_ids):
+        """
+        Remove the processed CPTs of BRO ids from the cache, for all versions of the CPTs and all settings
+
+        :param bro_ids: list of BRO ids
+        :return: number of removed CPTs
+        """
+        bro_ids = set(bro_ids)
+        removed = 0
+        with self.__lock:
+            for key in [key for key in self.__memory if key.split("_", 1)[0] in bro_ids]:
+                del self.__memory[key]
+                removed += 1
+
+        if self.cache_folder:
+            for file_name in os.listdir(self.cache_folder):
+                key, extension = os.path.splitext(file_name)
+                if extension == ".pkl" and key.split("_", 1)[0] in bro_ids:
+                    try:
+                        os.remove(os.path.join(self.cache_folder, file_name))
+                        removed += 1
+                    except OSError as e:
+                        logging.warning("Cannot remove cached CPT {}: {}".format(file_name, e))
+        return removed
+
+    def __add(self, key, value):
+        self.__memory[key] = value
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.max_size:
+            self.__memory.popitem(last=False)
+        return
+
+    def __file_name(self, key):
+        if not self.cache_folder:
+            return None
+        return os.path.join(self.cache_folder, key + ".pkl")
@@ -3,16 +3,275 @@ CPT module
 """
 # import packages
 import os
+import logging
 import numpy as np
-import more_itertools as mit
-import matplotlib.pylab as plt
-import matplotlib.patches as patches
-from cycler import cycler
 # import OURS packages
+from CPTtool import reporting
 from CPTtool import robertson
 from CPTtool import tools_utils
 from CPTtool import netcdf
 
+# fixed values of the correlations
+g = 9.81
+Pa = 100.
+
+
+def corrected_cone_resistance(tip, water, a):
+    r"""
+    Corrected cone resistance (see :meth:`CPT.qt_calc`)
+
+    :param tip: cone resistance
+    :param water: pore water pressure
+    :param a: cone area ratio (per sample or for all samples)
+    :return: corrected cone resistance
+    """
+    qt = tip + water * (1. - a)
+    qt[qt <= 0] = 0
+    return qt
+
+
+def unit_weight(qt, friction_nbr, method="Robertson", gamma_min=10.5, gamma_max=22, offsets=None):
+    r"""
+    Unit weight (see :meth:`CPT.gamma_calc`)
+
+    :param qt: corrected cone resistance
+    :param friction_nbr: friction number
+    :param method: (optional) Method to compute unit weight: Robertson or Lengkeek. Default is Robertson
+    :param gamma_min: (optional) Minimum gamma. Default is 10.5
+    :param gamma_max: (optional) Maximum gamma. Default is 22
+    :param offsets: (optional) start and end indexes of the CPTs in the arrays. Default is None: one CPT
+    :return: unit weight
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if method == "Robertson":
+            aux = 0.27 * np.log10(friction_nbr) + 0.36 * np.log10(qt / Pa) + 1.236
+            # set lower limit
+            aux = tools_utils.ceil_value(aux, gamma_min / g, offsets=offsets)
+            # set higher limit
+            aux[np.abs(aux) >= gamma_max] = gamma_max / g
+            return aux * g
+        elif method == "Lengkeek":
+            aux = 19. - 4.12 * np.log10(5000. / qt) / np.log10(30. / friction_nbr)
+            # if nan: aux is 19
+            aux[np.isnan(aux)] = 19.
+            # set lower limit
+            aux = tools_utils.ceil_value(aux, gamma_min, offsets=offsets)
+            # set higher limit
+            aux[np.abs(aux) >= gamma_max] = gamma_max
+            return aux
+    raise ValueError("Unit weight method {} is not available".format(method))
+
+
+def density(gamma):
+    r"""
+    Density of soil (see :meth:`CPT.rho_calc`)
+
+    :param gamma: unit weight
+    :return: density
+    """
+    return gamma * 1000. / g
+
+
+def stresses(depth, depth_to_reference, gamma, pwp, offsets=None):
+    r"""
+    Total and effective stress (see :meth:`CPT.stress_calc`)
+
+    :param depth: depth
+    :param depth_to_reference: depth with respect to the reference level
+    :param gamma: unit weight
+    :param pwp: pwp level of each CPT
+    :param offsets: (optional) start and end indexes of the CPTs in the arrays. Default is None: one CPT
+    :return: total stress, effective stress
+    """
+    if offsets is None:
+        offsets = [0, len(depth)]
+    offsets = np.asarray(offsets)
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    lengths = np.diff(offsets)
+
+    # compute depth diff: the last sample of each CPT repeats the previous diff
+    z = np.empty(len(depth))
+    z[:-1] = np.diff(np.abs(depth - np.repeat(depth[starts], lengths)))
+    z[ends - 1] = z[ends - 2]
+    # total stress
+    top = np.array([np.mean(gamma[start:min(start + 10, end)]) for start, end in zip(starts, ends)])
+    total_stress = tools_utils.segmented_cumsum(gamma * z, offsets) + np.repeat(depth[starts] * top, lengths)
+    # compute pwp
+    # determine location of phreatic line: it cannot be above the CPT depth
+    z_aux = np.minimum(pwp, depth_to_reference[starts] + depth[starts])
+    pore_pressure = (np.repeat(z_aux, lengths) - depth_to_reference) * g
+    # no suction is allowed
+    pore_pressure[pore_pressure <= 0] = 0
+    # compute effective stress
+    effective_stress = total_stress - pore_pressure
+    # if effective stress is negative -> effective stress = 0
+    effective_stress[effective_stress <= 0] = 0
+    return total_stress, effective_stress
+
+
+def normalised_resistance(tip, friction, effective_stress, total_stress, n):
+    r"""
+    Normalised cone resistance Qtn and friction ratio Fr (see :meth:`CPT.norm_calc`)
+
+    :param tip: cone resistance
+    :param friction: friction
+    :param effective_stress: effective stress
+    :param total_stress: total stress
+    :param n: stress exponent
+    :return: Qtn, Fr
+    """
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        # parameter Cn
+        Cn = (Pa / effective_stress) ** n
+        # calculation Q and F
+        Q = (tip - total_stress) / Pa * Cn
+        F = friction / (tip - total_stress) * 100
+    # Q and F cannot be negative. if negative, log10 will be infinite.
+    # These values are limited by the contours of soil behaviour of Robertson
+    Q[Q <= 1.] = 1.
+    F[F <= 0.1] = 0.1
+    Q[Q >= 1000.] = 1000.
+    F[F >= 10.] = 10.
+    return Q, F
+
+
+def behaviour_index(Qtn, Fr):
+    r"""
+    Soil behaviour type index IC (see :meth:`CPT.IC_calc`)
+
+    :param Qtn: normalised cone resistance
+    :param Fr: normalised friction ratio
+    :return: IC
+    """
+    return ((3.47 - np.log10(Qtn)) ** 2. + (np.log10(Fr) + 1.22) ** 2.) ** 0.5
+
+
+def shear_wave_velocity(qt, friction, IC, Fr, depth, gamma, total_stress, effective_stress, method="Robertson",
+                        offsets=None):
+    r"""
+    Shear wave velocity (see :meth:`CPT.vs_calc`)
+
+    :param qt: corrected cone resistance
+    :param friction: friction
+    :param IC: soil behaviour type index
+    :param Fr: normalised friction ratio
+    :param depth: depth
+    :param gamma: unit weight
+    :param total_stress: total stress
+    :param effective_stress: effective stress
+    :param method: (optional) Method to compute the shear wave velocity: Robertson, Mayne, Andrus, Zang or Ahmed.
+                   Default is Robertson
+    :param offsets: (optional) start and end indexes of the CPTs in the arrays. Default is None: one CPT
+    :return: shear wave velocity
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if method == "Robertson":
+            # vs: following Robertson and Cabal (2015)
+            alpha_vs = 10 ** (0.55 * IC + 1.68)
+            vs = alpha_vs * (qt - total_stress) / Pa
+            return tools_utils.ceil_value(vs, 0, offsets=offsets) ** 0.5
+        elif method == "Mayne":
+            # vs: following Mayne (2006)
+            vs = 118.8 * np.log10(friction) + 18.5
+        elif method == "Andrus":
+            # vs: following Andrus (2007)
+            vs = 2.27 * qt ** 0.412 * IC ** 0.989 * depth ** 0.033 * 1
+        elif method == "Zang":
+            # vs: following Zang & Tong (2017)
+            vs = 10.915 * qt ** 0.317 * IC ** 0.210 * depth ** 0.057 * 0.92
+        elif method == "Ahmed":
+            vs = 1000. * np.exp(-0.887 * IC) * (1. + 0.443 * Fr * effective_stress / Pa * g / gamma) ** 0.5
+        else:
+            raise ValueError("Shear wave velocity method {} is not available".format(method))
+        return tools_utils.ceil_value(vs, 0, offsets=offsets)
+
+
+def damping(lithology, qt, Qtn, total_stress, effective_stress, method="Mayne", d_min=2, Cu=2., D50=0.2, Ip=40.,
+            freq=1.):
+    r"""
+    Damping (see :meth:`CPT.damp_calc`)
+
+    :param lithology: lithology (Robertson soil type)
+    :param qt: corrected cone resistance
+    :param Qtn: normalised cone resistance
+    :param total_stress: total stress
+    :param effective_stress: effective stress
+    :param method: (optional) Method for calculation of OCR. Default is Mayne
+    :param d_min: (optional) Minimum damping. Default is 2%
+    :param Cu: (optional) Coefficient of uniformity. Default is 2.0
+    :param D50: (optional) Median grain size. Default is 0.2 mm
+    :param Ip: (optional) Plasticity index. Default is 40
+    :param freq: (optional) Frequency. Default is 1 Hz
+    :return: damping (dimensionless)
+    """
+    # assign size to damping
+    damp = np.zeros(len(lithology)) + d_min
+    OCR = np.zeros(len(lithology))
+
+    clay = np.isin(lithology, [3, 4, 5])
+    peat = np.isin(lithology, [1, 2])
+    sand = ~(clay | peat)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stress_ratio = effective_stress / Pa
+        # if clay
+        if method == "Mayne":
+            OCR[clay] = 0.33 * (qt[clay] - total_stress[clay]) / effective_stress[clay]
+        elif method == "Robertson":
+            OCR[clay] = 0.25 * Qtn[clay] ** 1.25
+        damp[clay] = (0.8005 + 0.0129 * Ip * OCR[clay] ** (-0.1069)) * \
+            stress_ratio[clay] ** (-0.2889) * (1 + 0.2919 * np.log(freq))
+        # if peat: same as clay: OCR=1 IP=100
+        damp[peat] = 2.512 * stress_ratio[peat] ** -0.2889
+        # if sand
+        damp[sand] = 0.55 * Cu ** 0.1 * D50 ** -0.3 * stress_ratio[sand] ** -0.08
+
+    # limit the damping (when stress is zero damping is infinite)
+    damp[damp == np.inf] = 100
+    # damping units -> dimensionless
+    return damp / 100
+
+
+def stress_exponent_summary(n_iterations, converged):
+    r"""
+    Summary of the iterations of the stress exponent of a CPT (see :meth:`CPT.norm_calc`)
+
+    :param n_iterations: number of iterations per sample
+    :param converged: converged samples
+    :return: dictionary with the mean and maximum number of iterations, the number of samples that did not converge
+             and the number of samples
+    """
+    n_iterations = np.asarray(n_iterations)
+    converged = np.asarray(converged, dtype=bool)
+    if len(n_iterations) == 0:
+        return {"mean_iterations": 0., "max_iterations": 0, "not_converged": 0, "samples": 0}
+    return {"mean_iterations": float(np.mean(n_iterations)),
+            "max_iterations": int(np.max(n_iterations)),
+            "not_converged": int(np.sum(~converged)),
+            "samples": len(n_iterations)}
+
+
+def poisson_ratio(lithology, depth_to_reference, pwp):
+    r"""
+    Poisson ratio (see :meth:`CPT.poisson_calc`)
+
+    :param lithology: lithology (Robertson soil type)
+    :param depth_to_reference: depth with respect to the reference level
+    :param pwp: pwp level (per sample or for all samples)
+    :return: Poisson ratio
+    """
+    # assign size to poisson
+    poisson = np.zeros(len(lithology)) + 0.375
+
+    poisson[np.isin(lithology, [5, 6, 7])] = 0.3
+    poisson[lithology == 4] = 0.25
+    # if soft layer
+    poisson[np.isin(lithology, [1, 2, 3])] = 0.495
+    # If below pwp level -> 0.495
+    poisson[depth_to_reference <= pwp] = 0.495
+    return poisson
+
 
 class CPT:
     r"""
@@ -42,6 +301,8 @@ class CPT:
         self.Fr = []
         self.IC = []
         self.n = []
+        self.n_iterations = []
+        self.n_converged = []
         self.vs = []
         self.G0 = []
         self.poisson = []
@@ -63,12 +324,12 @@ class CPT:
 
         # checks if file_path exits. If not creates file_path
         if not os.path.exists(out_fold):
-            os.makedirs(out_fold)
+            os.makedirs(out_fold, exist_ok=True)
         self.output_folder = out_fold
 
         # fixed values
-        self.g = 9.81
-        self.Pa = 100.
+        self.g = g
+        self.Pa = Pa
         self.default_a = 0.8
 
         # private variables
@@ -88,13 +349,16 @@ class CPT:
         :return:
         """
 
+        # the BRO cpt dataset can be shared between scenarios: do not modify it
+        cpt = dict(cpt)
+
         # remove NAN columns from the dataframe
         cpt["dataframe"] = cpt["dataframe"].dropna(how="all", axis=1)
         # remove NAN rows from the dataframe
         cpt["dataframe"] = cpt["dataframe"].dropna(how="any", axis=0)
 
         # check if file contains data
-        if len(cpt["dataframe"].penetrationLength) == 0:
+        if "penetrationLength" not in cpt["dataframe"] or len(cpt["dataframe"].penetrationLength) == 0:
             message = "File " + cpt["id"] + " contains no data"
             return message
 
@@ -337,31 +601,31 @@ class CPT:
         Computes the lithology following Robertson and Cabal :cite:`robertson_cabal_2014`.
         """
 
-        classification = robertson.Robertson()
-        classification.soil_types()
+        classification = robertson.shared_classification()
 
         # compute Qtn and Fr
         self.norm_calc()
 
-        litho, points = classification.lithology(self.Qtn, self.Fr)
-
-        # assign to variables
-        self.lithology = litho
-        self.litho_points = points
+        # lithology as integer array (Robertson soil type 1 to 9)
+        self.lithology = classification.classify(self.Qtn, self.Fr).astype(np.int8)
+        self.litho_points = np.column_stack([np.asarray(self.Fr, dtype=float), np.asarray(self.Qtn, dtype=float)])
 
         return
 
-    def pwp_level_calc(self, path_bro):
+    def pwp_level_calc(self, path_bro, water_level=None):
         """
         Computes the estimated pwp level for the cpt coordinate
 
         :param path_bro: path for the location of the netCDF file with expected water levels
+        :param water_level: (optional) water level at the cpt coordinate, if already queried. Default is None
         :return:
         """
-        pwp = netcdf.NetCDF()
-        pwp.read_cdffile(path_bro)
-        pwp.query(self.coord[0], self.coord[1])
-        self.pwp = pwp.NAP_water_level
+        if water_level is not None:
+            self.pwp = water_level
+            return
+
+        # the water level grid is read only once per process
+        self.pwp = netcdf.water_level_grid(path_bro).query(self.coord[0], self.coord[1])
 
         return
 
@@ -394,33 +658,16 @@ class CPT:
         # ignore divisions warnings
         np.seterr(divide="ignore", invalid='ignore', over='print')
 
-        # calculate unit weight according to Robertson & Cabal 2015
-        if method == "Robertson":
-            aux = 0.27 * np.log10(self.friction_nbr) + 0.36 * np.log10(self.qt / self.Pa) + 1.236
-            # set lower limit
-            aux = tools_utils.ceil_value(aux, gamma_min / self.g)
-            # set higher limit
-            aux[np.abs(aux) >= gamma_max] = gamma_max / self.g
-            # assign gamma
-            self.gamma = aux * self.g
-
-        elif method == "Lengkeek":
-            aux = 19. - 4.12 * np.log10(5000. / self.qt) / np.log10(30. / self.friction_nbr)
-            # if nan: aux is 19
-            aux[np.isnan(aux)] = 19.
-            # set lower limit
-            aux = tools_utils.ceil_value(aux, gamma_min)
-            # set higher limit
-            aux[np.abs(aux) >= gamma_max] = gamma_max
-            # assign gamma
-            self.gamma = aux
-
-        elif method == "all":  # if all, compares all the methods and plot
+        if method == "all":  # if all, compares all the methods and plot
             self.gamma_calc(method="Lengkeek")
             gamma_1 = self.gamma
             self.gamma_calc(method="Robertson")
             gamma_2 = self.gamma
             self.plot_correlations([gamma_1, gamma_2], "Unit Weight [kN/m3]", ["Lengkeek", "Robertson"], "unit_weight")
+        else:
+            # calculate unit weight according to Robertson & Cabal 2015 or Lengkeek
+            self.gamma = unit_weight(self.qt, self.friction_nbr, method=method, gamma_min=gamma_min,
+                                     gamma_max=gamma_max)
         return
 
     def rho_calc(self):
@@ -434,7 +681,7 @@ class CPT:
             \rho = \frac{\gamma}{g}
         """
 
-        self.rho = self.gamma * 1000. / self.g
+        self.rho = density(self.gamma)
         return
 
     def stress_calc(self):
@@ -442,21 +689,7 @@ class CPT:
         Computes total and effective stress
         """
 
-        # compute depth diff
-        z = np.diff(np.abs((self.depth - self.depth[0])))
-        z = np.append(z, z[-1])
-        # total stress
-        self.total_stress = np.cumsum(self.gamma * z) + self.depth[0] * np.mean(self.gamma[:10])
-        # compute pwp
-        # determine location of phreatic line: it cannot be above the CPT depth
-        z_aux = np.min([self.pwp, self.depth_to_reference[0] + self.depth[0]])
-        pwp = (z_aux - self.depth_to_reference) * self.g
-        # no suction is allowed
-        pwp[pwp <= 0] = 0
-        # compute effective stress
-        self.effective_stress = self.total_stress - pwp
-        # if effective stress is negative -> effective stress = 0
-        self.effective_stress[self.effective_stress <= 0] = 0
+        self.total_stress, self.effective_stress = stresses(self.depth, self.depth_to_reference, self.gamma, self.pwp)
         return
 
     def norm_calc(self, n_method=False):
@@ -477,42 +710,22 @@ class CPT:
 
         # normalisation of qc and friction into Qtn and Fr: following Robertson and Cabal (2014)
 
-        # iteration around n to compute IC
-        # start assuming n=1 for IC calculation
-        n = np.ones(len(self.tip))
-
         # switch for the n calculation. default is iterative process
         if not n_method:
-            tol = 1.e-12
-            error = 1
-            max_ite = 10000
-            itr = 0
-            while error >= tol:
-                # if did not converge
-                if itr >= max_ite:
-                    n = np.ones(len(self.tip)) * 0.5
-                    break
-                n1 = tools_utils.n_iter(n, self.tip, self.friction_nbr, self.effective_stress, self.total_stress,
-                                        self.Pa)
-                error = np.linalg.norm(n1 - n) / np.linalg.norm(n1)
-                n = n1
-                itr += 1
+            # iteration around n to compute IC: each sample converges on its own
+            n, self.n_iterations, self.n_converged = tools_utils.n_solve(self.tip, self.friction_nbr,
+                                                                         self.effective_stress, self.total_stress,
+                                                                         self.Pa)
+            if not all(self.n_converged):
+                logging.debug("CPT {}: stress exponent did not converge for {} of {} samples. n=0.5 is used".format(
+                    self.name, np.sum(~self.n_converged), len(self.n_converged)))
         else:
             n = np.ones(len(self.tip)) * 0.5
+            self.n_iterations = np.zeros(len(self.tip), dtype=int)
+            self.n_converged = np.ones(len(self.tip), dtype=bool)
 
-        # parameter Cn
-        Cn = (self.Pa / self.effective_stress) ** n
         # calculation Q and F
-        Q = (self.tip - self.total_stress) / self.Pa * Cn
-        F = self.friction / (self.tip - self.total_stress) * 100
-        # Q and F cannot be negative. if negative, log10 will be infinite.
-        # These values are limited by the contours of soil behaviour of Robertson
-        Q[Q <= 1.] = 1.
-        F[F <= 0.1] = 0.1
-        Q[Q >= 1000.] = 1000.
-        F[F >= 10.] = 10.
-        self.Qtn = Q
-        self.Fr = F
+        self.Qtn, self.Fr = normalised_resistance(self.tip, self.friction, self.effective_stress, self.total_stress, n)
         self.n = n
 
         return
@@ -528,8 +741,7 @@ class CPT:
         """
 
         # IC: following Robertson and Cabal (2015)
-        # compute IC
-        self.IC = ((3.47 - np.log10(self.Qtn)) ** 2. + (np.log10(self.Fr) + 1.22) ** 2.) ** 0.5
+        self.IC = behaviour_index(self.Qtn, self.Fr)
         return
 
     def vs_calc(self, method="Robertson"):
@@ -573,34 +785,7 @@ class CPT:
             v_{s} = 1000 \cdot e^{-0.887 \cdot I_{c}} \cdot \left( \left(1 + 0.443 \cdot F_{r} \right) \cdot \left(\frac{\sigma'_{v}}{p_{a}} \right) \cdot \left(\frac{\gamma_{w}}{\gamma} \right) \right)^{0.5}
         """
 
-        if method == "Robertson":
-            # vs: following Robertson and Cabal (2015)
-            alpha_vs = 10 ** (0.55 * self.IC + 1.68)
-            vs = alpha_vs * (self.qt - self.total_stress) / self.Pa
-            vs = tools_utils.ceil_value(vs, 0)
-            self.vs = vs ** 0.5
-            self.G0 = self.rho * self.vs ** 2
-        elif method == "Mayne":
-            # vs: following Mayne (2006)
-            vs = 118.8 * np.log10(self.friction) + 18.5
-            self.vs = tools_utils.ceil_value(vs, 0)
-            self.G0 = self.rho * self.vs ** 2
-        elif method == "Andrus":
-            # vs: following Andrus (2007)
-            vs = 2.27 * self.qt ** 0.412 * self.IC ** 0.989 * self.depth ** 0.033 * 1
-            self.vs = tools_utils.ceil_value(vs, 0)
-            self.G0 = self.rho * self.vs ** 2
-        elif method == "Zang":
-            # vs: following Zang & Tong (2017)
-            vs = 10.915 * self.qt ** 0.317 * self.IC ** 0.210 * self.depth ** 0.057 * 0.92
-            self.vs = tools_utils.ceil_value(vs, 0)
-            self.G0 = self.rho * self.vs ** 2
-        elif method == "Ahmed":
-            vs = 1000. * np.exp(-0.887 * self.IC) * (1. + 0.443 * self.Fr * self.effective_stress / self.Pa * self.g
-                                                     / self.gamma) ** 0.5
-            self.vs = tools_utils.ceil_value(vs, 0)
-            self.G0 = self.rho * self.vs ** 2
-        elif method == "all":  # compares all and assumes default
+        if method == "all":  # compares all and assumes default
             self.vs_calc(method="Mayne")
             vs1 = self.vs
             G0_1 = self.G0
@@ -620,6 +805,10 @@ class CPT:
                                    ["Mayne", "Robertson", "Andrus", "Zang", "Ahmed"], "shear_wave")
             self.plot_correlations([G0_1, G0_2, G0_3, G0_4, G0_5], "Shear modulus [kPa]",
                                    ["Mayne", "Robertson", "Andrus", "Zang", "Ahmed"], "shear_modulus")
+        else:
+            self.vs = shear_wave_velocity(self.qt, self.friction, self.IC, self.Fr, self.depth, self.gamma,
+                                          self.total_stress, self.effective_stress, method=method)
+            self.G0 = self.rho * self.vs ** 2
         return
 
     def damp_calc(self, method="Mayne", d_min=2, Cu=2., D50=0.2, Ip=40., freq=1.):
@@ -657,31 +846,8 @@ class CPT:
         :param freq: (optional) Frequency. Default is 1 Hz
         """
 
-        # assign size to damping
-        self.damping = np.zeros(len(self.lithology)) + d_min
-        OCR = np.zeros(len(self.lithology))
-
-        for i, lit in enumerate(self.lithology):
-            # if  clay
-            if lit == "3" or lit == "4" or lit == "5":
-                if method == "Mayne":
-                    OCR[i] = 0.33 * (self.qt[i] - self.total_stress[i]) / self.effective_stress[i]
-                elif method == "Robertson":
-                    OCR[i] = 0.25 * self.Qtn[i] ** 1.25
-                self.damping[i] = (0.8005 + 0.0129 * Ip * OCR[i] ** (-0.1069)) * \
-                                  (self.effective_stress[i] / self.Pa) ** (-0.2889) * (1 + 0.2919 * np.log(freq))
-            # if peat
-            elif lit == "1" or lit == "2":
-                # same as clay: OCR=1 IP=100
-                self.damping[i] = 2.512 * (self.effective_stress[i] / self.Pa) ** -0.2889
-            # if sand
-            else:
-                self.damping[i] = 0.55 * Cu ** 0.1 * D50 ** -0.3 * (self.effective_stress[i] / self.Pa) ** -0.08
-
-        # limit the damping (when stress is zero damping is infinite)
-        self.damping[self.damping == np.inf] = 100
-        # damping units -> dimensionless
-        self.damping /= 100
+        self.damping = damping(self.lithology, self.qt, self.Qtn, self.total_stress, self.effective_stress,
+                               method=method, d_min=d_min, Cu=Cu, D50=D50, Ip=Ip, freq=freq)
         return
 
     def poisson_calc(self):
@@ -691,23 +857,7 @@ class CPT:
         Poisson assumed 0.495 for soft layers, 0.2 for silty layers and 0.3 for sandy layers.
         """
 
-        # assign size to poisson
-        self.poisson = np.zeros(len(self.lithology))
-
-        for i, lit in enumerate(self.lithology):
-            # If below pwp level -> 0.495
-            if self.depth_to_reference[i] <= self.pwp:
-                self.poisson[i] = 0.495
-            # if soft layer
-            elif lit == "1" or lit == "2" or lit == "3":
-                self.poisson[i] = 0.495
-            elif lit == "4":
-                self.poisson[i] = 0.25
-            elif lit == "5" or lit == "6" or lit == "7":
-                self.poisson[i] = 0.3
-            else:
-                self.poisson[i] = 0.375
-
+        self.poisson = poisson_ratio(self.lithology, self.depth_to_reference, self.pwp)
         return
 
     def qt_calc(self):
@@ -721,8 +871,7 @@ class CPT:
 
         # qt computed following Robertson & Cabal (2015)
         # qt = qc + u2 * (1 - a)
-        self.qt = self.tip + self.water * (1. - self.a)
-        self.qt[self.qt <= 0] = 0
+        self.qt = corrected_cone_resistance(self.tip, self.water, self.a)
         return
 
     def filter(self, lithologies=[""], key="G0", value=0):
@@ -737,36 +886,48 @@ class CPT:
         :param value: value of the key to be limited
         :return:
         """
-        # attributes to be changed
-        attributes = ["depth", "depth_to_reference", "tip", "friction", "friction_nbr", "gamma", "rho", "total_stress",
-                      "effective_stress", "qt", "Qtn", "Fr", "IC", "n", "vs", "G0", "poisson", "damping", "water",
-                      "lithology", "litho_points", "inclination_resultant"]
+        # samples of the lithologies to be filtered (lithologies are given as labels: "1" to "9"),
+        # where the key attribute is smaller than the value
+        to_filter = self.filter_mask(self.lithology, getattr(self, key), lithologies, value)
+
+        # remove the first consecutive samples
+        self.remove_top(int(np.sum(np.cumprod(to_filter))))
+        return
 
-        # find indexes of the lithologies to be filtered
-        idx_lito = []
-        for lit in lithologies:
-            idx_lito.extend([i for i, val in enumerate(self.lithology) if val == lit])
+    @staticmethod
+    def filter_mask(lithology, data, lithologies, value):
+        """
+        Samples to be filtered: samples of the **lithologies**, where the **data** is smaller than the **value**
 
-        # find indexes where the key attribute is smaller than the value
-        idx_key = np.where(getattr(self, key) <= value)[0].tolist()
+        :param lithology: lithology of the samples
+        :param data: values of the key to be filtered
+        :param lithologies: list of lithologies to be filtered
+        :param value: value of the key to be limited
+        :return: boolean array
+        """
+        codes = [int(lit) for lit in lithologies if str(lit).isdigit()]
+        return np.isin(lithology, codes) & (np.asarray(data) <= value)
 
-        # intercept indexes: append
-        idx = list(set(idx_lito) & set(idx_key))
+    def remove_top(self, nb_samples):
+        """
+        Removes the first samples of the CPT. The depth is corrected to start at zero.
+        The attributes are views of the previous attributes.
 
+        :param nb_samples: number of samples to be removed
+        :return:
+        """
         # if nothing to delete : return
-        if not idx:
+        if nb_samples == 0:
             return
 
-        # find first consecutive indexes
-        idx_to_delete = [list(group) for group in mit.consecutive_groups(idx)][0]
-
-        # check if zeros is in idx_to_delete: otherwise return
-        if 0 not in idx_to_delete:
-            return
+        # attributes to be changed
+        attributes = ["depth", "depth_to_reference", "tip", "friction", "friction_nbr", "gamma", "rho", "total_stress",
+                      "effective_stress", "qt", "Qtn", "Fr", "IC", "n", "vs", "G0", "poisson", "damping", "water",
+                      "lithology", "litho_points", "inclination_resultant"]
 
-        # delete all attributes
+        # delete the samples of all attributes
         for att in attributes:
-            setattr(self, att, getattr(self, att)[idx_to_delete[-1] + 1:])
+            setattr(self, att, getattr(self, att)[nb_samples:])
 
         # correct depth
         self.depth -= self.depth[0]
@@ -775,7 +936,7 @@ class CPT:
 
     def plot_correlations(self, x_data, x_label, l_name, name):
         """
-        Plot CPT correlations.
+        Plot CPT correlations (see reporting.plot_correlations).
 
         Parameters
         ----------
@@ -784,196 +945,32 @@ class CPT:
         :param l_name: name of the different correlations within the dataset
         :param name: name for the output file
         """
-
-        # data
-        y_data = self.depth
-        y_label = "Depth [m]"
-
-        # set the color list
-        colormap = plt.cm.gist_ncar
-        colors = [colormap(i) for i in np.linspace(0, 0.9, len(x_data))]
-        plt.gca().set_prop_cycle(cycler('color', colors))
-        plt.figure(figsize=(4, 6))
-
-        # plot for each y_value
-        for i in range(len(x_data)):
-            plt.plot(x_data[i], y_data, label=l_name[i])
-
-        plt.xlabel(x_label, fontsize=12)
-        plt.ylabel(y_label, fontsize=12)
-        plt.grid()
-        plt.legend(loc=1, prop={'size': 12})
-        # invert y axis
-        plt.gca().invert_yaxis()
-        plt.tight_layout()
-        # save the figure
-        plt.savefig(os.path.join(self.output_folder, self.name + "_" + name) + ".png")
-        plt.close()
+        reporting.plot_correlations(self, x_data, x_label, l_name, name)
         return
 
     def plot_cpt(self, nb_plots=6):
         """
-        Plot CPT values.
+        Plot CPT values (see reporting.plot_cpt).
 
         Parameters
         ----------
         :param nb_plots: (optional) number of plots
         """
-        # data
-        x_data = [self.tip, self.friction_nbr, self.rho, self.G0, self.poisson, self.damping]
-        y_data = self.depth
-        l_name = ["Tip resistance", "Friction number", "Density", "Shear modulus", "Poisson ratio", "Damping"]
-        x_label = ["Tip resistance [kPa]", "Friction number [-]", r"Density [kg/m$^{3}$]", "Shear modulus [kPa]",
-                   "Poisson ratio [-]", "Damping [-]"]
-        y_label = "Depth [m]"
-
-        # set the color list
-        colormap = plt.cm.gist_ncar
-        colors = [colormap(i) for i in np.linspace(0, 0.9, nb_plots)]
-        plt.gca().set_prop_cycle(cycler('color', colors))
-        plt.close()  # close all previous figures
-        fig, ax = plt.subplots(1, nb_plots, figsize=(20, 6))
-
-        # plot for each y_value
-        for i in range(nb_plots):
-            ax[i].plot(list(x_data[i]), list(y_data), label=l_name[i])
-
-            # plt.title(title)
-            ax[i].set_xlabel(x_label[i], fontsize=12)
-            ax[i].set_ylabel(y_label, fontsize=12)
-            ax[i].grid()
-            ax[i].legend(loc=1, prop={'size': 12})
-            # invert y axis
-            ax[i].invert_yaxis()
-
-        plt.tight_layout()
-        # save the figure
-        fig.savefig(os.path.join(self.output_folder, self.name) + "_cpt.png")
-        plt.close()
+        reporting.plot_cpt(self, nb_plots=nb_plots)
         return
 
     def plot_lithology(self):
         """
-        Plot CPT lithology.
-        """
-
-        # define figure
-        f, (ax1, ax3) = plt.subplots(1, 2, figsize=(7, 10), sharey=True)
-
-        # first subplot - CPT
-        # ax1 tip
-        ax1.set_position([0.15, 0.1, 0.4, 0.8])
-        l1, = ax1.plot(self.tip, self.depth, label="Tip resistance", color="b")
-        ax1.set_xlabel("Tip resistance [kPa]", fontsize=12)
-        ax1.set_ylabel("Depth [m]", fontsize=12)
-        ax1.set_xlim(left=0)
-        # invert y axis
-        ax1.invert_yaxis()
-
-        # ax2 friction number
-        ax2 = ax1.twiny()
-        ax2.set_position([0.15, 0.1, 0.4, 0.8])
-        l2, = ax2.plot(self.friction_nbr, self.depth, label="Friction number", color="r")
-        ax2.set_xlabel("Friction number [-]", fontsize=12)
-        ax2.set_xlim(left=0)
-
-        # align grid
-        ax1.set_xticks(np.linspace(0, ax1.get_xticks()[-1], 5))
-        ax2.set_xticks(np.linspace(0, ax2.get_xticks()[-1], 5))
-
-        # grid
-        ax1.grid()
-
-        # legend
-        plt.legend(handles=[l1, l2], loc="upper right")
-
-        # second subplot - Lithology
-        litho = np.array(self.lithology).astype(int)
-        color_litho = ["red", "brown", "cyan", "blue", "gray", "yellow", "orange", "green", "lightgray"]
-
-        ax3.set_position([0.60, 0.1, 0.05, 0.8])
-        ax3.set_xlim((0, 10.))
-        # remove ticks
-        plt.setp(ax3.get_xticklabels(), visible=False)
-        plt.setp(ax3.get_yticklabels(), visible=False)
-        ax3.tick_params(axis='both', which='both', length=0)
-
-        # thickness
-        diff_depth = np.diff(self.depth)
-
-        # color the field
-        for i in range(len(self.depth) - 1):
-            ax3.add_patch(patches.Rectangle(
-                (0, self.depth[i]),
-                10.,
-                diff_depth[i],
-                fill=True,
-                color=color_litho[litho[i] - 1]))
-
-        # create legend for Robertson
-        for i, c in enumerate(color_litho):
-            ax3.add_patch(patches.Rectangle(
-                (16, ax1.get_ylim()[1] + (ax1.get_ylim()[0] - ax1.get_ylim()[1]) * 0.0425
-                 + (ax1.get_ylim()[0] - ax1.get_ylim()[1]) * 0.02 * i),
-                10.,
-                (ax1.get_ylim()[0] - ax1.get_ylim()[1]) * 0.015,
-                fill=True,
-                color=c,
-                clip_on=False))
-
-        # create text box
-        text = "Robertson classification:\n\n" + \
-               "          Type 1\n" + \
-               "          Type 2\n" + \
-               "          Type 3\n" + \
-               "          Type 4\n" + \
-               "          Type 5\n" + \
-               "          Type 6\n" + \
-               "          Type 7\n" + \
-               "          Type 8\n" + \
-               "          Type 9\n"
-        ax3.annotate(text, xy=(1, 1),
-                     xycoords='axes fraction',
-                     xytext=(20, 0),
-                     fontsize=10,
-                     textcoords='offset pixels',
-                     horizontalalignment='left',
-                     verticalalignment='top')
-
-        # save the figure
-        plt.savefig(os.path.join(self.output_folder, self.name) + "_lithology.png")
-        plt.close()
-
+        Plot CPT lithology (see reporting.plot_lithology).
+        """
+        reporting.plot_lithology(self)
         return
 
     def write_csv(self):
         """
-        Write CSV file into output file.
-        """
-
-        # write csv
-        with open(os.path.join(self.output_folder, str(self.name) + ".csv"), "w") as fo:
-            fo.write("Depth NAP [m];Depth [m];tip [kPa];friction [kPa];friction number [-];lithology [-];gamma [kN/m3];"
-                     "total stress [-kPa];effective stress [kPa];Qtn [-];Fr [-];IC [-];vs [m/s];G0 [kPa];"
-                     "Poisson [-];Damping [-]\n")
-
-            for i in range(len(self.depth_to_reference)):
-                fo.write(str(self.depth_to_reference[i]) + ";" +
-                         str(self.depth[i]) + ";" +
-                         str(self.tip[i]) + ";" +
-                         str(self.friction[i]) + ";" +
-                         str(self.friction_nbr[i]) + ";" +
-                         str(self.lithology[i]) + ";" +
-                         str(self.gamma[i]) + ";" +
-                         str(self.total_stress[i]) + ";" +
-                         str(self.effective_stress[i]) + ";" +
-                         str(self.Qtn[i]) + ";" +
-                         str(self.Fr[i]) + ";" +
-                         str(self.IC[i]) + ";" +
-                         str(self.vs[i]) + ";" +
-                         str(self.G0[i]) + ";" +
-                         str(self.poisson[i]) + ";" +
-                         str(self.damping[i]) + '\n')
+        Write CSV file into output file (see reporting.write_csv).
+        """
+        reporting.write_csv(self)
         return
 
     @staticmethod
@@ -989,3 +986,45 @@ class CPT:
         corrected_depth = np.concatenate((penetration_length[0], penetration_length[0] +
                                           np.cumsum(corrected_d_depth)), axis=None)
         return corrected_depth
+
+
+class CPTProfile:
+    r"""
+    Processed CPT profile
+
+    Compact representation of a processed CPT. It only contains the attributes that are needed for the interpolation
+    (see tools_utils.interpolation), and the summary of the iterations of the stress exponent for the log file.
+    The interpolated attributes can be stored in single precision.
+    """
+    __slots__ = ["name", "coord", "depth_to_reference", "Qtn", "Fr", "G0", "poisson", "rho", "damping", "IC",
+                 "stress_exponent"]
+
+    # attributes of the CPT that are interpolated
+    attributes = ["Qtn", "Fr", "G0", "poisson", "rho", "damping", "IC"]
+
+    def __init__(self, cpt, dtype="float64"):
+        """
+        Profile of a processed CPT
+
+        :param cpt: processed CPT object
+        :param dtype: (optional) data type of the interpolated attributes. Default is float64
+        """
+        self.name = cpt.name
+        self.coord = [cpt.coord[0], cpt.coord[1]]
+        # the depth defines the layers: it is always stored in double precision
+        self.depth_to_reference = np.array(cpt.depth_to_reference, dtype=np.float64)
+        for att in self.attributes:
+            setattr(self, att, np.array(getattr(cpt, att), dtype=dtype))
+        self.stress_exponent = stress_exponent_summary(cpt.n_iterations, cpt.n_converged)
+        return
+
+    def stress_exponent_message(self):
+        """
+        Message for the log file with the summary of the iterations of the stress exponent
+
+        :return: str
+        """
+        return "Stress exponent for {}: mean {:.1f} and maximum {} iterations. " \
+               "{} of {} samples did not converge (n=0.5 is used)".format(
+                   self.name, self.stress_exponent["mean_iterations"], self.stress_exponent["max_iterations"],
+                   self.stress_exponent["not_converged"], self.stress_exponent["samples"])
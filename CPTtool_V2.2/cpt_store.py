@@ -0,0 +1,175 @@
+"""
+Columnar store of BRO CPTs
+"""
+# import packages
+import os
+import json
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import wkt
+
+# version of the store format
+STORE_VERSION = 2
+# metadata of the cpts in the store
+metadata_columns = ['id', 'location_x', 'location_y', 'offset_z', 'predrilled_z', 'a',
+                    'vertical_datum', 'local_reference', 'quality_class', 'cpt_standard', 'in_track',
+                    'research_report_date']
+
+# process-wide stores: opened once per process
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def is_store(path):
+    """
+    Check if a path is a CPT store
+
+    :param path: path to the BRO data
+    :return: boolean
+    """
+    return os.path.isfile(os.path.join(path, "metadata.json"))
+
+
+def write_store(folder, cpts, points, crs, footprint, source, rejected=None):
+    """
+    Write the CPTs to a columnar store
+
+    The store is a folder with one contiguous array per measurement (.npy), the offsets of the CPTs in the
+    measurement arrays and a metadata table (metadata.json). The store is written to a temporary folder, that
+    replaces the existing store when all files are written.
+
+    :param folder: folder of the store
+    :param cpts: list of dictionaries containing the cpt data
+    :param points: array with the coordinates of the cpts in the coordinate system of the BRO spatial layer
+    :param crs: coordinate system of the BRO spatial layer
+    :param footprint: shapely polygon of the area of the store (epsg:28992)
+    :param source: path to the BRO database of the CPTs
+    :param rejected: (optional) research report date of the CPTs in the area that miss required data, by bro_id.
+                     Default is None
+    :return: None
+    """
+    folder = os.path.abspath(folder)
+    tmp_folder = folder + ".tmp"
+    if os.path.isdir(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.makedirs(tmp_folder)
+
+    columns = list(cpts[0]["dataframe"].columns) if cpts else []
+    offsets = np.cumsum([0] + [len(cpt["dataframe"]) for cpt in cpts]).astype(np.int64)
+    for column in columns:
+        data = np.concatenate([cpt["dataframe"][column].values for cpt in cpts]).astype(np.float64)
+        np.save(os.path.join(tmp_folder, column + ".npy"), data)
+    np.save(os.path.join(tmp_folder, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp_folder, "points.npy"), np.asarray(points, dtype=np.float64).reshape(len(cpts), 2))
+
+    metadata = {"version": STORE_VERSION,
+                "source": os.path.abspath(source),
+                "crs": crs,
+                "footprint": footprint.wkt,
+                "columns": columns,
+                "cpts": [[to_json(cpt.get(name)) for name in metadata_columns] for cpt in cpts],
+                "rejected": rejected or {}}
+    with open(os.path.join(tmp_folder, "metadata.json"), "w") as f:
+        json.dump(metadata, f)
+
+    # replace the existing store
+    with _stores_lock:
+        _stores.pop(folder, None)
+    if os.path.isdir(folder):
+        old_folder = folder + ".old"
+        if os.path.isdir(old_folder):
+            shutil.rmtree(old_folder)
+        os.rename(folder, old_folder)
+        os.rename(tmp_folder, folder)
+        shutil.rmtree(old_folder, ignore_errors=True)
+    else:
+        os.rename(tmp_folder, folder)
+    return
+
+
+def to_json(value):
+    """
+    Convert numpy scalars to json values
+
+    :param value: value
+    :return: json value
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def open_store(folder):
+    """
+    Process-wide CPT store
+
+    The store is opened only once per process. The measurement arrays are memory mapped: they are read-only and
+    shared between all receptors, threads and worker processes.
+
+    :param folder: folder of the store
+    :return: CPTStore object
+    """
+    folder = os.path.abspath(folder)
+    with _stores_lock:
+        if folder not in _stores:
+            _stores[folder] = CPTStore(folder)
+    return _stores[folder]
+
+
+class CPTStore:
+    """
+    Columnar store of BRO CPTs
+    """
+
+    def __init__(self, folder):
+        """
+        Open the store
+
+        :param folder: folder of the store
+        """
+        with open(os.path.join(folder, "metadata.json"), "r") as f:
+            metadata = json.load(f)
+        if metadata["version"] != STORE_VERSION:
+            raise ValueError("CPT store {} has version {}. Version {} is required".format(
+                folder, metadata["version"], STORE_VERSION))
+
+        self.folder = folder
+        self.source = metadata["source"]
+        self.crs = metadata["crs"]
+        self.footprint = wkt.loads(metadata["footprint"])
+        self.columns = metadata["columns"]
+        self.metadata = [dict(zip(metadata_columns, cpt)) for cpt in metadata["cpts"]]
+        self.rejected = metadata["rejected"]
+        self.offsets = np.load(os.path.join(folder, "offsets.npy"))
+        self.points = np.load(os.path.join(folder, "points.npy"))
+        self.data = {column: np.load(os.path.join(folder, column + ".npy"), mmap_mode="r") for column in self.columns}
+        shapely.prepare(self.footprint)
+        return
+
+    def select(self, polygon):
+        """
+        Select the CPTs that intercept a polygon
+
+        :param polygon: shapely polygon in the coordinate system of the store
+        :return: indexes of the CPTs
+        """
+        if len(self.points) == 0:
+            return np.array([], dtype=int)
+        return np.flatnonzero(shapely.intersects_xy(polygon, self.points[:, 0], self.points[:, 1]))
+
+    def cpt(self, i):
+        """
+        CPT data of the store
+
+        :param i: index of the CPT
+        :return: dictionary containing the cpt data
+        """
+        cpt = dict(self.metadata[i])
+        cpt["a"] = np.nan if cpt["a"] is None else cpt["a"]
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+        cpt["dataframe"] = pd.DataFrame({column: np.array(self.data[column][rows]) for column in self.columns},
+                                        columns=self.columns)
+        return cpt
@@ -6,11 +6,25 @@ import os
 import json
 import argparse
 import sys
+import logging
+import traceback
+import concurrent.futures
 # import OURS packages
 from CPTtool import bro
 from CPTtool import log_handler
 from CPTtool import tools_utils
 from CPTtool import cpt_module
+from CPTtool import netcdf
+from CPTtool import cpt_cache
+from CPTtool import robertson
+from CPTtool import cpt_store
+from CPTtool import cpt_batch
+from CPTtool import reporting
+
+# cache of processed cpts of a worker process
+_worker_cache = None
+# properties of the analysis in a worker process: passed once, when the worker is started
+_worker_properties = None
 
 
 def define_methods(input_file):
@@ -157,12 +171,163 @@ def read_json(input_file):
     return data
 
 
+def process_cpt(cpt_BRO, methods, settings, output_folder, bro_data, water_level=None):
+    """
+    Process CPT
+
+    Parse the BRO cpt and compute the CPT correlations
+
+    Parameters
+    ----------
+    :param cpt_BRO: cpt information from the BRO
+    :param methods: Methods for the CPT correlations
+    :param settings: Settings for the optional parameters for the CPT correlations
+    :param output_folder: Folder to save the files
+    :param bro_data: path to the BRO database
+    :param water_level: (optional) water level at the cpt coordinate. Default is None: read from the netCDF file
+    :return: processed cpt, or the data quality message if the cpt is not usable
+    """
+
+    # initialise CPT module
+    cpt = cpt_module.CPT(output_folder)
+    # read data from BRO
+    data_quality = cpt.parse_bro(cpt_BRO,
+                                 minimum_length=settings["minimum_length"], minimum_samples=settings["minimum_samples"],
+                                 minimum_ratio=settings["minimum_ratio"], convert_to_kPa=settings["convert_to_kPa"])
+    # check data quality from the BRO file
+    if data_quality is not True:
+        return data_quality
+    return correlations_cpt(cpt, methods, settings, bro_data, water_level=water_level)
+
+
+def correlations_cpt(cpt, methods, settings, bro_data, water_level=None):
+    """
+    Compute the CPT correlations of a parsed CPT
+
+    Parameters
+    ----------
+    :param cpt: CPT object, parsed from the BRO (see cpt_module.CPT.parse_bro)
+    :param methods: Methods for the CPT correlations
+    :param settings: Settings for the optional parameters for the CPT correlations
+    :param bro_data: path to the BRO database
+    :param water_level: (optional) water level at the cpt coordinate. Default is None: read from the netCDF file
+    :return: processed cpt
+    """
+
+    # smooth data
+    cpt.smooth(nb_points=settings["nb_points"], limit=settings["limit"])
+    # compute qc
+    cpt.qt_calc()
+    # compute unit weight
+    cpt.gamma_calc(method=methods["gamma"], gamma_min=settings["gamma_min"], gamma_max=settings["gamma_max"])
+    # compute density
+    cpt.rho_calc()
+    # compute water pressure level
+    cpt.pwp_level_calc(bro_data, water_level=water_level)
+    # compute stresses: total, effective and pore water pressures
+    cpt.stress_calc()
+    # compute lithology
+    cpt.lithology_calc()
+    # compute IC
+    cpt.IC_calc()
+    # compute shear wave velocity and shear modulus
+    cpt.vs_calc(method=methods["vs"])
+    # compute damping
+    cpt.damp_calc(method=methods["OCR"], d_min=settings["d_min"], Cu=settings["Cu"], D50=settings["D50"],
+                  Ip=settings["Ip"], freq=settings["freq"])
+    # compute Poisson ratio
+    cpt.poisson_calc()
+    # filter values
+    cpt.filter(lithologies=settings["lithologies"], key=settings["key"], value=settings["value"])
+    return cpt
+
+
+def process_cpts(cpts_BRO, methods, settings, output_folder, bro_data, water_levels):
+    """
+    Process CPTs as a batch
+
+    Parse the BRO cpts and compute the CPT correlations of all the cpts at once (see cpt_batch.CPTBatch).
+    The results are the same as of :func:`process_cpt` for each cpt. CPTs that are not longer than the smoothing
+    window, and correlation methods that make plots, are processed one by one.
+
+    Parameters
+    ----------
+    :param cpts_BRO: list of cpt information from the BRO
+    :param methods: Methods for the CPT correlations
+    :param settings: Settings for the optional parameters for the CPT correlations
+    :param output_folder: Folder to save the files
+    :param bro_data: path to the BRO database
+    :param water_levels: water levels at the cpt coordinates
+    :return: list of processed cpts, or the data quality messages of the cpts that are not usable
+    """
+
+    # the correlations that make plots are not available for a batch
+    if methods["gamma"] not in cpt_batch.gamma_methods or methods["vs"] not in cpt_batch.vs_methods:
+        return [process_cpt(cpt_BRO, methods, settings, output_folder, bro_data, water_level=water_level)
+                for cpt_BRO, water_level in zip(cpts_BRO, water_levels)]
+
+    results = []
+    batch = []
+    batch_water_levels = []
+    for cpt_BRO, water_level in zip(cpts_BRO, water_levels):
+        # initialise CPT module
+        cpt = cpt_module.CPT(output_folder)
+        # read data from BRO
+        data_quality = cpt.parse_bro(cpt_BRO,
+                                     minimum_length=settings["minimum_length"],
+                                     minimum_samples=settings["minimum_samples"],
+                                     minimum_ratio=settings["minimum_ratio"], convert_to_kPa=settings["convert_to_kPa"])
+        # check data quality from the BRO file
+        if data_quality is not True:
+            results.append(data_quality)
+        elif settings["nb_points"] < 2 or len(cpt.depth) <= settings["nb_points"]:
+            # cpts that are not longer than the smoothing window are processed on their own
+            results.append(correlations_cpt(cpt, methods, settings, bro_data, water_level=water_level))
+        else:
+            results.append(cpt)
+            batch.append(cpt)
+            batch_water_levels.append(water_level)
+
+    if not batch:
+        return results
+
+    cpts = cpt_batch.CPTBatch(batch)
+    # smooth data
+    cpts.smooth(nb_points=settings["nb_points"], limit=settings["limit"])
+    # compute qc
+    cpts.qt_calc()
+    # compute unit weight
+    cpts.gamma_calc(method=methods["gamma"], gamma_min=settings["gamma_min"], gamma_max=settings["gamma_max"])
+    # compute density
+    cpts.rho_calc()
+    # compute water pressure level
+    cpts.pwp_level_calc(bro_data, water_levels=batch_water_levels)
+    # compute stresses: total, effective and pore water pressures
+    cpts.stress_calc()
+    # compute lithology
+    cpts.lithology_calc()
+    # compute IC
+    cpts.IC_calc()
+    # compute shear wave velocity and shear modulus
+    cpts.vs_calc(method=methods["vs"])
+    # compute damping
+    cpts.damp_calc(method=methods["OCR"], d_min=settings["d_min"], Cu=settings["Cu"], D50=settings["D50"],
+                   Ip=settings["Ip"], freq=settings["freq"])
+    # compute Poisson ratio
+    cpts.poisson_calc()
+    # filter values
+    cpts.filter(lithologies=settings["lithologies"], key=settings["key"], value=settings["value"])
+    cpts.unpack()
+    return results
+
+
 def read_cpt(cpt_BRO, methods, settings, output_folder, input_dictionary, make_plots, index_coordinate, log_file,
-             jsn, scenario):
+             jsn, scenario, cache=None, batch=False, dtype="float64", reporter=None):
     """
     Read CPT
 
-    Read and process cpt files: GEF format
+    Read and process cpt files: GEF format.
+    Only the profiles of the processed cpts (see cpt_module.CPTProfile) are kept for the interpolation.
 
     Parameters
     ----------
@@ -176,60 +341,64 @@ def read_cpt(cpt_BRO, methods, settings, output_folder, input_dictionary, make_p
     :param log_file: Log file for the analysis
     :param jsn: dictionary with the scenarios
     :param scenario: scenario number
+    :param cache: (optional) cache of processed cpts. Default is None: no cache
+    :param batch: (optional) process the cpts as a batch. Default is False
+    :param dtype: (optional) data type of the profiles of the processed cpts. Default is float64
+    :param reporter: (optional) reporter of the processed cpts (see reporting.Reporter). Default is None: the reports
+                     are written directly
     :return: json file with results, bool (True/False) if there results are not empty
     """
 
     is_jsn_modified = False
     # dictionary for the results
     results_cpt = {}
+    # water levels at all the cpt coordinates
+    water_levels = netcdf.water_level_grid(input_dictionary['BRO_data']).query_many(
+        [c["location_x"] for c in cpt_BRO], [c["location_y"] for c in cpt_BRO])
+    # hash of the settings of the processed cpts
+    settings_hash = cpt_cache.CPTCache.settings_hash(methods, settings, dtype=dtype)
+    # processed cpts from the cache, by the version of the cpt data.
+    # the plots are made from the full cpts: the cpts are always processed
+    keys = [cpt_cache.CPTCache.key(c["id"], cpt_cache.CPTCache.cpt_hash(c, water_level), settings_hash)
+            for c, water_level in zip(cpt_BRO, water_levels)]
+    processed = [cache.get(key) if cache is not None and not make_plots else None for key in keys]
+    # process the cpts that are not in the cache
+    missing = [idx_cpt for idx_cpt in range(len(cpt_BRO)) if processed[idx_cpt] is None]
+    if batch:
+        new_cpts = process_cpts([cpt_BRO[idx_cpt] for idx_cpt in missing], methods, settings, output_folder,
+                                input_dictionary['BRO_data'], [water_levels[idx_cpt] for idx_cpt in missing])
+    else:
+        new_cpts = [process_cpt(cpt_BRO[idx_cpt], methods, settings, output_folder, input_dictionary['BRO_data'],
+                                water_level=water_levels[idx_cpt]) for idx_cpt in missing]
+    for idx_cpt, cpt in zip(missing, new_cpts):
+        if isinstance(cpt, cpt_module.CPT):
+            # make the plots (optional)
+            if make_plots:
+                cpt.output_folder = output_folder
+                if reporter is not None:
+                    reporter.submit(cpt)
+                else:
+                    reporting.write_report(cpt)
+            # keep the profile for the interpolation
+            cpt = cpt_module.CPTProfile(cpt, dtype=dtype)
+        processed[idx_cpt] = cpt
+        if cache is not None:
+            cache.put(keys[idx_cpt], cpt)
+
     for idx_cpt in range(len(cpt_BRO)):
         # add message to log file
         log_file.info_message("Reading CPT: " + cpt_BRO[idx_cpt]["id"])
-        # initialise CPT module
-        cpt = cpt_module.CPT(output_folder)
-        # read data from BRO
-        data_quality = cpt.parse_bro(cpt_BRO[idx_cpt],
-                                     minimum_length=settings["minimum_length"], minimum_samples=settings["minimum_samples"],
-                                     minimum_ratio=settings["minimum_ratio"], convert_to_kPa=settings["convert_to_kPa"])
+        cpt = processed[idx_cpt]
         # check data quality from the BRO file
-        if data_quality is not True:
+        if not isinstance(cpt, cpt_module.CPTProfile):
             # If the quality is not good skip this cpt file
-            log_file.error_message(data_quality)
+            log_file.error_message(cpt)
             continue
-        # smooth data
-        cpt.smooth(nb_points=settings["nb_points"], limit=settings["limit"])
-        # compute qc
-        cpt.qt_calc()
-        # compute unit weight
-        cpt.gamma_calc(method=methods["gamma"], gamma_min=settings["gamma_min"], gamma_max=settings["gamma_max"])
-        # compute density
-        cpt.rho_calc()
-        # compute water pressure level
-        cpt.pwp_level_calc(input_dictionary['BRO_data'])
-        # compute stresses: total, effective and pore water pressures
-        cpt.stress_calc()
-        # compute lithology
-        cpt.lithology_calc()
-        # compute IC
-        cpt.IC_calc()
-        # compute shear wave velocity and shear modulus
-        cpt.vs_calc(method=methods["vs"])
-        # compute damping
-        cpt.damp_calc(method=methods["OCR"], d_min=settings["d_min"], Cu=settings["Cu"], D50=settings["D50"],
-                      Ip=settings["Ip"], freq=settings["freq"])
-        # compute Poisson ratio
-        cpt.poisson_calc()
-        # filter values
-        cpt.filter(lithologies=settings["lithologies"], key=settings["key"], value=settings["value"])
-        # make the plots (optional)
-        if make_plots:
-            cpt.write_csv()
-            cpt.plot_cpt()
-            cpt.plot_lithology()
         # update scenario
         results_cpt.update({cpt_BRO[idx_cpt]["id"]: cpt})
         # add to log file that the analysis is successful
         log_file.info_message("Analysis succeeded for: " + cpt_BRO[idx_cpt]["id"])
+        log_file.info_message(cpt.stress_exponent_message())
 
     # Check if the data of all the cpts are empty. If they are skip processing them
     if bool(results_cpt):
@@ -247,125 +416,276 @@ def read_cpt(cpt_BRO, methods, settings, output_folder, input_dictionary, make_p
     return jsn, is_jsn_modified
 
 
-def analysis(properties, methods_cpt, settings_cpt, output, plots):
+def read_bro_point(idx, properties, methods_cpt):
     """
-    Analysis of CPT
+    Reads the BRO data base for one calculation point
 
-    Extracts the CPT from the BRO PDOK database, based on coordinate location and processes the cpt
+    :param idx: index of the calculation point
+    :param properties: JSON file with the properties of the analysis: opened json file
+    :param methods_cpt: methods to use for the CPT interpretation
+    :return: CPTs of the polygons and the circle of the calculation point
+    """
+    inpt = {"BRO_data": properties["BRO_data"],
+            "Source_x": float(properties["Source_x"][idx]), "Source_y": float(properties["Source_y"][idx]),
+            "Radius": float(methods_cpt["radius"]),
+            }
+    return bro.read_bro_gpkg_version(inpt)
+
+
+def analysis_point(idx, properties, methods_cpt, settings_cpt, output, plots, cache=None, cpts=None, batch=False,
+                   dtype="float64", reporter=None):
+    """
+    Analysis of CPT for one calculation point
 
+    Extracts the CPT from the BRO PDOK database, based on coordinate location and processes the cpt.
+    The results and the log file are written for the index of the calculation point.
+
+    :param idx: index of the calculation point
     :param properties: JSON file with the properties of the analysis: opened json file
     :param methods_cpt: methods to use for the CPT interpretation
     :param settings_cpt: settings for the optional parameters for the CPT interpretation
     :param output: path for the output results
     :param plots: boolean create the plots
+    :param cache: (optional) cache of processed cpts. Default is None: no cache
+    :param cpts: (optional) BRO data of the calculation point (see read_bro_point). Default is None: the BRO data is read
+    :param batch: (optional) process the cpts as a batch. Default is False
+    :param dtype: (optional) data type of the profiles of the processed cpts. Default is float64
+    :param reporter: (optional) reporter of the processed cpts (see reporting.Reporter). Default is None: the reports
+                     are written directly
     :return:
     """
-    # number of points
-    nb_points = len(properties["Source_x"])
-
-    # for each calculation point
-    for idx in range(nb_points):
-
-        # probability of scenarios
-        prob = []
-
-        # variables
-        jsn = {"scenarios": []}  # json dictionary
-        scenario = 0  # scenario number
-
-        # Define log file
-        log_file = log_handler.LogFile(output, idx)
-        log_file.info_message("Analysis started for coordinate point: (" + properties["Source_x"][idx] + ", "
-                              + properties["Source_y"][idx] + ")")
-
-        # read BRO data base
-        inpt = {"BRO_data": properties["BRO_data"],
-                "Source_x": float(properties["Source_x"][idx]), "Source_y": float(properties["Source_y"][idx]),
-                "Radius": float(methods_cpt["radius"]),
-                }
-        cpts = bro.read_bro_gpkg_version(inpt)
-
-        results = {}
-        # check points within polygons
-        cpts_polygons = {}
-        polygons_names = []
-        for zone in cpts['polygons']:
-            cpts_polygons.update({zone: {"data": list(filter(None, cpts['polygons'][zone]['data'])),
-                                         "perc": cpts['polygons'][zone]['perc']
-                                         }
-                                  })
-
-            for c in cpts_polygons[zone]["data"]:
-                polygons_names.append(c["id"])
-
-        # process cpts polygons
-        results.update({"polygons": {}})
-        for zone in cpts_polygons:
-            # remove the nones
-            data = list(filter(None, cpts['polygons'][zone]['data']))
-            if data:
-                jsn, is_jsn_modified = read_cpt(data, methods_cpt, settings_cpt, output, properties, plots, idx,
-                                                log_file, jsn, scenario)
-                if is_jsn_modified:
-                    results["polygons"].update({zone: True})
-                    prob.append(cpts['polygons'][zone]['perc'])
-                    jsn["scenarios"][scenario].update({"coordinates": [properties["Receiver_x"][idx], properties["Receiver_y"][idx]],
-                                                       "probability": prob[-1]})
-                    scenario += 1
-
-        # check points within circle
-        cpts_circle = list(filter(None, cpts['circle']['data']))
-        # get cpts that are not in polygons
-        circle_names = []
-        circle_idx = []
-        for j, c in enumerate(cpts_circle):
-            circle_names.append(c["id"])
-            circle_idx.append(j)
-
-        # process only the ones that are not part of polygons
-        names_diff = list(set(circle_names) - set(polygons_names))
-        # get the indexes of the circle cpts to be processed
-        circle_idx = [circle_names.index(n) for n in names_diff]
-        cpts_circle = [cpts_circle[j] for j in circle_idx]
 
+    # probability of scenarios
+    prob = []
+
+    # variables
+    jsn = {"scenarios": []}  # json dictionary
+    scenario = 0  # scenario number
+
+    # Define log file
+    log_file = log_handler.LogFile(output, idx)
+    log_file.info_message("Analysis started for coordinate point: (" + properties["Source_x"][idx] + ", "
+                          + properties["Source_y"][idx] + ")")
+
+    # read BRO data base
+    if cpts is None:
+        cpts = read_bro_point(idx, properties, methods_cpt)
+
+    results = {}
+    # check points within polygons
+    cpts_polygons = {}
+    polygons_names = []
+    for zone in cpts['polygons']:
+        cpts_polygons.update({zone: {"data": list(filter(None, cpts['polygons'][zone]['data'])),
+                                     "perc": cpts['polygons'][zone]['perc']
+                                     }
+                              })
+
+        for c in cpts_polygons[zone]["data"]:
+            polygons_names.append(c["id"])
+
+    # process cpts polygons
+    results.update({"polygons": {}})
+    for zone in cpts_polygons:
         # remove the nones
-        data = list(filter(None, cpts_circle))
-
-        # get indexes of
-        results.update({"circle": []})
+        data = list(filter(None, cpts['polygons'][zone]['data']))
         if data:
-            # if data exists in the circle
-            jsn, is_jsn_modified = read_cpt(data, methods_cpt, settings_cpt, output, properties, plots, idx, log_file,
-                                            jsn, scenario)
+            jsn, is_jsn_modified = read_cpt(data, methods_cpt, settings_cpt, output, properties, plots, idx,
+                                            log_file, jsn, scenario, cache=cache, batch=batch,
+                                            dtype=dtype, reporter=reporter)
             if is_jsn_modified:
-                results["circle"] = True
+                results["polygons"].update({zone: True})
+                prob.append(cpts['polygons'][zone]['perc'])
                 jsn["scenarios"][scenario].update({"coordinates": [properties["Receiver_x"][idx], properties["Receiver_y"][idx]],
-                                                   "probability": 1. - sum(prob)})
+                                                   "probability": prob[-1]})
                 scenario += 1
-        elif jsn["scenarios"]:
-            # if circle is empty and polygons exist: update probability of polygons
-            for i in range(len(jsn["scenarios"])):
-                jsn["scenarios"][i]["probability"] = jsn["scenarios"][i]["probability"] / sum(prob)
-
-        # check if cpts have data or are all empty: this mean that this point has no data
-        if not results["circle"] and not results["polygons"]:
-            log_file.error_message("No data in this coordinate point")
-            log_file.info_message("Analysis finished for coordinate point: (" + str(properties["Source_x"][idx]) + ", "
-                                  + str(properties["Source_y"][idx]) + ")")
-            log_file.close()
-            continue
 
-        # round probability to two decimals
+    # check points within circle
+    cpts_circle = list(filter(None, cpts['circle']['data']))
+    # get cpts that are not in polygons
+    circle_names = []
+    circle_idx = []
+    for j, c in enumerate(cpts_circle):
+        circle_names.append(c["id"])
+        circle_idx.append(j)
+
+    # process only the ones that are not part of polygons
+    names_diff = list(set(circle_names) - set(polygons_names))
+    # get the indexes of the circle cpts to be processed
+    circle_idx = [circle_names.index(n) for n in names_diff]
+    cpts_circle = [cpts_circle[j] for j in circle_idx]
+
+    # remove the nones
+    data = list(filter(None, cpts_circle))
+
+    # get indexes of
+    results.update({"circle": []})
+    if data:
+        # if data exists in the circle
+        jsn, is_jsn_modified = read_cpt(data, methods_cpt, settings_cpt, output, properties, plots, idx, log_file,
+                                        jsn, scenario, cache=cache, batch=batch, dtype=dtype, reporter=reporter)
+        if is_jsn_modified:
+            results["circle"] = True
+            jsn["scenarios"][scenario].update({"coordinates": [properties["Receiver_x"][idx], properties["Receiver_y"][idx]],
+                                               "probability": 1. - sum(prob)})
+            scenario += 1
+    elif jsn["scenarios"]:
+        # if circle is empty and polygons exist: update probability of polygons
         for i in range(len(jsn["scenarios"])):
-            jsn["scenarios"][i]["probability"] = round(jsn["scenarios"][i]["probability"], 3)
+            jsn["scenarios"][i]["probability"] = jsn["scenarios"][i]["probability"] / sum(prob)
 
-        # dump json
-        tools_utils.dump_json(jsn, idx, output)
-
-        # processed cpts
+    # check if cpts have data or are all empty: this mean that this point has no data
+    if not results["circle"] and not results["polygons"]:
+        log_file.error_message("No data in this coordinate point")
         log_file.info_message("Analysis finished for coordinate point: (" + str(properties["Source_x"][idx]) + ", "
                               + str(properties["Source_y"][idx]) + ")")
         log_file.close()
+        return
+
+    # round probability to two decimals
+    for i in range(len(jsn["scenarios"])):
+        jsn["scenarios"][i]["probability"] = round(jsn["scenarios"][i]["probability"], 3)
+
+    # dump json
+    tools_utils.dump_json(jsn, idx, output)
+
+    # processed cpts
+    log_file.info_message("Analysis finished for coordinate point: (" + str(properties["Source_x"][idx]) + ", "
+                          + str(properties["Source_y"][idx]) + ")")
+    log_file.close()
+    return
+
+
+def load_resources(bro_data):
+    """
+    Loads the read-only resources that are shared by all calculation points
+
+    :param bro_data: path to the BRO database
+    :return:
+    """
+    netcdf.water_level_grid(bro_data)
+    robertson.shared_classification()
+    bro.geomorph_data(bro_data)
+    if cpt_store.is_store(bro_data):
+        cpt_store.open_store(bro_data)
+    return
+
+
+def _init_worker(bro_data, cache_folder, properties):
+    """
+    Initialise a worker process of the analysis
+
+    :param bro_data: path to the BRO database
+    :param cache_folder: folder of the on-disk cache of processed cpts (shared by the workers)
+    :param properties: properties of the analysis
+    :return:
+    """
+    global _worker_cache, _worker_properties
+
+    _worker_properties = properties
+    load_resources(bro_data)
+    # file based indexes are opened in the worker itself (file handles are not shared between processes)
+    bro.track_index(os.path.join(os.path.dirname(bro_data), 'buff_track'))
+    _worker_cache = cpt_cache.CPTCache(cache_folder=cache_folder)
+    return
+
+
+def _analysis_point_worker(idx, methods_cpt, settings_cpt, output, plots, batch, dtype):
+    """
+    Analysis of one calculation point in a worker process
+
+    :return: None if the analysis succeeded, otherwise the traceback of the error
+    """
+    try:
+        analysis_point(idx, _worker_properties, methods_cpt, settings_cpt, output, plots, cache=_worker_cache, batch=batch,
+                       dtype=dtype)
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+
+def analysis(properties, methods_cpt, settings_cpt, output, plots, cache=None, workers=1, prefetch=False,
+             batch=False, dtype="float64", report_workers=1):
+    """
+    Analysis of CPT
+
+    Extracts the CPT from the BRO PDOK database, based on coordinate location and processes the cpt
+
+    :param properties: JSON file with the properties of the analysis: opened json file
+    :param methods_cpt: methods to use for the CPT interpretation
+    :param settings_cpt: settings for the optional parameters for the CPT interpretation
+    :param output: path for the output results
+    :param plots: boolean create the plots
+    :param cache: (optional) cache of processed cpts. Default is None: in-memory cache for this analysis
+    :param workers: (optional) number of worker processes. Default is 1: the points are analysed sequentially
+    :param prefetch: (optional) read the BRO data of the next point while the current point is analysed.
+                     Only for the sequential analysis. Default is False
+    :param batch: (optional) process the cpts of a calculation point as a batch. Default is False
+    :param dtype: (optional) data type of the profiles of the processed cpts: float64 or float32. Default is float64
+    :param report_workers: (optional) number of background processes that write the plots of the sequential analysis.
+                           With 0 the plots are written directly. Default is 1
+    :return:
+    """
+    # number of points
+    nb_points = len(properties["Source_x"])
+
+    # cpts are shared between neighbouring points: process each cpt only once
+    if cache is None:
+        cache = cpt_cache.CPTCache()
+
+    # indexes of the geopackage are prepared once, before the points are analysed (and the workers are started)
+    if os.path.isfile(properties["BRO_data"]):
+        bro.prepare_gpkg(properties["BRO_data"])
+
+    if workers > 1:
+        # checks if output exits. If not creates output
+        os.makedirs(output, exist_ok=True)
+        # load the shared resources before the workers are started: forked workers share them
+        load_resources(properties["BRO_data"])
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=(properties["BRO_data"], cache.cache_folder,
+                                                              properties)) as pool:
+            futures = [pool.submit(_analysis_point_worker, idx, methods_cpt, settings_cpt, output, plots, batch, dtype)
+                       for idx in range(nb_points)]
+            for idx, future in enumerate(futures):
+                error = future.result()
+                # add the error to the log file of the calculation point
+                if error is not None:
+                    log_file = log_handler.LogFile(output, idx, mode="a")
+                    log_file.error_message("Analysis failed for coordinate point: (" + str(properties["Source_x"][idx])
+                                           + ", " + str(properties["Source_y"][idx]) + ")\n" + error)
+                    log_file.close()
+                    logging.error("Analysis failed for coordinate point {}".format(idx))
+        return
+
+    # the plots are written in the background, while the points are analysed
+    reporter = reporting.Reporter(workers=report_workers if plots else 0)
+
+    try:
+        if prefetch:
+            # the BRO data of the next point is read in a background thread (with its own connection to the database),
+            # while the current point is analysed
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as reader:
+                next_cpts = reader.submit(read_bro_point, 0, properties, methods_cpt) if nb_points > 0 else None
+                for idx in range(nb_points):
+                    cpts = next_cpts.result()
+                    if idx + 1 < nb_points:
+                        next_cpts = reader.submit(read_bro_point, idx + 1, properties, methods_cpt)
+                    analysis_point(idx, properties, methods_cpt, settings_cpt, output, plots, cache=cache, cpts=cpts,
+                                   batch=batch, dtype=dtype, reporter=reporter)
+        else:
+            # for each calculation point
+            for idx in range(nb_points):
+                analysis_point(idx, properties, methods_cpt, settings_cpt, output, plots, cache=cache, batch=batch,
+                               dtype=dtype, reporter=reporter)
+    finally:
+        # the queued reports are written, also when the analysis fails
+        reporter.close()
+
+    logging.warning("Processed CPTs cache: {} hits, {} misses".format(cache.hits, cache.misses))
+    if os.path.isfile(properties["BRO_data"]):
+        tiles = bro.tile_cache(properties["BRO_data"])
+        logging.warning("BRO tile cache: {} hits, {} misses".format(tiles.hits, tiles.misses))
     return
 
 
@@ -376,6 +696,16 @@ if __name__ == "__main__":
     parser.add_argument('-p', '--plots', help='make plots', required=False, default=False)
     parser.add_argument('-m', '--methods', help='methods for CPT correlations', required=False, default=False)
     parser.add_argument('-s', '--settings', help='settings for CPT correlations', required=False, default=False)
+    parser.add_argument('-c', '--cache', help='folder for the cache of processed CPTs', required=False, default=None)
+    parser.add_argument('-w', '--workers', help='number of worker processes', required=False, default=1, type=int)
+    parser.add_argument('-f', '--prefetch', help='read the BRO data of the next point in the background',
+                        required=False, action='store_true')
+    parser.add_argument('-b', '--batch', help='process the CPTs of a point as a batch', required=False,
+                        action='store_true')
+    parser.add_argument('-d', '--dtype', help='data type of the processed CPTs', required=False, default="float64",
+                        choices=["float64", "float32"])
+    parser.add_argument('-r', '--report_workers', help='number of background processes for the plots', required=False,
+                        default=1, type=int)
     args = parser.parse_args()
 
     # reads input json file
@@ -385,5 +715,9 @@ if __name__ == "__main__":
     # define settings
     settings = define_settings(args.settings)
 
+    # cache of processed CPTs
+    cpt_profiles = cpt_cache.CPTCache(cache_folder=args.cache)
+
     # do analysis
-    analysis(props, methods, settings, args.output, args.plots)
+    analysis(props, methods, settings, args.output, args.plots, cache=cpt_profiles, workers=args.workers,
+             prefetch=args.prefetch, batch=args.batch, dtype=args.dtype, report_workers=args.report_workers)
@@ -5,12 +5,12 @@ Log handler
 import os
 
 class LogFile:
-    def __init__(self, output_folder, index):
+    def __init__(self, output_folder, index, mode="w"):
         # checks if file_path exits. If not creates file_path
         if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
+            os.makedirs(output_folder, exist_ok=True)
 
-        self.file = open(os.path.join(output_folder, "log_file_" + str(index) + ".txt"), "w")
+        self.file = open(os.path.join(output_folder, "log_file_" + str(index) + ".txt"), mode)
         return
 
     def error_message(self, message):
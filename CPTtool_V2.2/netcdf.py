@@ -5,11 +5,17 @@ NetCFD
 import netCDF4
 import numpy as np
 import os
+import threading
 from pyproj import Transformer
+from scipy.spatial import cKDTree
 import logging
 
 transformer = Transformer.from_crs("epsg:28992", "epsg:4326")
 
+# process-wide water level grids: one per netCDF file
+_water_level_grids = {}
+_water_level_lock = threading.Lock()
+
 
 class NetCDF:
 
@@ -18,6 +24,14 @@ class NetCDF:
         self.lat = []  # latitude of dataset points
         self.lon = []  # longitude of dataset points
         self.data = []  # dataset
+        self.lat_axis = []  # latitude of the grid rows
+        self.lon_axis = []  # longitude of the grid columns
+        self.grid = []  # full dataset grid
+        self.valid = []  # grid cells with data
+        self.regular = False  # grid has a constant spacing
+        self.__cells = []  # row and column of the dataset points
+        self.__tree = None  # KDtree of the dataset points
+        self.__tree_lock = threading.Lock()
         return
 
     def read_cdffile(self, bro):
@@ -34,17 +48,27 @@ class NetCDF:
         dataset = netCDF4.Dataset(cdf_file)
 
         # read coordinates
-        lat = dataset.variables['lat'][:]
-        lon = dataset.variables['lon'][:]
-        self.data = dataset.variables["Band1"][:]
+        self.lat_axis = np.asarray(dataset.variables['lat'][:], dtype=float)
+        self.lon_axis = np.asarray(dataset.variables['lon'][:], dtype=float)
+        data = dataset.variables["Band1"][:]
+        self.grid = np.ma.getdata(data)
+        self.valid = ~np.ma.getmaskarray(data)
 
         # only use valid data
-        mlon, mlat = np.meshgrid(lon, lat)
-        self.lat = mlat[~self.data.mask]
-        self.lon = mlon[~self.data.mask]
-        self.data = self.data[~self.data.mask]
+        self.__cells = np.nonzero(self.valid)
+        self.lat = self.lat_axis[self.__cells[0]]
+        self.lon = self.lon_axis[self.__cells[1]]
+        self.data = self.grid[self.__cells]
 
         dataset.close()
+
+        # the nearest cell follows from the row / column arithmetic if the spacing is constant
+        self.regular = all(len(axis) > 1 and np.allclose(np.diff(axis), axis[1] - axis[0], rtol=1e-6, atol=0)
+                           for axis in [self.lat_axis, self.lon_axis])
+
+        # the grid is shared between CPTs (and threads): make it read-only
+        for array in [self.lat, self.lon, self.data, self.lat_axis, self.lon_axis, self.grid, self.valid]:
+            array.setflags(write=False)
         return
 
     def query(self, X, Y):
@@ -53,13 +77,109 @@ class NetCDF:
 
         :param X: coordinate X [RD coordinates]
         :param Y: coordinate Y [RD coordinates]
+        :return: NAP water level at the nearest point with data
         """
 
         # convert to coordinate system of netCDF
         y_lat, x_lon = transformer.transform(X, Y)
 
         # find nearest cell
-        id_min = ((self.lon - x_lon)**2 + (self.lat - y_lat)**2).argmin()
-        self.NAP_water_level = self.data[id_min]
-        logging.debug("For given x: {} (lon: {}) and y: {} (lat: {}), nearest point with data is {} {}".format(X, x_lon, Y, y_lat, self.lon[id_min], self.lat[id_min]))
-        return
+        row, col = self.nearest_cell(np.array([x_lon]), np.array([y_lat]))
+        # the grid is shared between CPTs (and threads): the water level is returned, not stored on the grid
+        NAP_water_level = self.grid[row[0], col[0]]
+        logging.debug("For given x: {} (lon: {}) and y: {} (lat: {}), nearest point with data is {} {}".format(X, x_lon, Y, y_lat, self.lon_axis[col[0]], self.lat_axis[row[0]]))
+        return NAP_water_level
+
+    def query_many(self, X, Y):
+        """
+        Query data for the points X, Y
+
+        :param X: list of coordinates X [RD coordinates]
+        :param Y: list of coordinates Y [RD coordinates]
+        :return: array with the NAP water level at the nearest point with data
+        """
+
+        # convert to coordinate system of netCDF
+        y_lat, x_lon = transformer.transform(np.asarray(X, dtype=float), np.asarray(Y, dtype=float))
+
+        # find nearest cells
+        row, col = self.nearest_cell(np.atleast_1d(x_lon), np.atleast_1d(y_lat))
+        return self.grid[row, col]
+
+    def nearest_cell(self, x_lon, y_lat):
+        """
+        Find the nearest grid cell with data
+
+        On a regular grid the nearest cell follows from the row / column arithmetic. Its 3x3 neighbourhood is checked,
+        to account for the floating point spacing of the grid. Points where the nearest cell has no data, or that are
+        outside the grid, are searched in the KDtree of the cells with data.
+
+        :param x_lon: array of longitudes
+        :param y_lat: array of latitudes
+        :return: row and column of the nearest cells
+        """
+
+        row = np.zeros(len(x_lon), dtype=int)
+        col = np.zeros(len(x_lon), dtype=int)
+        found = np.zeros(len(x_lon), dtype=bool)
+
+        if self.regular:
+            nb_rows, nb_cols = self.grid.shape
+            # direct row / column arithmetic
+            row_0 = np.rint((y_lat - self.lat_axis[0]) / (self.lat_axis[1] - self.lat_axis[0])).astype(int)
+            col_0 = np.rint((x_lon - self.lon_axis[0]) / (self.lon_axis[1] - self.lon_axis[0])).astype(int)
+            inside = (row_0 >= 0) & (row_0 < nb_rows) & (col_0 >= 0) & (col_0 < nb_cols)
+            row_0 = np.clip(row_0, 0, nb_rows - 1)
+            col_0 = np.clip(col_0, 0, nb_cols - 1)
+            found = inside & self.valid[row_0, col_0]
+
+            # nearest valid cell in the neighbourhood
+            distance = np.full(len(x_lon), np.inf)
+            for i in [-1, 0, 1]:
+                for j in [-1, 0, 1]:
+                    r = np.clip(row_0 + i, 0, nb_rows - 1)
+                    c = np.clip(col_0 + j, 0, nb_cols - 1)
+                    d = (self.lon_axis[c] - x_lon) ** 2 + (self.lat_axis[r] - y_lat) ** 2
+                    d[~self.valid[r, c]] = np.inf
+                    closer = d < distance
+                    distance[closer] = d[closer]
+                    row[closer] = r[closer]
+                    col[closer] = c[closer]
+
+        # fallback: nearest cell with data
+        if not all(found):
+            _, id_min = self.__kdtree().query(np.column_stack([x_lon[~found], y_lat[~found]]))
+            row[~found] = self.__cells[0][id_min]
+            col[~found] = self.__cells[1][id_min]
+
+        return row, col
+
+    def __kdtree(self):
+        """
+        KDtree of the cells with data. It is only built when it is needed.
+        """
+        with self.__tree_lock:
+            if self.__tree is None:
+                self.__tree = cKDTree(np.column_stack([self.lon, self.lat]))
+        return self.__tree
+
+
+def water_level_grid(bro):
+    """
+    Process-wide water level grid
+
+    The netCDF file is read only once per process. The grid is read-only, so it can be shared between all CPTs and
+    receptors, between threads, and with forked worker processes (copy-on-write memory).
+
+    :param bro: path to the BRO database. The netCDF file is located in the same folder
+    :return: NetCDF object with the water level grid
+    """
+
+    cdf_file = os.path.abspath(os.path.join(os.path.split(bro)[0], r"peilgebieden_jp_250m.nc"))
+
+    with _water_level_lock:
+        if cdf_file not in _water_level_grids:
+            grid = NetCDF()
+            grid.read_cdffile(bro)
+            _water_level_grids[cdf_file] = grid
+    return _water_level_grids[cdf_file]
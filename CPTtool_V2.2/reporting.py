@@ -0,0 +1,321 @@
+"""
+Reports of the processed CPTs: CSV files and plots
+"""
+# import packages
+import os
+import sys
+import logging
+import multiprocessing
+import concurrent.futures
+import numpy as np
+
+
+def pyplot():
+    """
+    Import of matplotlib, only when the plots are made.
+    The non-interactive backend is used: the figures are only saved to file.
+
+    :return: matplotlib.pyplot module
+    """
+    import matplotlib
+    if "matplotlib.pyplot" not in sys.modules:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def write_report(cpt):
+    """
+    Write the CSV file and the plots of a processed CPT into the output folder of the CPT
+
+    :param cpt: processed CPT object
+    :return:
+    """
+    write_csv(cpt)
+    plot_cpt(cpt)
+    plot_lithology(cpt)
+    return
+
+
+class Reporter:
+    """
+    Reports of the processed CPTs
+
+    The reports are written in a pool of background processes, so that the analysis does not wait for the figures.
+    The processes are started with "spawn": they do not inherit the threads and database connections of the analysis.
+    Without workers the reports are written directly.
+    """
+
+    def __init__(self, workers=0):
+        """
+        Initialise the reporter
+
+        :param workers: (optional) number of background processes. Default is 0: the reports are written directly
+        """
+        self.workers = workers
+        self.__futures = []
+        self.__pool = None
+        if workers > 0:
+            self.__pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                                 mp_context=multiprocessing.get_context("spawn"))
+        return
+
+    def submit(self, cpt):
+        """
+        Write the report of a processed CPT
+
+        :param cpt: processed CPT object. The CPT must not be changed after it is submitted
+        :return:
+        """
+        if self.__pool is None:
+            write_report(cpt)
+            return
+        self.__futures.append((cpt.name, self.__pool.submit(write_report, cpt)))
+        self.__collect(wait=False)
+        return
+
+    def close(self):
+        """
+        Wait for all the reports to be written
+
+        :return:
+        """
+        if self.__pool is not None:
+            self.__collect(wait=True)
+            self.__pool.shutdown()
+            self.__pool = None
+        return
+
+    def __collect(self, wait):
+        # check the finished reports
+        if wait:
+            concurrent.futures.wait([future for _, future in self.__futures])
+        pending = []
+        for name, future in self.__futures:
+            if not future.done():
+                pending.append((name, future))
+            elif future.exception() is not None:
+                logging.error("Report of CPT {} failed: {}".format(name, future.exception()))
+        self.__futures = pending
+        return
+
+
+def plot_correlations(cpt, x_data, x_label, l_name, name):
+    """
+    Plot CPT correlations.
+
+    Parameters
+    ----------
+    :param cpt: CPT object
+    :param x_data: dataset for the plots
+    :param x_label: label of the plots
+    :param l_name: name of the different correlations within the dataset
+    :param name: name for the output file
+    """
+
+    plt = pyplot()
+    from cycler import cycler
+
+    # data
+    y_data = cpt.depth
+    y_label = "Depth [m]"
+
+    # set the color list
+    colormap = plt.cm.gist_ncar
+    colors = [colormap(i) for i in np.linspace(0, 0.9, len(x_data))]
+    plt.gca().set_prop_cycle(cycler('color', colors))
+    plt.figure(figsize=(4, 6))
+
+    # plot for each y_value
+    for i in range(len(x_data)):
+        plt.plot(x_data[i], y_data, label=l_name[i])
+
+    plt.xlabel(x_label, fontsize=12)
+    plt.ylabel(y_label, fontsize=12)
+    plt.grid()
+    plt.legend(loc=1, prop={'size': 12})
+    # invert y axis
+    plt.gca().invert_yaxis()
+    plt.tight_layout()
+    # save the figure
+    plt.savefig(os.path.join(cpt.output_folder, cpt.name + "_" + name) + ".png")
+    plt.close()
+    return
+
+
+def plot_cpt(cpt, nb_plots=6):
+    """
+    Plot CPT values.
+
+    Parameters
+    ----------
+    :param cpt: processed CPT object
+    :param nb_plots: (optional) number of plots
+    """
+    plt = pyplot()
+    from cycler import cycler
+
+    # data
+    x_data = [cpt.tip, cpt.friction_nbr, cpt.rho, cpt.G0, cpt.poisson, cpt.damping]
+    y_data = cpt.depth
+    l_name = ["Tip resistance", "Friction number", "Density", "Shear modulus", "Poisson ratio", "Damping"]
+    x_label = ["Tip resistance [kPa]", "Friction number [-]", r"Density [kg/m$^{3}$]", "Shear modulus [kPa]",
+               "Poisson ratio [-]", "Damping [-]"]
+    y_label = "Depth [m]"
+
+    # set the color list
+    colormap = plt.cm.gist_ncar
+    colors = [colormap(i) for i in np.linspace(0, 0.9, nb_plots)]
+    plt.gca().set_prop_cycle(cycler('color', colors))
+    plt.close()  # close all previous figures
+    fig, ax = plt.subplots(1, nb_plots, figsize=(20, 6))
+
+    # plot for each y_value
+    for i in range(nb_plots):
+        ax[i].plot(list(x_data[i]), list(y_data), label=l_name[i])
+
+        # plt.title(title)
+        ax[i].set_xlabel(x_label[i], fontsize=12)
+        ax[i].set_ylabel(y_label, fontsize=12)
+        ax[i].grid()
+        ax[i].legend(loc=1, prop={'size': 12})
+        # invert y axis
+        ax[i].invert_yaxis()
+
+    plt.tight_layout()
+    # save the figure
+    fig.savefig(os.path.join(cpt.output_folder, cpt.name) + "_cpt.png")
+    plt.close()
+    return
+
+
+def plot_lithology(cpt):
+    """
+    Plot CPT lithology.
+
+    :param cpt: processed CPT object
+    """
+    plt = pyplot()
+    import matplotlib.patches as patches
+
+    # define figure
+    f, (ax1, ax3) = plt.subplots(1, 2, figsize=(7, 10), sharey=True)
+
+    # first subplot - CPT
+    # ax1 tip
+    ax1.set_position([0.15, 0.1, 0.4, 0.8])
+    l1, = ax1.plot(cpt.tip, cpt.depth, label="Tip resistance", color="b")
+    ax1.set_xlabel("Tip resistance [kPa]", fontsize=12)
+    ax1.set_ylabel("Depth [m]", fontsize=12)
+    ax1.set_xlim(left=0)
+    # invert y axis
+    ax1.invert_yaxis()
+
+    # ax2 friction number
+    ax2 = ax1.twiny()
+    ax2.set_position([0.15, 0.1, 0.4, 0.8])
+    l2, = ax2.plot(cpt.friction_nbr, cpt.depth, label="Friction number", color="r")
+    ax2.set_xlabel("Friction number [-]", fontsize=12)
+    ax2.set_xlim(left=0)
+
+    # align grid
+    ax1.set_xticks(np.linspace(0, ax1.get_xticks()[-1], 5))
+    ax2.set_xticks(np.linspace(0, ax2.get_xticks()[-1], 5))
+
+    # grid
+    ax1.grid()
+
+    # legend
+    plt.legend(handles=[l1, l2], loc="upper right")
+
+    # second subplot - Lithology
+    litho = np.array(cpt.lithology).astype(int)
+    color_litho = ["red", "brown", "cyan", "blue", "gray", "yellow", "orange", "green", "lightgray"]
+
+    ax3.set_position([0.60, 0.1, 0.05, 0.8])
+    ax3.set_xlim((0, 10.))
+    # remove ticks
+    plt.setp(ax3.get_xticklabels(), visible=False)
+    plt.setp(ax3.get_yticklabels(), visible=False)
+    ax3.tick_params(axis='both', which='both', length=0)
+
+    # thickness
+    diff_depth = np.diff(cpt.depth)
+
+    # color the field
+    for i in range(len(cpt.depth) - 1):
+        ax3.add_patch(patches.Rectangle(
+            (0, cpt.depth[i]),
+            10.,
+            diff_depth[i],
+            fill=True,
+            color=color_litho[litho[i] - 1]))
+
+    # create legend for Robertson
+    for i, c in enumerate(color_litho):
+        ax3.add_patch(patches.Rectangle(
+            (16, ax1.get_ylim()[1] + (ax1.get_ylim()[0] - ax1.get_ylim()[1]) * 0.0425
+             + (ax1.get_ylim()[0] - ax1.get_ylim()[1]) * 0.02 * i),
+            10.,
+            (ax1.get_ylim()[0] - ax1.get_ylim()[1]) * 0.015,
+            fill=True,
+            color=c,
+            clip_on=False))
+
+    # create text box
+    text = "Robertson classification:\n\n" + \
+           "          Type 1\n" + \
+           "          Type 2\n" + \
+           "          Type 3\n" + \
+           "          Type 4\n" + \
+           "          Type 5\n" + \
+           "          Type 6\n" + \
+           "          Type 7\n" + \
+           "          Type 8\n" + \
+           "          Type 9\n"
+    ax3.annotate(text, xy=(1, 1),
+                 xycoords='axes fraction',
+                 xytext=(20, 0),
+                 fontsize=10,
+                 textcoords='offset pixels',
+                 horizontalalignment='left',
+                 verticalalignment='top')
+
+    # save the figure
+    plt.savefig(os.path.join(cpt.output_folder, cpt.name) + "_lithology.png")
+    plt.close()
+
+    return
+
+
+def write_csv(cpt):
+    """
+    Write CSV file into output file.
+
+    :param cpt: processed CPT object
+    """
+
+    # write csv
+    with open(os.path.join(cpt.output_folder, str(cpt.name) + ".csv"), "w") as fo:
+        fo.write("Depth NAP [m];Depth [m];tip [kPa];friction [kPa];friction number [-];lithology [-];gamma [kN/m3];"
+                 "total stress [-kPa];effective stress [kPa];Qtn [-];Fr [-];IC [-];vs [m/s];G0 [kPa];"
+                 "Poisson [-];Damping [-]\n")
+
+        for i in range(len(cpt.depth_to_reference)):
+            fo.write(str(cpt.depth_to_reference[i]) + ";" +
+                     str(cpt.depth[i]) + ";" +
+                     str(cpt.tip[i]) + ";" +
+                     str(cpt.friction[i]) + ";" +
+                     str(cpt.friction_nbr[i]) + ";" +
+                     str(cpt.lithology[i]) + ";" +
+                     str(cpt.gamma[i]) + ";" +
+                     str(cpt.total_stress[i]) + ";" +
+                     str(cpt.effective_stress[i]) + ";" +
+                     str(cpt.Qtn[i]) + ";" +
+                     str(cpt.Fr[i]) + ";" +
+                     str(cpt.IC[i]) + ";" +
+                     str(cpt.vs[i]) + ";" +
+                     str(cpt.G0[i]) + ";" +
+                     str(cpt.poisson[i]) + ";" +
+                     str(cpt.damping[i]) + '\n')
+    return
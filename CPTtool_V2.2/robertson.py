@@ -3,13 +3,18 @@ Robertson soil classification
 """
 # import packages
 import os
+import threading
 import numpy as np
 import shapefile
+import shapely
 from shapely.geometry import Polygon
-from shapely.geometry import Point
 # import OURS packages
 from CPTtool import tools_utils
 
+# process-wide classification: the shapefile is read only once
+_classification = None
+_classification_lock = threading.Lock()
+
 
 class Robertson:
     r"""
@@ -47,7 +52,9 @@ class Robertson:
         list_of_polygons = []
         for polygon in list(sf.iterShapes()):
             list_of_polygons.append(Polygon(polygon.points))
-        self.polygons = list_of_polygons
+        # prepare the polygons for the (repeated) point in polygon tests
+        shapely.prepare(list_of_polygons)
+        self.polygons = tuple(list_of_polygons)
         return
 
     def lithology(self, Qtn, Fr):
@@ -62,24 +69,60 @@ class Robertson:
         :return: lithology array, Qtn, Fr
         """
 
-        litho = [""] * len(Qtn)
-        coords = np.zeros((len(Qtn), 2))
+        litho = self.classify(Qtn, Fr)
+        coords = np.column_stack([np.asarray(Fr, dtype=float), np.asarray(Qtn, dtype=float)])
+
+        return [str(lit) for lit in litho], coords
+
+    def classify(self, Qtn, Fr):
+        r"""
+        Vectorised classification of the CPT points into the soil types.
+
+        A point belongs to the first polygon that contains it. Points that are not inside any polygon belong to the
+        first polygon on whose boundary they are.
+
+        Parameters
+        ----------
+        :param Qtn: array of normalised cone resistance
+        :param Fr: array of normalised friction ratio
+        :return: integer array with the soil type (1 to the number of polygons)
+        """
+
+        Qtn = np.asarray(Qtn, dtype=float)
+        Fr = np.asarray(Fr, dtype=float)
+        litho = np.zeros(len(Qtn), dtype=int)
 
         # determine into which soil type the point is
-        for i in range(len(Qtn)):
-            pnt = Point(Fr[i], Qtn[i])
-            aux = []
-            for polygon in self.polygons:
-                aux.append(polygon.contains(pnt))
-
-            # check if point is within a boundary
-            if all(not x for x in aux):
-                aux = []
-                for polygon in self.polygons:
-                    aux.append(polygon.touches(pnt))
-
-            idx = np.where(np.array(aux))[0][0]
-            litho[i] = str(idx + 1)
-            coords[i] = [Fr[i], Qtn[i]]
-
-        return litho, np.array(coords)
+        for i, polygon in enumerate(self.polygons):
+            idx = np.where(litho == 0)[0]
+            litho[idx[shapely.contains_xy(polygon, Fr[idx], Qtn[idx])]] = i + 1
+
+        # check if point is within a boundary
+        for i, polygon in enumerate(self.polygons):
+            idx = np.where(litho == 0)[0]
+            litho[idx[shapely.intersects_xy(polygon, Fr[idx], Qtn[idx])]] = i + 1
+
+        if any(litho == 0):
+            raise ValueError("CPT points outside the soil classification: Fr {} Qtn {}".format(
+                Fr[litho == 0], Qtn[litho == 0]))
+
+        return litho
+
+
+def shared_classification():
+    r"""
+    Process-wide Robertson classification.
+
+    The shapefile is read the first time the classification is requested. The same (read-only) classification is
+    returned afterwards, and shared by all CPTs and threads.
+
+    :return: Robertson classification with the soil types
+    """
+    global _classification
+
+    with _classification_lock:
+        if _classification is None:
+            classification = Robertson()
+            classification.soil_types()
+            _classification = classification
+    return _classification
@@ -0,0 +1,175 @@
+"""
+Test setup: the folder CPTtool_V2.2 is imported as the package CPTtool, and a small synthetic BRO dataset is created
+
+Run the tests from the root of the repository with: python -m pytest CPTtool_V2.2/tests
+"""
+import os
+import sys
+import json
+import sqlite3
+import importlib.util
+import numpy as np
+import pytest
+
+# the code imports itself as the package CPTtool
+package_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if "CPTtool" not in sys.modules:
+    spec = importlib.util.spec_from_file_location("CPTtool", os.path.join(package_folder, "__init__.py"),
+                                                  submodule_search_locations=[package_folder])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["CPTtool"] = module
+    spec.loader.exec_module(module)
+
+# centre of the synthetic dataset (epsg:28992)
+x0, y0 = 120000., 480000.
+# measurement columns of the geopackage
+measurement_columns = ["penetration_length", "depth", "elapsed_time", "cone_resistance", "corrected_cone_resistance",
+                       "net_cone_resistance", "magnetic_field_strength_x", "magnetic_field_strength_y",
+                       "magnetic_field_strength_z", "magnetic_field_strength_total", "electrical_conductivity",
+                       "inclination_ew", "inclination_ns", "inclination_x", "inclination_y", "inclination_resultant",
+                       "magnetic_inclination", "magnetic_declination", "local_friction", "pore_ratio", "temperature",
+                       "pore_pressure_u1", "pore_pressure_u2", "pore_pressure_u3", "friction_ratio"]
+
+
+def write_geopackage(fn, nb_cpts=12, changed=()):
+    """
+    Write a synthetic BRO geopackage with the tables that are read by the tool
+
+    The cpts are the same for every geopackage, except the changed cpts: a new release of the BRO database.
+
+    :param fn: geopackage file location
+    :param nb_cpts: (optional) number of cpts. Default is 12
+    :param changed: (optional) indexes of the cpts with a new research report date and new measurements.
+                    Default is no cpts
+    :return: list of bro_ids
+    """
+    import geopandas as gpd
+    from pyproj import Transformer
+    from shapely.geometry import Point
+
+    x = x0 - 550. + 100. * np.arange(nb_cpts)
+    y = y0 + 40. * np.sin(np.arange(nb_cpts))
+    lon, lat = Transformer.from_crs("epsg:28992", "epsg:4258", always_xy=True).transform(x, y)
+    bro_ids = ["CPT{:012d}".format(1000 + i) for i in range(nb_cpts)]
+    keys = np.arange(1, nb_cpts + 1) * 3
+    cpts = gpd.GeoDataFrame({"geotechnical_cpt_survey_pk": keys, "bro_id": bro_ids,
+                             "quality_regime": ["IMBRO"] * nb_cpts,
+                             "cpt_standard": ["NEN-EN-ISO 22476-1"] * nb_cpts,
+                             "research_report_date": ["2021-01-01" if i in changed else "2020-01-01"
+                                                      for i in range(nb_cpts)]},
+                            geometry=[Point(a, b) for a, b in zip(lon, lat)], crs="epsg:4258")
+    cpts.to_file(fn, layer="geotechnical_cpt_survey", driver="GPKG")
+
+    conn = sqlite3.connect(fn)
+    conn.execute("CREATE TABLE cone_penetration_test_result (cone_penetration_test_result_pk INTEGER PRIMARY KEY, "
+                 "cone_penetration_test_fk INTEGER, " + ", ".join(c + " REAL" for c in measurement_columns) + ")")
+    conn.execute("CREATE TABLE delivered_vertical_position (delivered_vertical_position_pk INTEGER PRIMARY KEY, "
+                 "geotechnical_cpt_survey_fk INTEGER, offset REAL, vertical_datum TEXT, "
+                 "local_vertical_reference_point TEXT)")
+    conn.execute("CREATE TABLE bro_point (bro_point_pk INTEGER PRIMARY KEY, bro_location_fk INTEGER, "
+                 "x_or_lon REAL, y_or_lat REAL)")
+    conn.execute("CREATE TABLE trajectory (trajectory_pk INTEGER PRIMARY KEY, cone_penetrometer_survey_fk INTEGER, "
+                 "predrilled_depth REAL)")
+    conn.execute("CREATE TABLE cone_penetrometer (cone_penetrometer_pk INTEGER PRIMARY KEY, "
+                 "cone_penetrometer_survey_fk INTEGER, cone_surface_quotient REAL)")
+    for i, key in enumerate(keys):
+        conn.executemany("INSERT INTO cone_penetration_test_result (cone_penetration_test_fk, "
+                         + ", ".join(measurement_columns) + ") VALUES (" + ", ".join("?" * 26) + ")",
+                         measurements(int(key), np.random.default_rng(i), scale=1.1 if i in changed else 1.))
+        conn.execute("INSERT INTO delivered_vertical_position (geotechnical_cpt_survey_fk, offset, vertical_datum, "
+                     "local_vertical_reference_point) VALUES (?, ?, ?, ?)", (int(key), -1., "NAP", "maaiveld"))
+        conn.execute("INSERT INTO bro_point (bro_location_fk, x_or_lon, y_or_lat) VALUES (?, ?, ?)",
+                     (int(key), float(x[i]), float(y[i])))
+        conn.execute("INSERT INTO trajectory (cone_penetrometer_survey_fk, predrilled_depth) VALUES (?, ?)",
+                     (int(key), 0.))
+        conn.execute("INSERT INTO cone_penetrometer (cone_penetrometer_survey_fk, cone_surface_quotient) "
+                     "VALUES (?, ?)", (int(key), 0.8))
+    conn.commit()
+    conn.close()
+    return bro_ids
+
+
+def measurements(key, rng, scale=1., nb_samples=400):
+    """
+    Synthetic measurements of a cpt: clay on top of sand
+
+    :param key: key of the cpt in the geopackage
+    :param rng: random generator
+    :param scale: (optional) scale factor of the cone resistance. Default is 1
+    :param nb_samples: (optional) number of samples. Default is 400
+    :return: list of rows of the cone_penetration_test_result table
+    """
+    penetration_length = 0.02 * np.arange(1, nb_samples + 1)
+    sand = penetration_length > 4.
+    cone_resistance = scale * (np.where(sand, 12., 0.8) + rng.uniform(0., 0.2, nb_samples))
+    friction_ratio = np.where(sand, 0.6, 3.5) + rng.uniform(0., 0.2, nb_samples)
+    rows = []
+    for j in range(nb_samples):
+        values = dict.fromkeys(measurement_columns)
+        values.update(penetration_length=penetration_length[j], elapsed_time=float(j),
+                      cone_resistance=cone_resistance[j], friction_ratio=friction_ratio[j],
+                      local_friction=cone_resistance[j] * friction_ratio[j] / 100.)
+        rows.append([key] + [values[c] for c in measurement_columns])
+    return rows
+
+
+def write_auxiliary_data(folder):
+    """
+    Write the water level grid, the geomorphological map and the buffered track next to the BRO data
+
+    :param folder: folder of the BRO data
+    :return: None
+    """
+    import netCDF4
+    from rtree import index
+    from shapely.geometry import box, mapping
+    from pyproj import Transformer
+
+    # water level grid around the dataset
+    lon, lat = Transformer.from_crs("epsg:28992", "epsg:4326", always_xy=True).transform(x0, y0)
+    dataset = netCDF4.Dataset(os.path.join(folder, "peilgebieden_jp_250m.nc"), "w")
+    dataset.createDimension("lat", 40)
+    dataset.createDimension("lon", 40)
+    dataset.createVariable("lat", "f8", ("lat", ))[:] = lat + 0.0025 * np.arange(-20, 20)
+    dataset.createVariable("lon", "f8", ("lon", ))[:] = lon + 0.0035 * np.arange(-20, 20)
+    dataset.createVariable("Band1", "f4", ("lat", "lon"), fill_value=-9999.)[:] = np.full((40, 40), -1.5, dtype="f4")
+    dataset.close()
+
+    # two geomorphological polygons
+    geomorph = index.Index(os.path.join(folder, "geomorph"))
+    polygons = [box(x0 - 2000., y0 - 2000., x0, y0 + 2000.), box(x0, y0 - 2000., x0 + 2000., y0 + 2000.)]
+    for i, polygon in enumerate(polygons):
+        geomorph.insert(i, polygon.bounds, obj=("gm{}".format(i), mapping(polygon)))
+    geomorph.close()
+
+    # buffered track along the cpts
+    track = index.Index(os.path.join(folder, "buff_track"))
+    track.insert(0, (x0 - 1000., y0 - 20., x0 + 1000., y0 + 20.))
+    track.close()
+    return
+
+
+@pytest.fixture
+def bro_folder(tmp_path):
+    """
+    Folder with a synthetic BRO geopackage (bro.gpkg) and its auxiliary data
+    """
+    write_geopackage(str(tmp_path / "bro.gpkg"))
+    write_auxiliary_data(str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def receptors():
+    """
+    Properties of an analysis with three receptors along the synthetic cpts (without the BRO data)
+    """
+    x = [str(x0 - 300.), str(x0), str(x0 + 300.)]
+    y = [str(y0)] * 3
+    return {"Source_x": x, "Source_y": y, "Receiver_x": x, "Receiver_y": y, "MinLayerThickness": "0.5"}
+
+
+def write_json(fn, data):
+    with open(fn, "w") as f:
+        json.dump(data, f)
+    return
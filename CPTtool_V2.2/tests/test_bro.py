@@ -0,0 +1,80 @@
+"""
+Tests of the selection of the BRO CPTs with their location in the spatial layer, and of the geomorphological cache
+"""
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pyproj
+from shapely.geometry import Point
+from CPTtool import bro
+from CPTtool import cpt_store
+from conftest import x0, y0
+
+
+def lon_lat_cpts():
+    # cpts of which the coordinates in the BRO database are stored as lon/lat
+    rd = np.array([[120000., 480000.], [120050., 480000.], [121000., 480000.]])
+    lon, lat = pyproj.Transformer.from_crs('epsg:28992', 'epsg:4258', always_xy=True).transform(rd[:, 0], rd[:, 1])
+    points = np.column_stack([lon, lat])
+    cpts = [{"id": "CPT{:012d}".format(i), "location_x": x, "location_y": y, "offset_z": 0., "predrilled_z": 0.,
+             "a": 0.8, "vertical_datum": "NAP", "local_reference": "maaiveld", "quality_class": 2,
+             "cpt_standard": "NEN-EN-ISO 22476-1", "in_track": False, "research_report_date": "2020-01-01",
+             "dataframe": pd.DataFrame({"penetrationLength": [0., 0.02], "coneResistance": [1., 1.1]})}
+            for i, (x, y) in enumerate(points)]
+    return cpts, points
+
+
+def test_cpts_inside_lon_lat():
+    cpts, points = lon_lat_cpts()
+    circle = Point(120000., 480000.).buffer(100., resolution=32)
+    inside = bro.cpts_inside(circle, cpts, points, 'epsg:4258')
+    assert [cpt["id"] for cpt in inside] == [cpts[0]["id"], cpts[1]["id"]]
+
+
+def test_read_cpt_from_store_lon_lat(tmp_path):
+    cpts, points = lon_lat_cpts()
+    footprint = Point(120500., 480000.).buffer(1000., resolution=32)
+    folder = str(tmp_path / "store")
+    cpt_store.write_store(folder, cpts, points, 'epsg:4258', footprint, str(tmp_path / "bro.gpkg"))
+
+    circle = Point(121000., 480000.).buffer(100., resolution=32)
+    selected, selected_points, crs = bro.read_cpt_from_store(circle, folder)
+    assert crs == 'epsg:4258'
+    assert [cpt["id"] for cpt in selected] == [cpts[2]["id"]]
+    np.testing.assert_array_equal(selected_points, points[2:])
+    assert [cpt["id"] for cpt in bro.cpts_inside(circle, selected, selected_points, crs)] == [cpts[2]["id"]]
+
+
+def test_geomorph_cache(bro_folder):
+    fn = str(bro_folder / "bro.gpkg")
+    cache_file = str(bro_folder / "geomorph.npz")
+    bro.geomorph_caches.clear()
+    codes, polygons, polygons_etrs89 = bro.geomorph_polygons(fn, Point(x0 - 10., y0).buffer(100.))
+    assert codes == ["gm0", "gm1"]
+
+    # the cache next to the data files contains no pickled objects
+    with np.load(cache_file, allow_pickle=False) as f:
+        assert list(f["codes"]) == ["gm0", "gm1"]
+
+    # a new process reads the polygons from the cache
+    bro.geomorph_caches.clear()
+    assert bro.read_geomorph_cache(cache_file, str(bro_folder / "geomorph")) is not None
+    codes_cache, polygons_cache, polygons_etrs89_cache = bro.geomorph_polygons(fn, Point(x0 - 10., y0).buffer(100.))
+    assert codes_cache == codes
+    assert all(a.equals_exact(b, 0) for a, b in zip(polygons_cache, polygons))
+    assert all(a.equals_exact(b, 0) for a, b in zip(polygons_etrs89_cache, polygons_etrs89))
+
+
+def test_geomorph_cache_pickle(bro_folder):
+    # a pickled cache is never loaded: it is replaced by a new cache
+    cache_file = str(bro_folder / "geomorph.npz")
+    with open(cache_file, "wb") as f:
+        pickle.dump({"codes": np.array(["gm0", "gm1"], dtype=object)}, f)
+    assert bro.read_geomorph_cache(cache_file, str(bro_folder / "geomorph")) is None
+
+    bro.geomorph_caches.clear()
+    codes, _, _ = bro.geomorph_polygons(str(bro_folder / "bro.gpkg"), Point(x0 + 10., y0).buffer(100.))
+    assert codes == ["gm0", "gm1"]
+    assert bro.read_geomorph_cache(cache_file, str(bro_folder / "geomorph")) is not None
+    assert not [name for name in os.listdir(str(bro_folder)) if name.endswith(".tmp")]
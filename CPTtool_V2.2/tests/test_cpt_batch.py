@@ -0,0 +1,33 @@
+"""
+Tests of the batch of CPTs against the processing of each CPT on its own
+"""
+import itertools
+import numpy as np
+import pytest
+from shapely.geometry import Point
+from CPTtool import bro
+from CPTtool import cpt_batch
+from CPTtool import cpt_tool
+from conftest import x0, y0
+
+attributes = ["depth", "depth_to_reference", "tip", "friction", "friction_nbr", "water", "qt", "gamma", "rho",
+              "total_stress", "effective_stress", "Qtn", "Fr", "n", "n_iterations", "n_converged", "lithology",
+              "litho_points", "IC", "vs", "G0", "damping", "poisson"]
+
+
+@pytest.mark.parametrize("gamma, vs, OCR", list(itertools.product(cpt_batch.gamma_methods, cpt_batch.vs_methods,
+                                                                  ["Mayne", "Robertson"])))
+def test_batch_equals_cpt(bro_folder, tmp_path, gamma, vs, OCR):
+    fn = str(bro_folder / "bro.gpkg")
+    cpts, _, _ = bro.tile_cache(fn).read(Point(x0, y0).buffer(1000.))
+    # the water level of each cpt is different: a deep water level and water levels above the surface
+    water_levels = np.linspace(-3., 1., len(cpts))
+    methods = {"gamma": gamma, "vs": vs, "OCR": OCR, "radius": 600.}
+    settings = cpt_tool.define_settings(False)
+
+    batch = cpt_tool.process_cpts(cpts, methods, settings, str(tmp_path), fn, water_levels)
+    for cpt_BRO, water_level, cpt_batch_ in zip(cpts, water_levels, batch):
+        cpt = cpt_tool.process_cpt(cpt_BRO, methods, settings, str(tmp_path), fn, water_level=water_level)
+        assert cpt.pwp == cpt_batch_.pwp
+        for att in attributes:
+            np.testing.assert_array_equal(getattr(cpt_batch_, att), getattr(cpt, att), err_msg=att)
@@ -0,0 +1,67 @@
+"""
+Tests of the cache of processed CPTs
+"""
+import os
+import numpy as np
+import pandas as pd
+from CPTtool import cpt_cache
+
+
+def cpt_BRO(scale=1.):
+    return {"id": "CPT000000001000", "location_x": 120000., "location_y": 480000., "offset_z": -1.,
+            "predrilled_z": 0., "a": 0.8, "vertical_datum": "NAP", "local_reference": "maaiveld",
+            "quality_class": "IMBRO", "cpt_standard": "NEN-EN-ISO 22476-1", "in_track": True,
+            "dataframe": pd.DataFrame({"penetrationLength": [0.02, 0.04], "coneResistance": [1., scale * 1.1]})}
+
+
+def test_memory_cache():
+    cache = cpt_cache.CPTCache(max_size=2)
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    # the least recently used cpt is removed
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_disk_cache(tmp_path):
+    folder = str(tmp_path / "cache")
+    cache = cpt_cache.CPTCache(cache_folder=folder)
+    cache.put("CPT1_data_settings", "processed")
+    # a new cache (or another process) reads the cpt from disk
+    other = cpt_cache.CPTCache(cache_folder=folder)
+    assert other.get("CPT1_data_settings") == "processed"
+    assert other.get("CPT2_data_settings") is None
+    assert [name for name in os.listdir(folder) if name.endswith(".tmp")] == []
+
+
+def test_invalidate(tmp_path):
+    cache = cpt_cache.CPTCache(cache_folder=str(tmp_path / "cache"))
+    for key in ["CPT1_v1_s1", "CPT1_v2_s2", "CPT2_v1_s1"]:
+        cache.put(key, key)
+    # all versions and settings of the cpt are removed, from memory and disk
+    assert cache.invalidate(["CPT1"]) == 4
+    assert cache.get("CPT1_v1_s1") is None and cache.get("CPT1_v2_s2") is None
+    assert cache.get("CPT2_v1_s1") == "CPT2_v1_s1"
+    assert os.listdir(str(tmp_path / "cache")) == ["CPT2_v1_s1.pkl"]
+
+
+def test_keys():
+    settings_hash = cpt_cache.CPTCache.settings_hash({"gamma": "Robertson"}, {"nb_points": 5})
+    assert settings_hash != cpt_cache.CPTCache.settings_hash({"gamma": "Lengkeek"}, {"nb_points": 5})
+    assert settings_hash != cpt_cache.CPTCache.settings_hash({"gamma": "Robertson"}, {"nb_points": 5},
+                                                             dtype="float32")
+
+    # the version of the cpt changes with its data and the water level
+    cpt_hash = cpt_cache.CPTCache.cpt_hash(cpt_BRO(), -1.5)
+    assert cpt_hash == cpt_cache.CPTCache.cpt_hash(cpt_BRO(), np.float32(-1.5))
+    assert cpt_hash != cpt_cache.CPTCache.cpt_hash(cpt_BRO(scale=1.1), -1.5)
+    assert cpt_hash != cpt_cache.CPTCache.cpt_hash(cpt_BRO(), -1.)
+    changed = cpt_BRO()
+    changed["research_report_date"] = "2021-01-01"
+    assert cpt_hash != cpt_cache.CPTCache.cpt_hash(changed, -1.5)
+
+    assert cpt_cache.CPTCache.key("CPT000000001000", cpt_hash, settings_hash).split("_", 1)[0] == "CPT000000001000"
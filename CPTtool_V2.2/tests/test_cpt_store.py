@@ -0,0 +1,148 @@
+"""
+Tests of the CPT store: writing, reading, extracting from the BRO database and ingesting a new release
+"""
+import os
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, LineString
+from CPTtool import bro
+from CPTtool import cpt_cache
+from CPTtool import cpt_store
+from conftest import x0, y0, write_geopackage
+
+
+def store_cpts():
+    cpts = []
+    for i, nb_samples in enumerate([3, 5, 4]):
+        cpts.append({"id": "CPT{:012d}".format(i), "location_x": 100. * i, "location_y": 50., "offset_z": -1.,
+                     "predrilled_z": 0., "a": np.nan if i == 1 else 0.8, "vertical_datum": "NAP",
+                     "local_reference": "maaiveld", "quality_class": "IMBRO", "cpt_standard": "NEN-EN-ISO 22476-1",
+                     "in_track": i == 0, "research_report_date": "2020-01-01",
+                     "dataframe": pd.DataFrame({"penetrationLength": 0.02 * np.arange(nb_samples),
+                                                "coneResistance": 1. + i + np.arange(nb_samples)})})
+    return cpts
+
+
+def test_write_read_store(tmp_path):
+    cpts = store_cpts()
+    points = np.array([[cpt["location_x"], cpt["location_y"]] for cpt in cpts])
+    footprint = Point(100., 50.).buffer(500.)
+    folder = str(tmp_path / "store")
+    cpt_store.write_store(folder, cpts, points, 'epsg:28992', footprint, str(tmp_path / "bro.gpkg"),
+                          rejected={"CPT000000000099": "2019-01-01"})
+
+    assert cpt_store.is_store(folder)
+    store = cpt_store.open_store(folder)
+    assert store is cpt_store.open_store(folder)
+    assert store.crs == 'epsg:28992'
+    assert store.rejected == {"CPT000000000099": "2019-01-01"}
+    assert store.footprint.equals(footprint)
+    for i, cpt in enumerate(cpts):
+        stored = store.cpt(i)
+        for name, value in cpt.items():
+            if name == "dataframe":
+                pd.testing.assert_frame_equal(stored[name], value)
+            elif name == "a" and np.isnan(value):
+                assert np.isnan(stored[name])
+            else:
+                assert stored[name] == value
+    np.testing.assert_array_equal(store.select(Point(50., 50.).buffer(60.)), [0, 1])
+
+
+def test_rewrite_store(tmp_path):
+    cpts = store_cpts()
+    points = np.array([[cpt["location_x"], cpt["location_y"]] for cpt in cpts])
+    folder = str(tmp_path / "store")
+    cpt_store.write_store(folder, cpts, points, 'epsg:28992', Point(0., 0.).buffer(500.), "bro.gpkg")
+    assert len(cpt_store.open_store(folder).metadata) == 3
+
+    # the new store replaces the old store, also for the process-wide stores
+    cpt_store.write_store(folder, cpts[:1], points[:1], 'epsg:28992', Point(0., 0.).buffer(500.), "bro.gpkg")
+    assert len(cpt_store.open_store(folder).metadata) == 1
+    assert not os.path.exists(folder + ".tmp") and not os.path.exists(folder + ".old")
+
+
+def test_extract_corridor(bro_folder):
+    fn = str(bro_folder / "bro.gpkg")
+    store = str(bro_folder / "corridor")
+    track = LineString([(x0 - 300., y0), (x0 + 300., y0)])
+    assert bro.extract_corridor(fn, track, 200., store) == 12
+
+    # the cpts of the store are the cpts of the geopackage
+    circle = Point(x0, y0).buffer(400., resolution=32)
+    cpts_store, points_store, crs_store = bro.read_cpt_from_store(circle, store)
+    cpts_gpkg, points_gpkg, crs_gpkg = bro.tile_cache(fn).read(circle)
+    assert crs_store == crs_gpkg
+    np.testing.assert_array_equal(points_store, points_gpkg)
+    assert [cpt["id"] for cpt in cpts_store] == [cpt["id"] for cpt in cpts_gpkg]
+    for cpt_store_, cpt_gpkg in zip(cpts_store, cpts_gpkg):
+        np.testing.assert_array_equal(cpt_store_["dataframe"].values, cpt_gpkg["dataframe"].values)
+        assert cpt_store_["research_report_date"] == "2020-01-01"
+
+
+def test_ingest_store(bro_folder, tmp_path):
+    fn = str(bro_folder / "bro.gpkg")
+    store = str(bro_folder / "corridor")
+    bro.extract_corridor(fn, LineString([(x0 - 1000., y0), (x0 + 1000., y0)]), 200., store)
+
+    # processed cpts of all cpts in the cache
+    cache = cpt_cache.CPTCache(cache_folder=str(tmp_path / "cache"))
+    bro_ids = [cpt["id"] for cpt in cpt_store.open_store(store).metadata]
+    for bro_id in bro_ids:
+        cache.put(cpt_cache.CPTCache.key(bro_id, "data", "settings"), bro_id)
+
+    # new release: cpt 2 is changed and cpt 11 is retired
+    new_fn = str(tmp_path / "bro_new.gpkg")
+    write_geopackage(new_fn, nb_cpts=11, changed=[2])
+    updates = bro.ingest_store(store, new_fn, cache=cache)
+    assert updates == {"added": [], "replaced": [bro_ids[2]], "retired": [bro_ids[11]]}
+
+    new_store = cpt_store.open_store(store)
+    assert [cpt["id"] for cpt in new_store.metadata] == bro_ids[:11]
+    assert new_store.metadata[2]["research_report_date"] == "2021-01-01"
+    new_cpts, _, _ = bro.tile_cache(new_fn).read(Point(x0, y0).buffer(1000.))
+    np.testing.assert_array_equal(new_store.cpt(2)["dataframe"].values, new_cpts[2]["dataframe"].values)
+
+    # only the processed cpts of the replaced and retired cpts are removed from the cache
+    assert sorted(os.listdir(str(tmp_path / "cache"))) == sorted(
+        cpt_cache.CPTCache.key(bro_id, "data", "settings") + ".pkl"
+        for i, bro_id in enumerate(bro_ids) if i not in [2, 11])
+
+
+def test_ingest_analysis_cycle(bro_folder, receptors, tmp_path):
+    from CPTtool import cpt_tool
+
+    store = str(bro_folder / "corridor")
+    bro.extract_corridor(str(bro_folder / "bro.gpkg"), LineString([(x0 - 1000., y0), (x0 + 1000., y0)]), 600.,
+                         store)
+    properties = dict(receptors, BRO_data=store)
+    methods = cpt_tool.define_methods(False)
+    settings = cpt_tool.define_settings(False)
+    cache_folder = str(tmp_path / "cache")
+
+    # first analysis: all cpts are processed
+    cache = cpt_cache.CPTCache(cache_folder=cache_folder)
+    cpt_tool.analysis(properties, methods, settings, str(tmp_path / "output_1"), False, cache=cache)
+    assert cache.misses == 12
+    assert len(os.listdir(cache_folder)) == 12
+    assert all(os.path.isfile(str(tmp_path / "output_1" / "results_{}.json".format(i))) for i in range(3))
+
+    # new release with one changed cpt
+    new_fn = str(tmp_path / "bro_new.gpkg")
+    write_geopackage(new_fn, changed=[5])
+    updates = bro.ingest_store(store, new_fn, cache=cpt_cache.CPTCache(cache_folder=cache_folder))
+    assert updates["replaced"] == ["CPT000000001005"]
+    assert len(os.listdir(cache_folder)) == 11
+
+    # second analysis: only the changed cpt is processed
+    cache = cpt_cache.CPTCache(cache_folder=cache_folder)
+    cpt_tool.analysis(properties, methods, settings, str(tmp_path / "output_2"), False, cache=cache)
+    assert cache.misses == 1
+    assert len(os.listdir(cache_folder)) == 12
+    assert all(os.path.isfile(str(tmp_path / "output_2" / "results_{}.json".format(i))) for i in range(3))
+
+    # the log file reports the iterations of the stress exponent of each cpt, also of the cached cpts
+    with open(str(tmp_path / "output_2" / "log_file_1.txt")) as f:
+        messages = [line for line in f if "Stress exponent for" in line]
+    assert len(messages) > 1
+    assert all("0 of 400 samples did not converge" in message for message in messages)
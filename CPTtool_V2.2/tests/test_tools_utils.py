@@ -0,0 +1,90 @@
+"""
+Tests of the vectorised functions of tools_utils against the loop implementations that they replace
+"""
+from itertools import groupby
+from operator import itemgetter
+import numpy as np
+from CPTtool import tools_utils
+
+
+def ceil_value_loop(data, value):
+    # loop implementation of ceil_value
+    idx = [i for i, val in enumerate(data) if val <= value]
+    runs = [list(map(itemgetter(1), g)) for k, g in groupby(enumerate(idx), lambda ix: ix[0] - ix[1])]
+    for i in runs:
+        for j in i:
+            if i[-1] + 1 >= len(data):
+                data[j] = data[i[0] - 1]
+            else:
+                data[j] = data[i[-1] + 1]
+    return data
+
+
+def n_solve_loop(qt, friction_nb, sigma_eff, sigma_tot, Pa, tol=1.e-12, max_ite=10000):
+    # loop implementation of the stress exponent: the norm of all samples converges
+    n = np.ones(len(qt))
+    error = 1
+    itr = 0
+    while error >= tol:
+        if itr >= max_ite:
+            return np.ones(len(qt)) * 0.5
+        n1 = tools_utils.n_iter(n, qt, friction_nb, sigma_eff, sigma_tot, Pa)
+        error = np.linalg.norm(n1 - n) / np.linalg.norm(n1)
+        n = n1
+        itr += 1
+    return n
+
+
+def test_ceil_value():
+    rng = np.random.default_rng(1)
+    for _ in range(2000):
+        data = rng.normal(size=rng.integers(1, 12))
+        data[rng.random(len(data)) < rng.random()] = -1.
+        if rng.random() < 0.2:
+            data[rng.random(len(data)) < 0.3] = np.nan
+        expected = ceil_value_loop(data.copy(), 0)
+        result = data.copy()
+        assert tools_utils.ceil_value(result, 0) is result
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_ceil_value_offsets():
+    rng = np.random.default_rng(2)
+    for _ in range(500):
+        datasets = []
+        for length in rng.integers(1, 10, size=rng.integers(1, 6)):
+            data = rng.normal(size=length)
+            data[rng.random(length) < rng.random()] = -1.
+            datasets.append(data)
+        offsets = np.cumsum([0] + [len(data) for data in datasets])
+        expected = np.concatenate([ceil_value_loop(data.copy(), 0) for data in datasets])
+        np.testing.assert_array_equal(tools_utils.ceil_value(np.concatenate(datasets), 0, offsets=offsets), expected)
+
+
+def test_n_solve():
+    rng = np.random.default_rng(3)
+    depth = 0.02 * np.arange(1, 501)
+    sigma_tot = 17. * depth
+    sigma_eff = sigma_tot - 10. * np.maximum(depth - 1., 0.)
+    qt = 1000. * rng.uniform(0.5, 20., len(depth))
+    friction_nb = rng.uniform(0.5, 5., len(depth))
+
+    n, iterations, converged = tools_utils.n_solve(qt, friction_nb, sigma_eff, sigma_tot, 100.)
+    assert np.all(converged) and np.all(iterations > 0)
+    np.testing.assert_allclose(n, n_solve_loop(qt, friction_nb, sigma_eff, sigma_tot, 100.), rtol=1e-9)
+
+
+def test_n_solve_not_converged():
+    # samples that do not converge within the maximum number of iterations get the default stress exponent
+    qt = np.array([5000., 5000., 5000.])
+    friction_nb = np.array([1., 1., 1.])
+    sigma_eff = np.array([50., 0., -10.])
+    sigma_tot = np.array([60., 0., 20.])
+    n, iterations, converged = tools_utils.n_solve(qt, friction_nb, sigma_eff, sigma_tot, 100.)
+    assert np.all(converged) and iterations[0] > 2
+
+    n_max, iterations_max, converged_max = tools_utils.n_solve(qt, friction_nb, sigma_eff, sigma_tot, 100., max_ite=2)
+    np.testing.assert_array_equal(converged_max, [False, True, True])
+    assert n_max[0] == 0.5
+    np.testing.assert_array_equal(n_max[1:], n[1:])
+    np.testing.assert_array_equal(iterations_max, np.minimum(iterations, 2))
@@ -2,8 +2,6 @@
 Tools for OURS
 """
 # import packages
-from itertools import groupby
-from operator import itemgetter
 import numpy as np
 import os
 import sys
@@ -48,6 +46,57 @@ def n_iter(n, qt, friction_nb, sigma_eff, sigma_tot, Pa):
     return n
 
 
+def n_solve(qt, friction_nb, sigma_eff, sigma_tot, Pa, tol=1.e-12, max_ite=10000, n_default=0.5):
+    """
+    Iterative computation of stress exponent *n* per sample
+
+    The fixed point iteration of :func:`n_iter` starts at n=1. Each sample is iterated until its relative change is
+    smaller than the tolerance; converged samples are removed from the iteration.
+    Samples that do not converge within the maximum number of iterations, or that become non-finite,
+    are set to the default value.
+
+    :param qt: tip resistance
+    :param friction_nb: friction number
+    :param sigma_eff: effective stress
+    :param sigma_tot: total stress
+    :param Pa: atmospheric pressure
+    :param tol: (optional) relative tolerance. Default is 1e-12
+    :param max_ite: (optional) maximum number of iterations. Default is 10000
+    :param n_default: (optional) stress exponent for samples that do not converge. Default is 0.5
+    :return: stress exponent *n*, number of iterations per sample, converged samples
+    """
+
+    qt = np.asarray(qt, dtype=float)
+    friction_nb = np.asarray(friction_nb, dtype=float)
+    sigma_eff = np.asarray(sigma_eff, dtype=float)
+    sigma_tot = np.asarray(sigma_tot, dtype=float)
+
+    # start assuming n=1
+    n = np.ones(len(qt))
+    iterations = np.zeros(len(qt), dtype=int)
+    converged = np.zeros(len(qt), dtype=bool)
+    # samples still iterating
+    active = np.arange(len(qt))
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for _ in range(max_ite):
+            if len(active) == 0:
+                break
+            n1 = n_iter(n[active], qt[active], friction_nb[active], sigma_eff[active], sigma_tot[active], Pa)
+            iterations[active] += 1
+
+            # non-finite samples do not converge
+            finite = np.isfinite(n1)
+            done = finite & (np.abs(n1 - n[active]) <= tol * np.abs(n1))
+            n[active] = n1
+            converged[active[done]] = True
+            active = active[finite & ~done]
+
+    # samples that did not converge
+    n[~converged] = n_default
+    return n, iterations, converged
+
+
 def interpolation(data_cpt, coordinates, power=1):
     """
     Inverse distance weight interpolation
@@ -153,32 +202,40 @@ def resource_path(file_name):
     return os.path.join(base_path, file_name)
 
 
-def ceil_value(data, value):
+def ceil_value(data, value, offsets=None):
     """
     Replaces the data values from data, that are are smaller of equal to value.
     It replaces the data values with the first non-zero value of the dataset.
+    If the values are at the end of the data, they are replaced with the last value before them. If all the values
+    are replaced, the last value of the data is used.
 
-    :param data:
-    :param value:
+    :param data: data array. It is updated in place
+    :param value: limit value
+    :param offsets: (optional) start and end indexes of the datasets in data, if data contains several datasets.
+                    Each dataset is updated on its own. Default is None: data is one dataset
     :return: data with the updated values
     """
+    data = np.asarray(data)
     # collect indexes smaller than value
-    idx = [i for i, val in enumerate(data) if val <= value]
-
-    # get consecutive indexes on the list
-    indx_conseq = []
-    for k, g in groupby(enumerate(idx), lambda ix: ix[0] - ix[1]):
-        indx_conseq.append(list(map(itemgetter(1), g)))
-
-    # assigns the value of the first non-value
-    for i in indx_conseq:
-        for j in i:
-            # if the sequence contains the last index of the data use the previous one
-            if i[-1] + 1 >= len(data):
-                data[j] = data[i[0] - 1]
-            else:
-                data[j] = data[i[-1] + 1]
-
+    to_replace = data <= value
+    if not np.any(to_replace):
+        return data
+
+    if offsets is None:
+        offsets = [0, len(data)]
+    lengths = np.diff(offsets)
+    start = np.repeat(offsets[:-1], lengths)
+    end = np.repeat(offsets[1:], lengths)
+    index = np.arange(len(data))
+
+    # next and previous indexes that are not replaced
+    next_index = np.minimum.accumulate(np.where(to_replace, len(data), index)[::-1])[::-1]
+    previous_index = np.maximum.accumulate(np.where(to_replace, -1, index))
+
+    # assigns the value of the first non-value.
+    # if the sequence contains the last index of the dataset use the previous one
+    source = np.where(next_index < end, next_index, np.where(previous_index >= start, previous_index, end - 1))
+    data[to_replace] = data[source[to_replace]]
     return data
 
 
@@ -205,8 +262,7 @@ def merge_thickness(cpt_data, min_layer_thick):
     cpt_data["Fr"][cpt_data["Fr"] <= 0.1] = 0.1
     cpt_data["Fr"][cpt_data["Fr"] >= 10.] = 10.
 
-    classification = robertson.Robertson()
-    classification.soil_types()
+    classification = robertson.shared_classification()
     lithology, _ = classification.lithology(cpt_data["Qtn"], cpt_data["Fr"])
 
     depth = cpt_data["depth"]
@@ -384,7 +440,7 @@ def dump_json(jsn, index, output_folder):
     return
 
 
-def smooth(sig, window_len=10, lim=None):
+def smooth(sig, window_len=10, lim=None, offsets=None):
     r"""
     Smooth signal
 
@@ -393,9 +449,14 @@ def smooth(sig, window_len=10, lim=None):
     :param sig: original signal
     :param window_len: (optional) number of samples for the smoothing window: default 10
     :param lim: (optional) limit the minimum value of the array: default None: does not apply limit.
+    :param offsets: (optional) start and end indexes of the signals in sig, if sig contains several signals.
+                    Each signal is smoothed on its own. Default is None: sig is one signal
     :return: smoothed signal
     """
 
+    if offsets is not None:
+        return smooth_segments(sig, offsets, window_len=window_len, lim=lim)
+
     # if window length bigger that the size of the signal: window is the same size as the signal
     if window_len > len(sig):
         window_len = len(sig)
@@ -408,4 +469,78 @@ def smooth(sig, window_len=10, lim=None):
     # limit the value is exits
     if lim is not None:
         y[y < lim] = lim
-    return y[window_len - 1:-window_len + 1]
\ No newline at end of file
+    return y[window_len - 1:-window_len + 1]
+
+
+def smooth_segments(sig, offsets, window_len=10, lim=None):
+    r"""
+    Smooth the signals of a concatenated array
+
+    All signals are padded as in :func:`smooth` and convolved in one pass.
+    The signals must be longer than the window, and the window must have at least two samples.
+
+    :param sig: concatenated signals
+    :param offsets: start and end indexes of the signals in sig
+    :param window_len: (optional) number of samples for the smoothing window: default 10
+    :param lim: (optional) limit the minimum value of the array: default None: does not apply limit.
+    :return: smoothed signals
+    """
+
+    sig = np.asarray(sig, dtype=float)
+    offsets = np.asarray(offsets)
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    if window_len < 2 or np.any(lengths <= window_len):
+        raise ValueError("Signals must be longer than the smoothing window of {} samples".format(window_len))
+    y = np.empty(len(sig))
+    if len(lengths) == 0:
+        return y
+
+    # padding of the signals: reflection around the first and last samples
+    pad = window_len - 1
+    ends = starts + lengths - 1
+    left = 2 * sig[starts][:, None] - sig[starts[:, None] + np.arange(window_len, 1, -1)]
+    right = 2 * sig[ends][:, None] - sig[ends[:, None] - np.arange(pad)]
+
+    # position of the samples of the signals in the padded array
+    padded_starts = np.concatenate([[0], np.cumsum(lengths + 2 * pad)[:-1]])
+    shift = np.repeat(padded_starts + pad - starts, lengths)
+    samples = np.concatenate([np.arange(start, start + length) for start, length in zip(starts, lengths)])
+
+    s = np.empty(np.sum(lengths + 2 * pad))
+    s[padded_starts[:, None] + np.arange(pad)] = left
+    s[(padded_starts + pad + lengths)[:, None] + np.arange(pad)] = right
+    s[samples + shift] = sig[samples]
+
+    # constant window
+    w = np.ones(window_len)
+    # convolute signals
+    z = np.convolve(w / w.sum(), s, mode='same')
+    # limit the value is exits
+    if lim is not None:
+        z[z < lim] = lim
+    y[samples] = z[samples + shift]
+    return y
+
+
+def segmented_cumsum(data, offsets):
+    r"""
+    Cumulative sum of the segments of a concatenated array
+
+    The segments are placed in the rows of a zero padded array, so that each segment is summed in the same order as
+    the cumulative sum of the segment on its own.
+
+    :param data: concatenated array
+    :param offsets: start and end indexes of the segments in data
+    :return: cumulative sum of each segment
+    """
+
+    offsets = np.asarray(offsets)
+    lengths = np.diff(offsets)
+    if len(data) == 0:
+        return np.zeros(0)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    columns = np.arange(len(data)) - np.repeat(offsets[:-1], lengths)
+    padded = np.zeros((len(lengths), np.max(lengths)))
+    padded[rows, columns] = data
+    return np.cumsum(padded, axis=1)[rows, columns]
\ No newline at end of file